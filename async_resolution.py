@@ -0,0 +1,195 @@
+import sys
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple, Iterable, AsyncIterator, Callable
+import citation_normalisation as cn
+from backend_policy import rate_limiter, set_rate_limiter
+from metrics import METRICS
+
+
+# Per backend: (maximal number of concurrent requests, requests per second)
+# NCBI allows 3 requests per second without an API key, Crossref asks polite users for moderate rates.
+DEFAULT_BACKEND_LIMITS = {'MetaPub': (3, 3.0),
+						  'Crossref': (20, 20.0)}
+
+
+class resolution_engine:
+	'''
+	This class contains an asyncio based engine for the resolution of many references.
+	The blocking MetaPub and Crossref lookups from citation_normalisation are run in a shared
+	thread pool; every lookup has to wait for a free slot of its backend first. Thousands of references
+	can be in flight (waiting for their turn) while the number of threads is bounded by the sum of the
+	backend concurrency limits. While the engine is open, every HTTP request (including retries, result pages
+	and the Crossref fallback of DOI lookups) takes a token of the rate limiter of the backend it is sent to
+	(see backend_policy.rate_limiter).
+	'''
+	def __init__(self, backend_limits: Dict[str, Tuple[int, float]] = None, max_in_flight: int = 1000) -> None:
+		self.backend_limits = dict(DEFAULT_BACKEND_LIMITS)
+		if backend_limits:
+			self.backend_limits.update(backend_limits)
+		self.max_in_flight = max_in_flight
+		self._semaphores = {}
+		self._previous_rate_limiters = {}
+		for backend, (concurrency, rate) in self.backend_limits.items():
+			self._semaphores[backend] = asyncio.Semaphore(concurrency)
+			self._previous_rate_limiters[backend] = set_rate_limiter(backend, rate_limiter(rate, concurrency))
+		max_workers = sum([concurrency for concurrency, _ in self.backend_limits.values()])
+		self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+
+	async def __aenter__(self):
+		return self
+
+
+	async def __aexit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def close(self) -> None:
+		'''This function shuts down the thread pool of the engine and restores the previous rate limiters.'''
+		self._executor.shutdown(wait=True)
+		for backend, previous_limiter in self._previous_rate_limiters.items():
+			set_rate_limiter(backend, previous_limiter)
+		self._previous_rate_limiters = {}
+
+
+	async def call(self, backend: str, function: Callable, *args):
+		'''
+		This function takes a backend name, a blocking function and its arguments. It waits
+		for a free slot of the given backend, runs the function in the thread pool
+		and returns its result. If cn.SINGLE_FLIGHT is set, concurrent calls of the same function
+		with the same arguments share one call (and its requests).
+		'''
+		flight = cn.SINGLE_FLIGHT
+		if flight is None:
+			return await self._call(backend, function, *args)
+		key = (getattr(function, '__qualname__', repr(function)), cn.coalescing_key(args))
+		return await flight.do_async(backend, key, self._call, backend, function, *args)
+
+
+	async def _call(self, backend: str, function: Callable, *args):
+		'''This function runs a blocking function in the thread pool once a slot of the backend is available.
+		The requests sent by the function are rate limited per request (see backend_policy.limited_call()).'''
+		loop = asyncio.get_running_loop()
+		async with self._semaphores[backend]:
+			return await loop.run_in_executor(self._executor, functools.partial(function, *args))
+
+
+	async def retrieve(self, unstructured_publication_ID: str, only_DOI_PMID: bool = False) -> Dict:
+		'''
+		This function is the asynchronous version of cn.retrieve_info_MetaPub_Crossref(). It takes a
+		string that contains a reference to a publication and returns the raw reference dict.
+		It runs the same stages; the blocking lookups (cn.identifier_lookup() and cn.crossref_lookup())
+		are run in the thread pool once a slot of their backend is free.
+		'''
+		# The offline index and the negative cache are local and fast, they do not need a backend slot
+		finished, article_dict = cn.start_retrieval(unstructured_publication_ID, only_DOI_PMID)
+		if finished:
+			return article_dict
+		article_dict = False
+		failure_reason = 'no_candidates'
+		backend_error = False
+		DOI, PMID = cn.detect_identifiers(unstructured_publication_ID)
+		if DOI or PMID:
+			article_dict, backend_error = await self.call('MetaPub', cn.identifier_lookup, DOI, PMID)
+		if not only_DOI_PMID:
+			if not article_dict:
+				parsed_ref_dict = cn.parse_reference_str(unstructured_publication_ID)
+				if parsed_ref_dict:
+					article_dict, failure_reason = await self.call('Crossref', cn.crossref_lookup, parsed_ref_dict)
+				else:
+					failure_reason = 'no_parse'
+		return cn.finish_retrieval(unstructured_publication_ID, only_DOI_PMID, article_dict, 'backend_error' if backend_error else failure_reason)
+
+
+	async def resolve(self, ref_str: str) -> Dict:
+		'''
+		This function is the asynchronous version of cn.get_final_dict_from_ref_str(). It takes a
+		ref_str and returns a dictionary that maps it to a normalised reference str, the DOI and the PMID.
+		'''
+		with METRICS.timed('reference_seconds'):
+			ref_dict = await self.retrieve(ref_str)
+			with METRICS.timed('stage_seconds', stage='normalisation'):
+				return cn.get_final_dict_from_ref_dict(ref_dict)
+
+
+	async def map(self, coroutine_function: Callable, items: Iterable, ordered: bool = False) -> AsyncIterator[Tuple]:
+		'''
+		This function takes a coroutine function and an iterable of items. It applies the
+		coroutine function to all items (max. max_in_flight at once, the iterable is consumed lazily)
+		and yields (item, result) tuples as they complete. If ordered, the results are yielded
+		in the order of the input. If the coroutine raises an exception for an item, the error is
+		reported and the item is yielded with None as result, so that the other items are not aborted.
+		'''
+		items = iter(items)
+		pending = {}
+		next_index = 0
+		next_yield_index = 0
+		finished = {}
+		exhausted = False
+		while True:
+			# Fill up the window of references in flight
+			while not exhausted and len(pending) + len(finished) < self.max_in_flight:
+				try:
+					item = next(items)
+				except StopIteration:
+					exhausted = True
+					break
+				task = asyncio.ensure_future(coroutine_function(item))
+				pending[task] = (next_index, item)
+				next_index += 1
+			if not pending:
+				break
+			done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+			for task in done:
+				index, item = pending.pop(task)
+				result = self.task_result(task, item)
+				if ordered:
+					finished[index] = (item, result)
+				else:
+					yield item, result
+			# Yield results in input order as soon as all previous results are there
+			while next_yield_index in finished:
+				yield finished.pop(next_yield_index)
+				next_yield_index += 1
+
+
+	@staticmethod
+	def task_result(task: asyncio.Task, item) -> Dict:
+		'''This function takes a finished task and its item and returns the result of the task.
+		If the task has raised an exception, it is printed and counted and None is returned.'''
+		try:
+			return task.result()
+		except Exception as error:
+			METRICS.increment('reference_errors_total')
+			print('Could not resolve {}: {!r}'.format(item, error), file=sys.stderr)
+			return None
+
+
+	async def retrieve_many(self, refs: Iterable[str], ordered: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+		'''This function takes an iterable of reference str and yields (reference, raw reference dict) tuples
+		as they complete (see retrieve()).'''
+		async for ref, ref_dict in self.map(self.retrieve, refs, ordered):
+			yield ref, ref_dict
+
+
+	async def resolve_many(self, refs: Iterable[str], ordered: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+		'''This function takes an iterable of reference str and yields (reference, final dict) tuples
+		as they complete (see resolve()).'''
+		async for ref, final_dict in self.map(self.resolve, refs, ordered):
+			yield ref, final_dict
+
+
+async def resolve_many(refs: Iterable[str], ordered: bool = False, backend_limits: Dict[str, Tuple[int, float]] = None,
+					   max_in_flight: int = 1000) -> AsyncIterator[Tuple[str, Dict]]:
+	'''
+	This function takes an iterable of reference str and yields (reference, final dict) tuples as they
+	complete. The final dicts have the same format as the output of cn.get_final_dict_from_ref_str().
+	Example:
+	async for ref, final_dict in resolve_many(['20512739', '10.1021/ol502216j']):
+		print(ref, final_dict)
+	'''
+	async with resolution_engine(backend_limits, max_in_flight) as engine:
+		async for ref, final_dict in engine.resolve_many(refs, ordered):
+			yield ref, final_dict
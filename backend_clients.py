@@ -0,0 +1,110 @@
+import threading
+from typing import Dict
+import requests
+from requests.adapters import HTTPAdapter
+from metapub import PubMedFetcher
+
+
+class client_registry:
+	'''
+	This class contains the long-lived clients of the backends: one requests.Session with bounded
+	keep-alive connection pools for the Crossref API (shared by all threads) and one PubMedFetcher
+	per thread (reused for all MetaPub calls of that thread). The clients are created when they are
+	used for the first time (or by open()) and released by close(); the registry can be used as
+	(async) context manager. connection_statistics() shows how often connections have been reused.
+	'''
+	def __init__(self, pool_connections: int = 10, pool_maxsize: int = 20, user_agent: str = None) -> None:
+		self.pool_connections = pool_connections
+		self.pool_maxsize = pool_maxsize
+		self.user_agent = user_agent
+		self._session = None
+		self._fetchers = threading.local()
+		self._fetcher_count = 0
+		self._lock = threading.Lock()
+
+
+	def __enter__(self):
+		self.open()
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	async def __aenter__(self):
+		self.open()
+		return self
+
+
+	async def __aexit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def open(self) -> None:
+		'''This function creates the HTTP session (if it does not exist yet).'''
+		with self._lock:
+			if self._session is None:
+				session = requests.Session()
+				# The retries are handled by backend_policy.call_backend()
+				adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=0)
+				session.mount('https://', adapter)
+				session.mount('http://', adapter)
+				if self.user_agent:
+					session.headers['User-Agent'] = self.user_agent
+				self._session = session
+
+
+	def close(self) -> None:
+		'''This function closes the HTTP session with all its connections and drops the PubMedFetchers.'''
+		with self._lock:
+			if self._session is not None:
+				self._session.close()
+				self._session = None
+			self._fetchers = threading.local()
+			self._fetcher_count = 0
+
+
+	@property
+	def session(self) -> requests.Session:
+		'''The shared HTTP session (thread-safe, connections are pooled per host).'''
+		if self._session is None:
+			self.open()
+		return self._session
+
+
+	def pubmed_fetcher(self) -> PubMedFetcher:
+		'''This function returns the PubMedFetcher of the calling thread.'''
+		fetchers = self._fetchers
+		fetcher = getattr(fetchers, 'fetcher', None)
+		if fetcher is None:
+			fetcher = PubMedFetcher()
+			fetchers.fetcher = fetcher
+			with self._lock:
+				self._fetcher_count += 1
+		return fetcher
+
+
+	def connection_statistics(self) -> Dict:
+		'''
+		This function returns a dict with the number of opened connections, the number of requests sent
+		over them and the number of requests that reused an existing connection (per host and in total),
+		and the number of PubMedFetchers that have been created.
+		'''
+		statistics = {'hosts': {}, 'connections': 0, 'requests': 0, 'reused_connections': 0,
+					  'pubmed_fetchers': self._fetcher_count}
+		session = self._session
+		if session is None:
+			return statistics
+		adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+		for adapter in adapters.values():
+			for pool_key in adapter.poolmanager.pools.keys():
+				pool = adapter.poolmanager.pools[pool_key]
+				host = '{}://{}:{}'.format(pool.scheme, pool.host, pool.port)
+				statistics['hosts'][host] = {'connections': pool.num_connections,
+											 'requests': pool.num_requests,
+											 'reused_connections': pool.num_requests - pool.num_connections}
+				statistics['connections'] += pool.num_connections
+				statistics['requests'] += pool.num_requests
+		statistics['reused_connections'] = statistics['requests'] - statistics['connections']
+		return statistics
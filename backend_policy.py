@@ -0,0 +1,263 @@
+import time
+import random
+import threading
+import email.utils
+from typing import Callable
+import requests
+from metrics import METRICS
+
+
+# HTTP status codes that indicate a temporary problem of the backend
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+	'''This exception is raised if a backend is called while its circuit breaker is open.'''
+	pass
+
+
+def get_response(error: Exception) -> requests.Response:
+	'''This function takes an exception and returns the HTTP response it has been raised for (or None).'''
+	return getattr(error, 'response', None)
+
+
+def is_retryable_error(error: Exception) -> bool:
+	'''This function takes an exception raised by a backend call and returns True if the call
+	should be repeated (timeouts, connection problems, rate limits and server errors).'''
+	if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+		return True
+	response = get_response(error)
+	if response is not None and getattr(response, 'status_code', None) in RETRYABLE_STATUS_CODES:
+		return True
+	# NCBI reports exceeded rate limits in the body of the response (EutilsNCBIError)
+	return 'rate limit' in str(error).lower()
+
+
+def parse_retry_after(response: requests.Response) -> float:
+	'''
+	This function takes an HTTP response and returns the number of seconds the client should wait
+	before the next request according to its headers (or None). Retry-After (seconds or HTTP date)
+	and the Crossref rate limit headers (X-Rate-Limit-Limit requests per X-Rate-Limit-Interval) are used.
+	'''
+	if response is None or not getattr(response, 'headers', None):
+		return None
+	headers = response.headers
+	if headers.get('Retry-After'):
+		retry_after = headers['Retry-After'].strip()
+		if retry_after.isdigit():
+			return float(retry_after)
+		try:
+			return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+		except (TypeError, ValueError):
+			pass
+	if headers.get('X-Rate-Limit-Limit') and headers.get('X-Rate-Limit-Interval'):
+		try:
+			interval = float(headers['X-Rate-Limit-Interval'].strip().rstrip('s'))
+			return interval / float(headers['X-Rate-Limit-Limit'])
+		except ValueError:
+			pass
+	return None
+
+
+class retry_policy:
+	'''
+	This class contains a retry policy with exponential backoff and full jitter: before the n-th
+	repetition, a random time between 0 and min(max_delay, base_delay * 2^n) is waited. If the
+	backend has sent a Retry-After or rate limit header, at least that long is waited.
+	'''
+	def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.0, jitter: bool = True,
+				 retryable: Callable[[Exception], bool] = is_retryable_error) -> None:
+		self.max_attempts = max_attempts
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.jitter = jitter
+		self.retryable = retryable
+
+
+	def delay(self, attempt: int, error: Exception = None) -> float:
+		'''This function takes the number of failed attempts and the last exception and returns the
+		number of seconds to wait before the next attempt.'''
+		backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+		if self.jitter:
+			backoff = random.uniform(0, backoff)
+		retry_after = parse_retry_after(get_response(error))
+		if retry_after is not None:
+			backoff = max(backoff, min(retry_after, self.max_delay))
+		return backoff
+
+
+class circuit_breaker:
+	'''
+	This class contains a circuit breaker for a backend. After failure_threshold consecutive failed calls
+	(a call has failed once all its attempts have failed, see call_backend()),
+	the circuit is opened and calls are rejected (CircuitOpenError) for recovery_timeout seconds.
+	Afterwards, up to half_open_max_calls trial calls are let through: if one of them succeeds,
+	the circuit is closed again, if one fails, it is opened again.
+	'''
+	def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1) -> None:
+		self.failure_threshold = failure_threshold
+		self.recovery_timeout = recovery_timeout
+		self.half_open_max_calls = half_open_max_calls
+		self.state = 'closed'
+		self.consecutive_failures = 0
+		self.opened_at = None
+		self.half_open_calls = 0
+		self._lock = threading.Lock()
+
+
+	def allow_request(self) -> bool:
+		'''This function returns True if a call to the backend may be sent now.'''
+		with self._lock:
+			if self.state == 'open':
+				if time.monotonic() - self.opened_at < self.recovery_timeout:
+					return False
+				self.state = 'half_open'
+				self.half_open_calls = 0
+			if self.state == 'half_open':
+				if self.half_open_calls >= self.half_open_max_calls:
+					return False
+				self.half_open_calls += 1
+			return True
+
+
+	def record_success(self) -> None:
+		'''This function registers a successful call and closes the circuit.'''
+		with self._lock:
+			self.state = 'closed'
+			self.consecutive_failures = 0
+
+
+	def record_failure(self) -> bool:
+		'''This function registers a failed call. It returns True if the circuit has been opened.'''
+		with self._lock:
+			self.consecutive_failures += 1
+			if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+				opened = self.state != 'open'
+				self.state = 'open'
+				self.opened_at = time.monotonic()
+				return opened
+			return False
+
+
+	def is_open(self) -> bool:
+		'''This function returns True if calls are currently rejected.'''
+		with self._lock:
+			return self.state == 'open' and time.monotonic() - self.opened_at < self.recovery_timeout
+
+
+class rate_limiter:
+	'''
+	This class contains a thread-safe rate limiter for the requests to a backend: at most concurrency
+	requests at once (None: no limit) and a token bucket with rate requests per second (up to capacity
+	requests can be started at once). Every attempt of call_backend() takes its own slot and token.
+	'''
+	def __init__(self, rate: float, concurrency: int = None, capacity: float = None) -> None:
+		self.rate = rate
+		self.capacity = capacity if capacity else max(1.0, rate)
+		self.tokens = self.capacity
+		self.last_refill = None
+		self._lock = threading.Lock()
+		self._slots = threading.Semaphore(concurrency) if concurrency else None
+
+
+	def acquire(self) -> float:
+		'''This function waits until a slot and a token are available and consumes them.
+		It returns the number of seconds it has waited.'''
+		start = time.monotonic()
+		if self._slots is not None:
+			self._slots.acquire()
+		with self._lock:
+			while True:
+				now = time.monotonic()
+				if self.last_refill is not None:
+					self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+				self.last_refill = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return now - start
+				time.sleep((1 - self.tokens) / self.rate)
+
+
+	def release(self) -> None:
+		'''This function frees the slot of a finished request.'''
+		if self._slots is not None:
+			self._slots.release()
+
+
+# Retry policy and circuit breaker per backend (see configure_backend())
+BACKEND_POLICIES = {'MetaPub': (retry_policy(max_attempts=3, base_delay=0.5), circuit_breaker()),
+					'Crossref': (retry_policy(max_attempts=5, base_delay=0.5), circuit_breaker())}
+BACKEND_POLICIES_LOCK = threading.Lock()
+
+# Rate limiter per backend (see set_rate_limiter()); backends without a rate limiter are not limited
+BACKEND_RATE_LIMITERS = {}
+
+
+def configure_backend(backend: str, retry: retry_policy = None, breaker: circuit_breaker = None) -> None:
+	'''This function takes a backend name and sets its retry policy and/or circuit breaker.'''
+	with BACKEND_POLICIES_LOCK:
+		current_retry, current_breaker = BACKEND_POLICIES.get(backend, (retry_policy(), circuit_breaker()))
+		BACKEND_POLICIES[backend] = (retry or current_retry, breaker or current_breaker)
+
+
+def set_rate_limiter(backend: str, limiter: rate_limiter) -> rate_limiter:
+	'''This function takes a backend name and a rate_limiter (or None to switch rate limiting off) and uses it
+	for all following requests to the backend. It returns the previous rate limiter of the backend.'''
+	with BACKEND_POLICIES_LOCK:
+		previous_limiter = BACKEND_RATE_LIMITERS.pop(backend, None)
+		if limiter is not None:
+			BACKEND_RATE_LIMITERS[backend] = limiter
+	return previous_limiter
+
+
+def limited_call(backend: str, function: Callable, *args, **kwargs):
+	'''This function takes a backend name, a function that sends one request to the backend and its arguments.
+	It waits for a slot and a token of the rate limiter of the backend (if it has one), calls the function
+	and returns its result.'''
+	limiter = BACKEND_RATE_LIMITERS.get(backend)
+	if limiter is None:
+		return function(*args, **kwargs)
+	# Time spent waiting for the concurrency limit and the rate limit
+	METRICS.observe('backend_queue_seconds', limiter.acquire(), backend=backend)
+	try:
+		return function(*args, **kwargs)
+	finally:
+		limiter.release()
+
+
+def call_backend(backend: str, function: Callable, *args, **kwargs):
+	'''
+	This function takes a backend name, a function that sends a request to the backend and its
+	arguments. It calls the function and returns its result. Temporary errors (see is_retryable_error())
+	are retried according to the retry policy of the backend; the circuit breaker counts one failure per call
+	that has exhausted its attempts. If the circuit breaker is open, CircuitOpenError is raised without calling
+	the function (or instead of the next retry if other calls have opened it in the meantime).
+	Every attempt waits for the rate limiter of the backend (see limited_call()).
+	Other exceptions (eg. "not found") are raised immediately.
+	'''
+	policy, breaker = BACKEND_POLICIES[backend]
+	if not breaker.allow_request():
+		METRICS.increment('backend_rejected_total', backend=backend)
+		raise CircuitOpenError('The circuit breaker of {} is open'.format(backend))
+	attempt = 0
+	while True:
+		attempt += 1
+		try:
+			result = limited_call(backend, function, *args, **kwargs)
+		except Exception as error:
+			if not policy.retryable(error):
+				# The backend has answered, the request itself is the problem
+				breaker.record_success()
+				raise
+			if attempt >= policy.max_attempts:
+				if breaker.record_failure():
+					METRICS.increment('circuit_breaker_opened_total', backend=backend)
+				raise
+			if breaker.is_open():
+				METRICS.increment('backend_rejected_total', backend=backend)
+				raise CircuitOpenError('The circuit breaker of {} is open'.format(backend)) from error
+			METRICS.increment('backend_retries_total', backend=backend)
+			time.sleep(policy.delay(attempt, error))
+			continue
+		breaker.record_success()
+		return result
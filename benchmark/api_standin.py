@@ -0,0 +1,211 @@
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Tuple
+
+
+# Query parameters that do not change the response and are ignored when requests are matched with fixtures
+VOLATILE_PARAMS = {'mailto', 'tool', 'email', 'api_key'}
+
+# Upstream APIs for the record mode (by path prefix)
+UPSTREAM_URLS = {'/works': 'https://api.crossref.org',
+				 '/entrez': 'https://eutils.ncbi.nlm.nih.gov',
+				 '/pmc': 'https://www.ncbi.nlm.nih.gov'}
+
+# Responses for search requests without a fixture (other requests get a 404)
+EMPTY_RESPONSES = {'/works': (200, 'application/json', json.dumps({'status': 'ok', 'message': {'items': [], 'total-results': 0}})),
+				   '/entrez/eutils/esearch.fcgi': (200, 'text/xml', '<eSearchResult><Count>0</Count><IdList></IdList></eSearchResult>'),
+				   '/entrez/eutils/efetch.fcgi': (200, 'text/xml', '<PubmedArticleSet></PubmedArticleSet>'),
+				   '/pmc/utils/idconv/v1.0/': (200, 'text/xml', '<pmcids status="ok"><record status="error" errmsg="Identifier not found in PMC"/></pmcids>')}
+
+
+def request_params(query: str) -> Dict[str, str]:
+	'''This function takes a (form-encoded) query str and returns a dict of its parameters without the volatile parameters.'''
+	return {key: value for key, value in urllib.parse.parse_qsl(query, keep_blank_values=True) if key not in VOLATILE_PARAMS}
+
+
+class api_standin:
+	'''
+	This class contains a local HTTP stand-in for the Crossref API, the NCBI E-utilities and the PMC ID converter that serves
+	recorded responses from a fixture file (JSONL, one response per line with the keys "path", "params",
+	"status", "content_type" and "body"). A fixture is served for a request to its path if all its
+	params are in the request (a fixture without params is the default for its path).
+	Other requests get an empty result, or are forwarded to the real API and recorded if record is True.
+	A configurable latency (+ jitter) is added to every response and errors (503 with Retry-After) can
+	be injected with a given probability. All requests are counted per path.
+	'''
+	def __init__(self, fixture_path: str = None, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+				 record: bool = False, host: str = '127.0.0.1', port: int = 0) -> None:
+		self.fixture_path = fixture_path
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.record = record
+		self.fixtures = {}
+		self.request_counts = {}
+		self._lock = threading.Lock()
+		if fixture_path:
+			self.load_fixtures(fixture_path)
+		standin = self
+
+		class request_handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			# Headers and body are written separately, without TCP_NODELAY keep-alive responses are delayed
+			disable_nagle_algorithm = True
+
+			def do_GET(self):
+				standin.handle(self)
+
+			def do_POST(self):
+				standin.handle(self)
+
+			def log_message(self, format, *args):
+				pass
+
+		self.server = ThreadingHTTPServer((host, port), request_handler)
+		self.server.daemon_threads = True
+		self.url = 'http://{}:{}'.format(*self.server.server_address)
+		self._thread = None
+
+
+	def __enter__(self):
+		self.start()
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.stop()
+
+
+	def load_fixtures(self, fixture_path: str) -> None:
+		'''This function reads the fixtures from the JSONL file at fixture_path.'''
+		try:
+			with open(fixture_path, 'r') as fixture_file:
+				for line in fixture_file:
+					if line.strip():
+						fixture = json.loads(line)
+						self.add_fixture(fixture['path'], fixture.get('params', {}), fixture.get('status', 200),
+										 fixture.get('content_type', 'application/json'), fixture['body'])
+		except FileNotFoundError:
+			if not self.record:
+				raise
+
+
+	def add_fixture(self, path: str, params: Dict[str, str], status: int, content_type: str, body: str) -> None:
+		'''This function registers a response for the requests to path that contain the given params.'''
+		with self._lock:
+			path_fixtures = self.fixtures.setdefault(path, [])
+			path_fixtures.append((params, (status, content_type, body)))
+			# Fixtures with more params are more specific and are checked first
+			path_fixtures.sort(key=lambda fixture: -len(fixture[0]))
+
+
+	def start(self) -> None:
+		'''This function starts serving requests in a background thread.'''
+		self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self._thread.start()
+
+
+	def stop(self) -> None:
+		'''This function stops the server.'''
+		self.server.shutdown()
+		self.server.server_close()
+
+
+	def reset_counts(self) -> None:
+		'''This function resets the request counters.'''
+		with self._lock:
+			self.request_counts = {}
+
+
+	def total_requests(self) -> int:
+		'''This function returns the total number of served requests.'''
+		with self._lock:
+			return sum(self.request_counts.values())
+
+
+	def get_response(self, path: str, query: str) -> Tuple[int, str, str]:
+		'''This function takes the path and the (form-encoded) query of a request and returns a
+		(status, content type, body) tuple.'''
+		params = request_params(query)
+		for fixture_params, response in self.fixtures.get(path, []):
+			if not self.record or fixture_params:
+				if all(params.get(key) == value for key, value in fixture_params.items()):
+					return response
+		if self.record:
+			return self.record_response(path, params)
+		if path in EMPTY_RESPONSES.keys():
+			return EMPTY_RESPONSES[path]
+		return (404, 'application/json', json.dumps({'status': 'error', 'message': 'Resource not found.'}))
+
+
+	def record_response(self, path: str, params: Dict[str, str]) -> Tuple[int, str, str]:
+		'''This function forwards a request to the real API, saves the response as fixture and returns it.'''
+		upstream_url = [url for prefix, url in UPSTREAM_URLS.items() if path.startswith(prefix)][0]
+		try:
+			with urllib.request.urlopen(upstream_url + path + '?' + urllib.parse.urlencode(params), timeout=60) as upstream_response:
+				response = (upstream_response.status, upstream_response.headers.get('Content-Type'), upstream_response.read().decode('utf-8'))
+		except urllib.error.HTTPError as error:
+			response = (error.code, error.headers.get('Content-Type'), error.read().decode('utf-8'))
+		self.add_fixture(path, params, *response)
+		with self._lock:
+			with open(self.fixture_path, 'a') as fixture_file:
+				fixture_file.write(json.dumps({'path': path, 'params': params, 'status': response[0],
+											   'content_type': response[1], 'body': response[2]}) + '\n')
+		return response
+
+
+	def handle(self, request: BaseHTTPRequestHandler) -> None:
+		'''This function answers a request (called by the request handler threads).'''
+		path, _, query = request.path.partition('?')
+		# E-utilities requests can be sent as form-encoded POST requests
+		content_length = int(request.headers.get('Content-Length') or 0)
+		if content_length:
+			query = '&'.join([part for part in [query, request.rfile.read(content_length).decode('utf-8')] if part])
+		path = urllib.parse.unquote(path)
+		with self._lock:
+			self.request_counts[path] = self.request_counts.get(path, 0) + 1
+		if self.latency or self.jitter:
+			time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+		if self.error_rate and random.random() < self.error_rate:
+			status, content_type, body = 503, 'text/plain', 'Service temporarily unavailable'
+			extra_headers = {'Retry-After': '1'}
+		else:
+			status, content_type, body = self.get_response(path, query)
+			extra_headers = {}
+		body = body.encode('utf-8')
+		request.send_response(status)
+		request.send_header('Content-Type', content_type)
+		request.send_header('Content-Length', str(len(body)))
+		for header, value in extra_headers.items():
+			request.send_header(header, value)
+		request.end_headers()
+		request.wfile.write(body)
+
+
+def main():
+	argument_parser = argparse.ArgumentParser(description='Local stand-in for the Crossref API and the NCBI E-utilities.')
+	argument_parser.add_argument('--fixtures', help='JSONL file with recorded responses')
+	argument_parser.add_argument('--port', type=int, default=8765)
+	argument_parser.add_argument('--latency', type=float, default=0.0, help='Latency per response in seconds')
+	argument_parser.add_argument('--jitter', type=float, default=0.0, help='Maximal deviation from the latency in seconds')
+	argument_parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of a 503 response')
+	argument_parser.add_argument('--record', action='store_true', help='Forward unknown requests to the real APIs and save them')
+	args = argument_parser.parse_args()
+	standin = api_standin(args.fixtures, args.latency, args.jitter, args.error_rate, args.record, port=args.port)
+	print('Serving on {}'.format(standin.url))
+	try:
+		standin.server.serve_forever()
+	except KeyboardInterrupt:
+		print(json.dumps(standin.request_counts, indent=2))
+		standin.server.server_close()
+
+
+if __name__ == '__main__':
+	main()
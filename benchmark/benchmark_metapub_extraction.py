@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import tracemalloc
+from typing import Dict, Callable, List
+from metapub import PubMedArticle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import citation_normalisation as cn
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.join(BENCHMARK_DIR, 'fixtures', 'api_responses.jsonl')
+
+
+def legacy_article_dict(article: PubMedArticle) -> Dict:
+	'''This function contains the former extraction (all public attributes via dir() and eval()) for comparison.'''
+	article_dict = {}
+	for info in dir(article):
+		if info[0] != '_':
+			article_dict[info] = eval('article.' + info)
+	return article_dict
+
+
+def read_pubmed_xml(fixture_path: str) -> List[bytes]:
+	'''This function reads the EFetch responses from a fixture file of the API stand-in and returns
+	the XML of all PubmedArticle records in them.'''
+	from lxml import etree
+	records = []
+	with open(fixture_path, 'r') as fixture_file:
+		for line in fixture_file:
+			fixture = json.loads(line)
+			if fixture['path'].endswith('efetch.fcgi'):
+				root = etree.fromstring(fixture['body'].encode('utf-8'))
+				records += [b'<PubmedArticleSet>' + etree.tostring(record) + b'</PubmedArticleSet>' for record in root.findall('PubmedArticle')]
+	return records
+
+
+def measure(extract: Callable, records: List[bytes], repeat: int) -> Dict:
+	'''This function takes an extraction function and a list of PubMed XML records. Every record is parsed
+	into a fresh PubMedArticle (so that no lazily computed attribute is reused) and extracted repeat times.
+	It returns the CPU time per record (microseconds, without the parsing) and the size of the results.'''
+	extraction_time = 0.0
+	for _ in range(repeat):
+		for record in records:
+			article = PubMedArticle(record)
+			start = time.process_time()
+			extract(article)
+			extraction_time += time.process_time() - start
+	# Memory of the extracted dicts (allocated while extracting) and size of their str() in the output files
+	articles = [PubMedArticle(record) for record in records]
+	tracemalloc.start()
+	article_dicts = [extract(article) for article in articles]
+	allocated, _ = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return {'microseconds_per_record': round(extraction_time / (repeat * len(records)) * 1e6, 2),
+			'allocated_bytes_per_record': allocated // len(records),
+			'output_bytes_per_record': sum([len(str(article_dict)) for article_dict in article_dicts]) // len(records),
+			'pickled_bytes_per_record': sum([len(pickle.dumps(article_dict)) for article_dict in article_dicts]) // len(records)
+										if all([is_picklable(article_dict) for article_dict in article_dicts]) else None,
+			'keys': len(article_dicts[0])}
+
+
+def is_picklable(article_dict: Dict) -> bool:
+	'''This function returns True if a dict can be pickled (the legacy dicts contain bound methods etc.).'''
+	try:
+		pickle.dumps(article_dict)
+		return True
+	except Exception:
+		return False
+
+
+def main():
+	argument_parser = argparse.ArgumentParser(description='Micro-benchmark of the extraction of metapub article dicts.')
+	argument_parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='Fixture file with EFetch responses')
+	argument_parser.add_argument('--repeat', type=int, default=1000)
+	args = argument_parser.parse_args()
+	records = read_pubmed_xml(args.fixtures)
+	results = {'records': len(records),
+			   'legacy (dir + eval)': measure(legacy_article_dict, records, args.repeat),
+			   'selected fields (getattr)': measure(cn.get_metapub_article_dict, records, args.repeat)}
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+	main()
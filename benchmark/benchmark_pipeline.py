@@ -0,0 +1,237 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import urllib.parse
+from typing import Dict, List
+import requests
+from api_standin import api_standin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import citation_normalisation as cn
+import async_resolution as ar
+from metrics import METRICS
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.join(BENCHMARK_DIR, 'fixtures', 'api_responses.jsonl')
+DEFAULT_SAMPLE = os.path.join(BENCHMARK_DIR, 'fixtures', 'coconut_sample.txt')
+
+
+class UnexpectedHostError(RuntimeError):
+	'''This exception is raised if the benchmark sends a request to another host than the stand-in.'''
+	pass
+
+
+class host_guard:
+	'''
+	This class contains a guard for the benchmark: while it is active (context manager), requests
+	(the HTTP library used for Crossref and by metapub) may only be sent to the stand-in. Requests to other
+	hosts are refused with UnexpectedHostError and remembered, so that check() fails even if the pipeline
+	has caught the error.
+	'''
+	def __init__(self, standin_url: str) -> None:
+		self.netloc = urllib.parse.urlsplit(standin_url).netloc
+		self.blocked_urls = []
+		self._send = None
+
+
+	def __enter__(self):
+		self._send = requests.adapters.HTTPAdapter.send
+		guard = self
+
+		def guarded_send(adapter, request, *args, **kwargs):
+			if urllib.parse.urlsplit(request.url).netloc != guard.netloc:
+				guard.blocked_urls.append(request.url)
+				raise UnexpectedHostError('Request to {} instead of the stand-in'.format(request.url))
+			return guard._send(adapter, request, *args, **kwargs)
+		requests.adapters.HTTPAdapter.send = guarded_send
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		requests.adapters.HTTPAdapter.send = self._send
+
+
+	def check(self) -> None:
+		'''This function raises UnexpectedHostError if a request has been sent to another host than the stand-in.'''
+		if self.blocked_urls:
+			raise UnexpectedHostError('{} requests were sent to other hosts than the stand-in, eg. {}'.format(
+				len(self.blocked_urls), self.blocked_urls[0]))
+
+
+def replace_host(url: str, standin_url: str) -> str:
+	'''This function takes a URL and returns it with the scheme and host of the stand-in.'''
+	return re.sub('^https?://[^/]+', standin_url, url)
+
+
+def redirect_backends(standin_url: str) -> None:
+	'''
+	This function takes the URL of the local stand-in and sends all Crossref, NCBI E-utilities and PMC ID
+	converter requests of citation_normalisation there. The E-utilities client of the installed metapub
+	version is redirected (NCBIClient for metapub >= 0.6, the eutils package for older versions).
+	The response cache is switched off.
+	'''
+	cn.CROSSREF_API_URL = standin_url
+	cn.set_response_cache(None)
+	# Start with a fresh connection pool
+	cn.CLIENTS.close()
+	redirected = False
+	try:
+		from metapub import ncbi_client
+		ncbi_client.NCBIClient.BASE_URL = replace_host(ncbi_client.NCBIClient.BASE_URL, standin_url)
+		redirected = True
+	except ImportError:
+		pass
+	try:
+		from eutils._internal import queryservice
+		if hasattr(queryservice, 'url_base'):
+			queryservice.url_base = replace_host(queryservice.url_base, standin_url)
+			redirected = True
+	except ImportError:
+		pass
+	if not redirected:
+		raise UnexpectedHostError('The E-utilities client of the installed metapub version cannot be redirected')
+	# DOI lookups of metapub go through the PMC ID converter (www.ncbi.nlm.nih.gov)
+	from metapub import pubmedcentral
+	if hasattr(pubmedcentral, 'PMC_ID_CONVERSION_URI'):
+		pubmedcentral.PMC_ID_CONVERSION_URI = replace_host(pubmedcentral.PMC_ID_CONVERSION_URI, standin_url)
+
+
+def read_sample(sample_path: str, repeat: int = 1) -> List[str]:
+	'''This function reads a file with one reference str per line and returns them repeat times as list.'''
+	with open(sample_path, 'r') as sample_file:
+		references = [line.rstrip('\n') for line in sample_file if line.strip()]
+	return references * repeat
+
+
+def percentile(values: List[float], percent: float) -> float:
+	'''This function takes a list of values and returns the given percentile (nearest rank).'''
+	if not values:
+		return 0.0
+	values = sorted(values)
+	index = max(0, int(round(percent / 100 * len(values) + 0.5)) - 1)
+	return values[min(index, len(values) - 1)]
+
+
+def run_sequential(references: List[str]) -> List[float]:
+	'''This function resolves the references one after another with cn.get_final_dict_from_ref_str()
+	and returns the list of latencies.'''
+	latencies = []
+	for reference in references:
+		start = time.perf_counter()
+		cn.get_final_dict_from_ref_str(reference)
+		latencies.append(time.perf_counter() - start)
+	return latencies
+
+
+def run_async(references: List[str], max_in_flight: int) -> List[float]:
+	'''This function resolves the references with async_resolution.resolution_engine and returns the list of
+	latencies (from the start of the resolution of a reference until its result is there).'''
+	latencies = []
+
+	async def resolve_all() -> None:
+		async with ar.resolution_engine(max_in_flight=max_in_flight) as engine:
+			async def timed_resolve(reference: str) -> Dict:
+				start = time.perf_counter()
+				final_dict = await engine.resolve(reference)
+				latencies.append(time.perf_counter() - start)
+				return final_dict
+			async for _ in engine.map(timed_resolve, references):
+				pass
+	asyncio.run(resolve_all())
+	return latencies
+
+
+def run_coordination(references: List[str]) -> List[float]:
+	'''This function runs retrieve_COCONUT_references.retrieval_coordination() on a temporary COCONUT
+	csv file with the references (in a temporary working directory). Repeated references are only
+	resolved once (like in the real run). Only the total time is known, it is returned as one latency.'''
+	import retrieve_COCONUT_references as rCr
+	working_directory = os.getcwd()
+	with tempfile.TemporaryDirectory() as temporary_directory:
+		csv_path = os.path.join(temporary_directory, 'COCONUT_references.csv')
+		with open(csv_path, 'w') as csv_file:
+			csv_file.write('coconut_id,citationDOI\n')
+			for index, reference in enumerate(references):
+				csv_file.write('CNP{},"{}"\n'.format(index, str([reference]).replace('"', '""')))
+		os.chdir(temporary_directory)
+		try:
+			start = time.perf_counter()
+			rCr.retrieval_coordination(csv_path)
+			return [time.perf_counter() - start]
+		finally:
+			os.chdir(working_directory)
+
+
+def benchmark(references: List[str], mode: str = 'sequential', fixture_path: str = DEFAULT_FIXTURES, latency: float = 0.0,
+			  jitter: float = 0.0, error_rate: float = 0.0, max_in_flight: int = 100) -> Dict:
+	'''
+	This function takes a list of reference str and resolves them against the local stand-in with
+	the given mode ('sequential', 'async' or 'coordination'), latency and error rate.
+	It returns a dict with references/sec, p50/p99 latency (seconds) and API calls per reference.
+	If a request is sent to another host than the stand-in, UnexpectedHostError is raised.
+	'''
+	with api_standin(fixture_path, latency, jitter, error_rate) as standin, host_guard(standin.url) as guard:
+		redirect_backends(standin.url)
+		if cn.SINGLE_FLIGHT is not None:
+			cn.SINGLE_FLIGHT.reset_statistics()
+		start = time.perf_counter()
+		if mode == 'sequential':
+			latencies = run_sequential(references)
+		elif mode == 'async':
+			latencies = run_async(references, max_in_flight)
+		elif mode == 'coordination':
+			latencies = run_coordination(references)
+		else:
+			raise ValueError('Unknown mode: {}'.format(mode))
+		duration = time.perf_counter() - start
+		guard.check()
+		request_counts = dict(standin.request_counts)
+		connection_statistics = cn.CLIENTS.connection_statistics()
+	api_calls = sum(request_counts.values())
+	return {'mode': mode,
+			'references': len(references),
+			'seconds': round(duration, 3),
+			'references_per_second': round(len(references) / duration, 2) if duration else None,
+			'p50_latency': round(percentile(latencies, 50), 4) if mode != 'coordination' else None,
+			'p99_latency': round(percentile(latencies, 99), 4) if mode != 'coordination' else None,
+			'api_calls': api_calls,
+			'api_calls_per_reference': round(api_calls / len(references), 2) if references else None,
+			'api_calls_per_path': request_counts,
+			'connections_opened': connection_statistics['connections'],
+			'reused_connections': connection_statistics['reused_connections'],
+			'coalesced_calls': cn.SINGLE_FLIGHT.statistics() if cn.SINGLE_FLIGHT is not None else None}
+
+
+def main():
+	argument_parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of the reference resolution.')
+	argument_parser.add_argument('--sample', default=DEFAULT_SAMPLE, help='File with one reference str per line')
+	argument_parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='JSONL file with recorded responses')
+	argument_parser.add_argument('--mode', default='sequential', choices=['sequential', 'async', 'coordination'])
+	argument_parser.add_argument('--repeat', type=int, default=1, help='Number of times the sample is resolved')
+	argument_parser.add_argument('--latency', type=float, default=0.0, help='Latency per response in seconds')
+	argument_parser.add_argument('--jitter', type=float, default=0.0, help='Maximal deviation from the latency in seconds')
+	argument_parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of a 503 response')
+	argument_parser.add_argument('--max-in-flight', type=int, default=100, help='References in flight (async mode)')
+	argument_parser.add_argument('--output', help='Write the results as JSON to this file')
+	argument_parser.add_argument('--metrics', help='Record the pipeline metrics and write them as JSON to this file')
+	args = argument_parser.parse_args()
+	if args.metrics:
+		METRICS.enable()
+	references = read_sample(args.sample, args.repeat)
+	results = benchmark(references, args.mode, args.fixtures, args.latency, args.jitter, args.error_rate, args.max_in_flight)
+	print(json.dumps(results, indent=2))
+	if args.output:
+		with open(args.output, 'w') as output:
+			json.dump(results, output, indent=2)
+	if args.metrics:
+		METRICS.save(args.metrics)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,165 @@
+import os
+import time
+import queue
+import threading
+from typing import Dict
+from metrics import METRICS
+from result_files import dumps, loads, is_jsonl
+
+
+class checkpoint_store:
+	'''
+	This class contains a checkpoint store for the raw retrieval output files (one line per reference).
+	If the path ends with .jsonl, every line is a JSON object {"reference": reference str, "result": retrieved dict}
+	(see result_files.iter_raw_results() for reading them), otherwise the former format
+	(reference str + tab + str(retrieved dict)) is written. The references that already are in the file are read once
+	and kept in a set, so that "already retrieved?" is answered in O(1). New lines are written by a
+	single background writer thread in batches, so that many threads can add results without locking.
+	The writer flushes after flush_every lines or flush_interval seconds, whatever comes first.
+	If fsync is True, every batch is also synced to disk.
+	If the writer thread cannot format or write a line, it keeps running and the error is raised by the next
+	call of add(), flush() or close() (references whose line could not be formatted are not in the store).
+	When the store is opened, an incomplete last line (eg. after a crash) is removed so that the
+	retrieval can simply be restarted.
+	'''
+	def __init__(self, path: str, flush_every: int = 100, flush_interval: float = 5.0, fsync: bool = False) -> None:
+		self.path = os.path.normpath(path)
+		self.flush_every = flush_every
+		self.flush_interval = flush_interval
+		self.fsync = fsync
+		self.jsonl = is_jsonl(self.path)
+		self._keys = set()
+		self._keys_lock = threading.Lock()
+		self._queue = queue.Queue()
+		self._error = None
+		self._load()
+		self._output = open(self.path, 'a', encoding='utf-8')
+		self._writer = threading.Thread(target=self._write_batches, daemon=True)
+		self._writer.start()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def __contains__(self, reference: str) -> bool:
+		return reference in self._keys
+
+
+	def __len__(self) -> int:
+		return len(self._keys)
+
+
+	def _load(self) -> None:
+		'''This function reads the references that already are in the file and cuts off an incomplete last line.'''
+		if not os.path.exists(self.path):
+			return
+		complete_size = 0
+		with open(self.path, 'rb') as output:
+			for line in output:
+				if not line.endswith(b'\n'):
+					break
+				complete_size += len(line)
+				if self.jsonl:
+					self._keys.add(loads(line)['reference'])
+				else:
+					self._keys.add(line.decode('utf-8').split('\t')[0])
+		if complete_size != os.path.getsize(self.path):
+			with open(self.path, 'r+b') as output:
+				output.truncate(complete_size)
+
+
+	def add(self, reference: str, ref_dict: Dict) -> bool:
+		'''
+		This function takes a reference str and the corresponding retrieved dict and queues
+		it for writing. It returns False (and does not write anything) if the reference is
+		already in the store. If the writer thread has failed since the last call, its error is raised.
+		'''
+		self._raise_writer_error()
+		with self._keys_lock:
+			if reference in self._keys:
+				return False
+			self._keys.add(reference)
+		# The lines are serialised by the writer thread
+		self._queue.put((reference, ref_dict))
+		return True
+
+
+	def _format_line(self, reference: str, ref_dict: Dict) -> str:
+		'''This function takes a reference str and the corresponding retrieved dict and returns the line for the file.'''
+		if self.jsonl:
+			return dumps({'reference': reference, 'result': ref_dict}) + '\n'
+		return reference + '\t' + str(ref_dict) + '\n'
+
+
+	def _raise_writer_error(self) -> None:
+		'''This function raises the error of the writer thread (if there is one) and resets it.'''
+		error, self._error = self._error, None
+		if error is not None:
+			raise error
+
+
+	def _write_batches(self) -> None:
+		'''This function is run by the writer thread and writes the queued lines in batches.
+		Errors are kept for the caller (see _raise_writer_error()), the file is closed when the thread ends.'''
+		try:
+			closed = False
+			while not closed:
+				batch = []
+				entries = 0
+				deadline = None
+				while entries < self.flush_every:
+					timeout = None if deadline is None else max(0, deadline - time.monotonic())
+					try:
+						entry = self._queue.get(timeout=timeout)
+					except queue.Empty:
+						break
+					entries += 1
+					if entry is None:
+						closed = True
+						break
+					try:
+						batch.append(self._format_line(*entry))
+					except Exception as error:
+						# The reference has not been saved, so it can be retrieved again
+						with self._keys_lock:
+							self._keys.discard(entry[0])
+						self._error = error
+					# The batch is written flush_interval seconds after its first line at the latest
+					if deadline is None:
+						deadline = time.monotonic() + self.flush_interval
+				try:
+					if batch:
+						with METRICS.timed('stage_seconds', stage='file_write'):
+							self._output.write(''.join(batch))
+							self._output.flush()
+							if self.fsync:
+								os.fsync(self._output.fileno())
+						METRICS.increment('checkpoint_lines_written_total', len(batch))
+				except Exception as error:
+					self._error = error
+				finally:
+					for _ in range(entries):
+						self._queue.task_done()
+		finally:
+			self._output.close()
+
+
+	def flush(self) -> None:
+		'''This function blocks until all queued lines have been written. If the writer thread has failed,
+		its error is raised.'''
+		self._queue.join()
+		self._raise_writer_error()
+
+
+	def close(self) -> None:
+		'''This function writes all queued lines, stops the writer thread and closes the file.
+		If the writer thread has failed, its error is raised.'''
+		if self._writer.is_alive():
+			self._queue.put(None)
+			self._writer.join()
+		self._raise_writer_error()
@@ -1,16 +1,190 @@
 import sys
 import os
 import re
-from typing import List, Tuple, Dict
+import ast
+import json
+import inspect
+import functools
+import urllib.parse
+import threading
+from typing import List, Tuple, Dict, Iterable, Iterator
 import requests
 from json.decoder import JSONDecodeError
 from eutils._internal.exceptions import EutilsNCBIError
-from metapub import PubMedFetcher
+from lxml import etree
+from metapub import PubMedFetcher, PubMedArticle
 from metapub.exceptions import MetaPubError
 from scholarly import scholarly
 from scholarly._navigator import MaxTriesExceededException
-from crossref.restful import Works
 import reference_parser as rp
+from response_cache import response_cache
+from negative_cache import negative_cache
+from journal_index import journal_index
+from local_index import local_index
+from metrics import METRICS
+from backend_policy import call_backend, is_retryable_error, CircuitOpenError
+from backend_clients import client_registry
+from normalized_reference import normalized_reference
+from single_flight import single_flight
+from result_files import dumps
+
+
+# Persistent cache for the DOI, PMID and Crossref lookups (see response_cache.py).
+# It is switched off if RESPONSE_CACHE is None. Set the environment variable
+# CITATION_NORMALISATION_CACHE to a file path or call set_response_cache() to use it.
+RESPONSE_CACHE = None
+if os.environ.get('CITATION_NORMALISATION_CACHE'):
+	RESPONSE_CACHE = response_cache(os.environ['CITATION_NORMALISATION_CACHE'])
+
+
+# Persistent cache of the references that could not be resolved and why (see negative_cache.py).
+# Failed references are skipped until the retry-after period of their failure reason has passed.
+# It is switched off if NEGATIVE_CACHE is None. Set the environment variable
+# CITATION_NORMALISATION_NEGATIVE_CACHE to a file path or call set_negative_cache() to use it.
+NEGATIVE_CACHE = None
+if os.environ.get('CITATION_NORMALISATION_NEGATIVE_CACHE'):
+	NEGATIVE_CACHE = negative_cache(os.environ['CITATION_NORMALISATION_NEGATIVE_CACHE'])
+
+
+# Index of journal titles and abbreviations used by journal_name_match() (see journal_index.py).
+# Confirmed matches are learned during the run, a saved index can be loaded with JOURNAL_INDEX.load(path).
+JOURNAL_INDEX = journal_index()
+
+# Offline bibliographic index built from a Crossref/PubMed dump (see local_index.py). If it is set,
+# retrieve_info_MetaPub_Crossref() looks references up in the index before the network is used
+# (or instead of the network if LOCAL_INDEX_ONLY is True).
+LOCAL_INDEX = None
+LOCAL_INDEX_ONLY = False
+
+# Base URL and timeout (seconds) of the Crossref REST API
+CROSSREF_API_URL = 'https://api.crossref.org'
+CROSSREF_TIMEOUT = 30
+
+# If CROSSREF_FIELD_PROJECTION is True, Crossref only returns the fields of the work records that
+# normalize_crossref_dict() uses (select parameter) instead of the full records with reference lists etc.
+CROSSREF_FIELD_PROJECTION = False
+CROSSREF_SELECT_FIELDS = ['DOI', 'title', 'issue', 'volume', 'issued', 'type', 'container-title', 'author', 'page']
+
+# Exceptions that mean that a backend could not be reached (outages, exhausted retries, open circuit breakers).
+# get_info_by_DOI() and get_info_by_PMID() raise them instead of returning an empty result, so that the
+# reference is recorded as backend_error and not as unresolvable (see record_retrieval_outcome()).
+BACKEND_ERRORS = (EutilsNCBIError, CircuitOpenError, requests.exceptions.RequestException)
+
+# Attributes of the metapub PubMedArticles that are used for the normalisation (see normalize_metapub_dict())
+METAPUB_FIELDS = ['pmid', 'doi', 'title', 'authors', 'journal', 'year', 'volume', 'issue', 'pages', 'first_page']
+
+# Single-flight layer: concurrent lookups of the same DOI, PMID or Crossref query share one request
+# (see single_flight.py and SINGLE_FLIGHT.statistics()). It is switched off if SINGLE_FLIGHT is None.
+SINGLE_FLIGHT = single_flight()
+
+# Long-lived backend clients (pooled HTTP session for Crossref, PubMedFetcher per thread, see backend_clients.py)
+CLIENTS = client_registry()
+
+# Number of requests, transferred bytes and resolved references (see get_crossref_transfer_statistics())
+CROSSREF_TRANSFER_STATISTICS = {'requests': 0, 'bytes': 0, 'references': 0}
+CROSSREF_TRANSFER_STATISTICS_LOCK = threading.Lock()
+
+# Number of result pages fetched by crossrefAPI_improved_query() (see get_crossref_page_statistics())
+CROSSREF_PAGE_STATISTICS = {'references': 0, 'pages': 0, 'max_pages': 0}
+CROSSREF_PAGE_STATISTICS_LOCK = threading.Lock()
+
+
+def set_response_cache(cache: response_cache) -> None:
+	'''This function takes a response_cache instance (or None to switch caching off) and
+	uses it for all following DOI, PMID and Crossref lookups.'''
+	global RESPONSE_CACHE
+	RESPONSE_CACHE = cache
+
+
+def set_negative_cache(cache: negative_cache) -> None:
+	'''This function takes a negative_cache instance (or None to switch it off) and uses it in
+	retrieve_info_MetaPub_Crossref() and async_resolution.resolution_engine.retrieve().'''
+	global NEGATIVE_CACHE
+	NEGATIVE_CACHE = cache
+
+
+def set_single_flight(flight: single_flight) -> None:
+	'''This function takes a single_flight instance (or None to switch coalescing off) and uses it
+	for all following DOI, PMID and Crossref lookups.'''
+	global SINGLE_FLIGHT
+	SINGLE_FLIGHT = flight
+
+
+def coalescing_key(args: Tuple, kwargs: Dict = None) -> str:
+	'''This function takes the arguments of a lookup and returns the key under which concurrent
+	identical lookups are coalesced (dicts are serialised with sorted keys).'''
+	return json.dumps([args, kwargs or {}], sort_keys=True, default=str)
+
+
+def coalesced_lookup(backend: str):
+	'''
+	This decorator takes a backend name and wraps a lookup function. If SINGLE_FLIGHT is set, concurrent
+	calls with the same arguments (see coalescing_key()) wait for the call in flight and share its result.
+	'''
+	def decorator(lookup_function):
+		@functools.wraps(lookup_function)
+		def coalesced_lookup_function(*args, **kwargs):
+			flight = SINGLE_FLIGHT
+			if flight is None:
+				return lookup_function(*args, **kwargs)
+			return flight.do(backend, coalescing_key(args, kwargs), lookup_function, *args, **kwargs)
+		return coalesced_lookup_function
+	return decorator
+
+
+def set_client_registry(clients: client_registry) -> None:
+	'''This function takes a client_registry instance and uses its clients for all following requests.
+	The previous registry is not closed.'''
+	global CLIENTS
+	CLIENTS = clients
+
+
+def set_local_index(index: local_index, exclusive: bool = False) -> None:
+	'''This function takes a local_index instance (or None to switch it off) and uses it in
+	retrieve_info_MetaPub_Crossref(). If exclusive, no network requests are sent at all.'''
+	global LOCAL_INDEX, LOCAL_INDEX_ONLY
+	LOCAL_INDEX = index
+	LOCAL_INDEX_ONLY = exclusive
+
+
+def cached_lookup(backend: str, with_failure_reason: bool = False):
+	'''
+	This decorator takes a backend name and wraps a lookup function whose first argument
+	is the query (DOI, PMID, keyword str or parsed reference dict). If a response cache is
+	set, cached responses are returned without a request and successful responses are saved.
+	Empty results are not cached so that they are retried in the next run.
+	If with_failure_reason is True, the lookup function returns (response, failure reason) tuples;
+	only the response is cached and cached responses are returned as (response, None).
+	Further arguments that differ from their defaults (eg. max_candidates) are part of the cache key.
+	'''
+	def decorator(lookup_function):
+		signature = inspect.signature(lookup_function)
+
+		def cache_key(query, args: Tuple, kwargs: Dict):
+			'''This function returns the query, combined with the non-default further arguments (if there are any).'''
+			if not args and not kwargs:
+				return query
+			arguments = signature.bind(query, *args, **kwargs).arguments
+			options = {name: value for name, value in list(arguments.items())[1:]
+					   if value != signature.parameters[name].default}
+			return {'query': query, 'options': options} if options else query
+
+		@functools.wraps(lookup_function)
+		def cached_lookup_function(query, *args, **kwargs):
+			cache = RESPONSE_CACHE
+			key = cache_key(query, args, kwargs)
+			if cache is not None:
+				cached_response = cache.get(backend, key)
+				METRICS.increment('cache_lookups_total', backend=backend, result='miss' if cached_response is None else 'hit')
+				if cached_response is not None:
+					return (cached_response, None) if with_failure_reason else cached_response
+			response = lookup_function(query, *args, **kwargs)
+			cacheable_response = response[0] if with_failure_reason else response
+			if cacheable_response and cache is not None:
+				cache.set(backend, key, cacheable_response)
+			return response
+		return cached_lookup_function
+	return decorator
 
 
 def DOI_validity_check(article_dict: Dict, DOI: str) -> bool:
@@ -84,23 +258,19 @@ def contains_minimal_information(article_dict) -> bool:
 
 
 
+@cached_lookup('Crossref_keyword')
 def crossrefAPI_query(keyword: str) -> Dict:
 	'''This function takes a keyword str and sends an according GET request to the CrossRef API.
 	A normalized version of the first (most 'relevant') result is returned.'''
 	article_dict = False
-	works = Works()
-	# If there is a timeout, try again (5 times)
-	for _ in range(5):
-		try:
-			result = works.query(keyword).sort("relevance")
-			for entry in result:
-				# Take first result
-				article_dict = entry
-				break
-		except:
-			pass
-	else:
+	# Temporary errors are retried with backoff (see backend_policy.py)
+	try:
+		items = call_backend('Crossref', crossref_works_request, {'query': keyword, 'sort': 'relevance', 'rows': 1})['items']
+	except (requests.exceptions.RequestException, JSONDecodeError, KeyError, CircuitOpenError):
 		return
+	if items:
+		# Take first result
+		article_dict = items[0]
 	if article_dict:
 		#article_dict = normalize_crossref_dict(article_dict)
 		#if contains_minimal_information(article_dict):
@@ -108,92 +278,140 @@ def crossrefAPI_query(keyword: str) -> Dict:
 		return article_dict
 
 
-def crossrefAPI_improved_query(parsed_ref_dict: Dict) -> Dict:
+def crossrefAPI_improved_query(parsed_ref_dict: Dict, rows: int = 20, max_candidates: int = 200, year_tolerance: int = 1) -> Dict:
+	'''
+	This function takes a parsed reference dict as returned by the parsers from reference_parser and returns
+	the first Crossref result that overlaps with the parsed information (None if there is none), see crossref_candidate_search().
+	'''
+	return crossref_candidate_search(parsed_ref_dict, rows, max_candidates, year_tolerance)[0]
+
+
+@cached_lookup('Crossref_extended_query', with_failure_reason=True)
+def crossref_candidate_search(parsed_ref_dict: Dict, rows: int = 20, max_candidates: int = 200, year_tolerance: int = 1) -> Tuple[Dict, str]:
 	'''
 	This function takes a parsed reference dict as returned by the parsers from reference_parser.
-	It uses the information given in the dict to create a cleaned up string for a  Crossref keyword 
-	query and goes through the first 200 entries to check if the returned result overlaps with the 
-	parsed information and returns the result.
+	It uses the information given in the dict to create a cleaned up string for a Crossref bibliographic
+	query. The parsed journal and first author are sent as field queries and the publication year
+	(+/- year_tolerance) as a filter, so that Crossref only returns fitting candidates. The results are
+	fetched in pages of rows entries and the first max_candidates entries are checked until one
+	overlaps with the parsed information; this one is returned together with None.
+	If no entry is found, it returns None and the failure reason (see negative_cache.FAILURE_REASONS).
+	The number of fetched pages is recorded (see get_crossref_page_statistics()).
 	'''
 	article_dict = False
-	works = Works()
-	for _ in range(5):
+	# Create clean query string
+	# If everything is given
+	if 'volume' not in parsed_ref_dict.keys():
+		return None, 'no_parse'
+	# Book references (eg. Harborne) are not parsed into journal, year and pages
+	if not all([key in parsed_ref_dict.keys() for key in ['journal', 'year', 'pages']]):
+		return None, 'no_parse'
+	if 'authors' in parsed_ref_dict.keys():
+		if 'issue' in parsed_ref_dict.keys():
+			formatted_bib_str = '{}, {}, {}, ({}), ({}), {}'.format(parsed_ref_dict['authors'],
+																parsed_ref_dict['journal'],
+																parsed_ref_dict['volume'],
+																parsed_ref_dict['issue'],
+																parsed_ref_dict['year'],
+																parsed_ref_dict['pages'])
+		# Everything but the issue is given
+		else:
+			formatted_bib_str = '{}, {}, {}, ({}), {}'.format(parsed_ref_dict['authors'],
+																parsed_ref_dict['journal'],
+																parsed_ref_dict['volume'],
+																parsed_ref_dict['year'],
+																parsed_ref_dict['pages'])
+	# Everything but author given
+	elif 'issue' in parsed_ref_dict.keys():
+		formatted_bib_str = '{}, {}, ({}), ({}), {}'.format(parsed_ref_dict['journal'],
+															parsed_ref_dict['volume'],
+															parsed_ref_dict['issue'],
+															parsed_ref_dict['year'],
+															parsed_ref_dict['pages'])
+	else:
+		return None, 'no_parse'
+
+	# Server-side constraints based on the parsed information
+	params = {'query.bibliographic': formatted_bib_str,
+			  'sort': 'relevance',
+			  'rows': rows}
+	if parsed_ref_dict.get('journal'):
+		params['query.container-title'] = parsed_ref_dict['journal']
+	if parsed_ref_dict.get('first_author_surname'):
+		params['query.author'] = parsed_ref_dict['first_author_surname'].strip()
+	if parsed_ref_dict.get('year') and str(parsed_ref_dict['year']).isdigit():
+		year = int(parsed_ref_dict['year'])
+		params['filter'] = 'from-pub-date:{}-01-01,until-pub-date:{}-12-31'.format(year - year_tolerance,
+																				  year + year_tolerance)
+
+	# Browse the first max_candidates entries page by page to check if one of the results fits
+	pages_fetched = 0
+	offset = 0
+	failure_reason = 'no_candidates'
+	while not article_dict and offset < max_candidates:
+		# Temporary errors are retried with backoff (see backend_policy.py)
 		try:
-			# Create clean query string
-			# If everything is given
-			if 'volume' not in parsed_ref_dict.keys():
-				return None
-			if 'authors' in parsed_ref_dict.keys():
-				if 'issue' in parsed_ref_dict.keys():
-					formatted_bib_str = '{}, {}, {}, ({}), ({}), {}'.format(parsed_ref_dict['authors'],
-																		parsed_ref_dict['journal'],
-																		parsed_ref_dict['volume'],
-																		parsed_ref_dict['issue'],
-																		parsed_ref_dict['year'],
-																		parsed_ref_dict['pages'])
-				# Everything but the issue is given
-				else:
-					formatted_bib_str = '{}, {}, {}, ({}), {}'.format(parsed_ref_dict['authors'],
-																		parsed_ref_dict['journal'],
-																		parsed_ref_dict['volume'],
-																		parsed_ref_dict['year'],
-																		parsed_ref_dict['pages'])
-			# Everything but author given
-			elif 'issue' in parsed_ref_dict.keys():
-				formatted_bib_str = '{}, {}, ({}), ({}), {}'.format(parsed_ref_dict['journal'],
-																	parsed_ref_dict['volume'],
-																	parsed_ref_dict['issue'],
-																	parsed_ref_dict['year'],
-																	parsed_ref_dict['pages'])
-			
-			result = works.query(formatted_bib_str).sort("relevance")
-			
-			# Browse first 200 entries to check if one of the results fit
-			a = 0
-			try:
-				for entry in result:
-					a += 1
-					if a == 200:
-						break
-					entry = add_retrieval_information(entry, 'Crossref', 'Crossref_extended_query', str(parsed_ref_dict))
-
-					normalized_dict = normalize_crossref_dict(entry)
-					#print(normalized_dict)
-					if normalized_dict:
-						if is_same_publication(parsed_ref_dict, normalized_dict):
-							article_dict = entry
-							break	
-			except JSONDecodeError:
-				pass
+			items = call_backend('Crossref', crossref_works_request, dict(params, offset=offset))['items']
+			pages_fetched += 1
+		except (requests.exceptions.RequestException, JSONDecodeError, KeyError, CircuitOpenError):
+			failure_reason = 'backend_error'
 			break
-		except requests.exceptions.Timeout:
-			pass
+		if not items:
+			break
+		failure_reason = 'mismatch'
+		candidates_scanned = 0
+		for entry in items[:max_candidates - offset]:
+			candidates_scanned += 1
+			entry = add_retrieval_information(entry, 'Crossref', 'Crossref_extended_query', str(parsed_ref_dict))
+			normalized_dict = normalize_crossref_dict(entry)
+			if normalized_dict:
+				if is_same_publication(parsed_ref_dict, normalized_dict):
+					article_dict = entry
+					break
+		METRICS.increment('crossref_candidates_scanned_total', candidates_scanned)
+		# Last page
+		if len(items) < rows:
+			break
+		offset += rows
+	record_crossref_pages(pages_fetched)
+	METRICS.increment('crossref_pages_total', pages_fetched)
+	METRICS.increment('crossref_matches_total', result='match' if article_dict else 'no_match')
 	if article_dict:
-		return article_dict
+		return article_dict, None
+	return None, failure_reason
+
+
+def record_crossref_pages(pages_fetched: int) -> None:
+	'''This function takes the number of result pages that have been fetched for one reference
+	in crossrefAPI_improved_query() and adds it to the statistics.'''
+	with CROSSREF_PAGE_STATISTICS_LOCK:
+		CROSSREF_PAGE_STATISTICS['references'] += 1
+		CROSSREF_PAGE_STATISTICS['pages'] += pages_fetched
+		CROSSREF_PAGE_STATISTICS['max_pages'] = max(CROSSREF_PAGE_STATISTICS['max_pages'], pages_fetched)
+
+
+def get_crossref_page_statistics() -> Dict:
+	'''This function returns a dict with the number of references that have been queried with
+	crossrefAPI_improved_query(), the total and maximal number of fetched result pages and the
+	average number of pages per reference.'''
+	with CROSSREF_PAGE_STATISTICS_LOCK:
+		statistics = dict(CROSSREF_PAGE_STATISTICS)
+	if statistics['references']:
+		statistics['pages_per_reference'] = statistics['pages'] / statistics['references']
+	else:
+		statistics['pages_per_reference'] = 0.0
+	return statistics
 
 
 def journal_name_match(str_1: str, str_2: str)-> bool:
 	'''
-	This function takes two strings and determines whether all letters from the
-	shorter string appear in the longer string in the same order. If the condition
-	is fulfilled, it returns True.
-	'''
-	# Normalise input strings while only considering alphabetic characters
-	str_1 = ''.join(re.findall('[A-Za-z]+', str_1)).lower()
-	str_2 = ''.join(re.findall('[A-Za-z]+', str_2)).lower()
-	longer_str = max([str_1, str_2], key=len)
-	shorter_str = min([str_1, str_2], key=len)
-
-	index = 0
-	reconstr_shorter_str = ''
-	# Check if chars from shorter str can be matched with longer str in right order
-	for short_char in shorter_str:
-		for long_char_index in range(index, len(longer_str)):
-			if short_char == longer_str[long_char_index]:
-				index = long_char_index + 1
-				reconstr_shorter_str += short_char
-				break
-	if reconstr_shorter_str == shorter_str:
+	This function takes two strings and determines whether they refer to the same journal.
+	The first one may be an abbreviation, the second one should be the full journal title.
+	Known abbreviations and ISO4-style abbreviations are looked up in JOURNAL_INDEX, otherwise
+	it is checked whether all letters from the shorter string appear in the longer string in the
+	same order. If the condition is fulfilled, it returns True.
+	'''
+	if JOURNAL_INDEX.match(str_1, str_2):
 		return True
 
 
@@ -243,32 +461,39 @@ def is_same_publication(parsed_ref_data: Dict, retrieved_ref_data: Dict) -> bool
 					pass
 				else:
 					return False
+	# Remember the confirmed journal abbreviation
+	JOURNAL_INDEX.add_abbreviation(parsed_ref_data['journal'], retrieved_ref_data['journal'])
 	return True
 
 
+@coalesced_lookup('DOI')
+@cached_lookup('DOI')
 def get_info_by_DOI(DOI: str) -> Dict:
 	'''This function takes a DOI str, requests information about the corresponding
-	article via metapub or crossref and checks if all necessary information has been retrieved.'''
+	article via metapub or crossref and checks if all necessary information has been retrieved.
+	If Crossref cannot be reached either, the error is raised (see BACKEND_ERRORS).'''
 	article_dict = {}
-	fetch = PubMedFetcher()
+	fetch = CLIENTS.pubmed_fetcher()
 	try:
-		article = fetch.article_by_doi(DOI)
+		with METRICS.timed('backend_request_seconds', backend='MetaPub'):
+			article = call_backend('MetaPub', fetch.article_by_doi, DOI)
 		# Save information in Dict
-		for info in dir(article):
-			if info[0] != '_':
-				article_dict[info] = eval('article.' + info)
+		article_dict = get_metapub_article_dict(article)
 		# Add data retrieval info to the dict
 		article_dict = add_retrieval_information(article_dict, 'MetaPub', 'DOI', DOI)
-	except MetaPubError:
+	# If PubMed is unavailable (open circuit breaker, exhausted retries), the request is rerouted to Crossref
+	except (MetaPubError, CircuitOpenError, requests.exceptions.RequestException):
+		METRICS.increment('backend_errors_total', backend='MetaPub')
 		# If it does not work via Metapub, do it via Crossref Api
-		# If there is a timeout, try again (5 times)
-		for _ in range(5):
-			try:
-				works = Works()
-				article_dict = works.doi(DOI)
-				break
-			except:
-				pass
+		# Temporary errors are retried with backoff (see backend_policy.py)
+		try:
+			article_dict = call_backend('Crossref', crossref_DOI_request, DOI)
+		except (requests.exceptions.RequestException, CircuitOpenError) as error:
+			# An outage is not the same as an unknown DOI
+			if isinstance(error, CircuitOpenError) or is_retryable_error(error):
+				raise
+		except (JSONDecodeError, KeyError):
+			pass
 		#article_dict = normalize_crossref_dict(article_dict)
 		# Add data retrieval info to the dict
 		#if contains_minimal_information(article_dict):
@@ -276,25 +501,297 @@ def get_info_by_DOI(DOI: str) -> Dict:
 	return article_dict
 
 
+@coalesced_lookup('PMID')
+@cached_lookup('PMID')
 def get_info_by_PMID(PMID: str) -> Dict:
 	'''This function takes a PMID str, requests information about the corresponding
-	article via metapub and checks if all necessary information has been retrieved.'''
+	article via metapub and checks if all necessary information has been retrieved.
+	If PubMed cannot be reached, the error is raised (see BACKEND_ERRORS).'''
 	article_dict = {}
-	fetch = PubMedFetcher()
+	fetch = CLIENTS.pubmed_fetcher()
 	try:
-		article = fetch.article_by_pmid(PMID)
+		with METRICS.timed('backend_request_seconds', backend='MetaPub'):
+			article = call_backend('MetaPub', fetch.article_by_pmid, PMID)
 		# Save information in Dict
-		for info in dir(article):
-			if info[0] != '_':
-				article_dict[info] = eval('article.' + info)				
+		article_dict = get_metapub_article_dict(article)
 	except MetaPubError:
-		pass
+		METRICS.increment('backend_errors_total', backend='MetaPub')
 	#if contains_minimal_information(article_dict):
 		# Add data retrieval info to the dict and return it
 	article_dict = add_retrieval_information(article_dict, 'MetaPub', 'PMID', PMID)
 	return article_dict
 
 
+def get_metapub_article_dict(article: PubMedArticle, fields: List[str] = None) -> Dict:
+	'''This function takes a PubMedArticle as returned by metapub and returns a dict with the
+	given attributes (default: METAPUB_FIELDS, the ones used by normalize_metapub_dict()).
+	If fields is an empty list, all public attributes are read.'''
+	if fields is None:
+		fields = METAPUB_FIELDS
+	elif not fields:
+		fields = [info for info in dir(article) if info[0] != '_' and not callable(getattr(article, info, None))]
+	return {field: getattr(article, field, None) for field in fields}
+
+
+def split_into_chunks(IDs: List[str], chunk_size: int) -> List[List[str]]:
+	'''This function takes a list of IDs and returns a list of lists with max. chunk_size IDs each.'''
+	return [IDs[index:index + chunk_size] for index in range(0, len(IDs), chunk_size)]
+
+
+def fetch_pubmed_articles(fetch: PubMedFetcher, PMIDs: List[str]) -> List[PubMedArticle]:
+	'''This function takes a PubMedFetcher and a list of PMIDs, fetches all records with one
+	EFetch request and returns a list of PubMedArticle objects.'''
+	xml = fetch.qs.efetch({'db': 'pubmed', 'id': ','.join(PMIDs)})
+	root = etree.fromstring(xml)
+	articles = []
+	for record in root.findall('PubmedArticle') + root.findall('PubmedBookArticle'):
+		# PubMedArticle looks for its root element below the top level element
+		articles.append(PubMedArticle(b'<PubmedArticleSet>' + etree.tostring(record) + b'</PubmedArticleSet>'))
+	return articles
+
+
+def get_info_by_PMIDs(PMIDs: List[str], chunk_size: int = 200) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+	'''
+	This function takes a list of PMID str and requests information about the corresponding
+	articles via metapub with one EFetch request per chunk of chunk_size PMIDs.
+	It returns a tuple of two dicts:
+	- PMID -> article dict (same format as returned by get_info_by_PMID())
+	- PMID -> reason why no information could be retrieved
+	'''
+	results = {}
+	failures = {}
+	PMIDs = list(dict.fromkeys([str(PMID).strip() for PMID in PMIDs]))
+	# Do not request what is already in the response cache
+	if RESPONSE_CACHE is not None:
+		for PMID in PMIDs:
+			cached_response = RESPONSE_CACHE.get('PMID', PMID)
+			if cached_response is not None:
+				results[PMID] = cached_response
+		PMIDs = [PMID for PMID in PMIDs if PMID not in results]
+	fetch = CLIENTS.pubmed_fetcher()
+	for chunk in split_into_chunks(PMIDs, chunk_size):
+		try:
+			articles = call_backend('MetaPub', fetch_pubmed_articles, fetch, chunk)
+		except (EutilsNCBIError, MetaPubError, etree.XMLSyntaxError, CircuitOpenError) as error:
+			for PMID in chunk:
+				failures[PMID] = 'request failed: {}'.format(error)
+			continue
+		for article in articles:
+			if article.pmid in chunk:
+				article_dict = get_metapub_article_dict(article)
+				results[article.pmid] = add_retrieval_information(article_dict, 'MetaPub', 'PMID', article.pmid)
+				if RESPONSE_CACHE is not None:
+					RESPONSE_CACHE.set('PMID', article.pmid, results[article.pmid])
+		for PMID in chunk:
+			if PMID not in results:
+				failures[PMID] = 'not found in PubMed'
+	return results, failures
+
+
+def get_info_by_DOIs(DOIs: List[str], chunk_size: int = 50, crossref_fallback: bool = True) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+	'''
+	This function takes a list of DOI str and requests information about the corresponding
+	articles via metapub. Per chunk of chunk_size DOIs, the PMIDs are looked up with one ESearch
+	request and the records are fetched with one EFetch request.
+	If crossref_fallback, the DOIs that could not be found in PubMed are resolved in bulk via
+	Crossref (see crossref_bulk_DOI_query()) just like get_info_by_DOI() falls back to Crossref.
+	It returns a tuple of two dicts:
+	- DOI -> article dict (same format as returned by get_info_by_DOI())
+	- DOI -> reason why no information could be retrieved (from PubMed and, if crossref_fallback, from Crossref)
+	'''
+	results = {}
+	failures = {}
+	DOIs = list(dict.fromkeys([DOI.strip() for DOI in DOIs]))
+	if RESPONSE_CACHE is not None:
+		for DOI in DOIs:
+			cached_response = RESPONSE_CACHE.get('DOI', DOI)
+			if cached_response is not None:
+				results[DOI] = cached_response
+		DOIs = [DOI for DOI in DOIs if DOI not in results]
+	fetch = CLIENTS.pubmed_fetcher()
+	for chunk in split_into_chunks(DOIs, chunk_size):
+		search_term = ' OR '.join(['"{}"[doi]'.format(DOI) for DOI in chunk])
+		try:
+			search_result = etree.fromstring(call_backend('MetaPub', fetch.qs.esearch, {'db': 'pubmed', 'term': search_term, 'retmax': len(chunk)}))
+			PMIDs = [ID.text for ID in search_result.findall('IdList/Id')]
+			articles = call_backend('MetaPub', fetch_pubmed_articles, fetch, PMIDs) if PMIDs else []
+		except (EutilsNCBIError, MetaPubError, etree.XMLSyntaxError, CircuitOpenError) as error:
+			for DOI in chunk:
+				failures[DOI] = 'request failed: {}'.format(error)
+			continue
+		# DOIs are case-insensitive
+		requested_DOIs = {DOI.lower(): DOI for DOI in chunk}
+		for article in articles:
+			if article.doi and article.doi.lower() in requested_DOIs.keys():
+				DOI = requested_DOIs[article.doi.lower()]
+				article_dict = get_metapub_article_dict(article)
+				results[DOI] = add_retrieval_information(article_dict, 'MetaPub', 'DOI', DOI)
+				if RESPONSE_CACHE is not None:
+					RESPONSE_CACHE.set('DOI', DOI, results[DOI])
+		for DOI in chunk:
+			if DOI not in results:
+				failures[DOI] = 'not found in PubMed'
+	if crossref_fallback and failures:
+		crossref_results, crossref_failures = crossref_bulk_DOI_query(list(failures.keys()), chunk_size)
+		results.update(crossref_results)
+		failures = {DOI: 'PubMed: {}; Crossref: {}'.format(failures[DOI], crossref_failure)
+					for DOI, crossref_failure in crossref_failures.items()}
+	return results, failures
+
+
+@coalesced_lookup('Crossref')
+def crossref_request(path: str, params: Dict = None) -> Dict:
+	'''This function takes the path of a Crossref API route (eg. "/works") and a dict with query parameters,
+	sends a GET request and returns the "message" of the JSON response (None if the resource does not exist).
+	The number of transferred bytes is recorded (see get_crossref_transfer_statistics()).'''
+	try:
+		with METRICS.timed('backend_request_seconds', backend='Crossref'):
+			response = CLIENTS.session.get(CROSSREF_API_URL + path, params=params, timeout=CROSSREF_TIMEOUT)
+	except requests.exceptions.Timeout:
+		METRICS.increment('backend_timeouts_total', backend='Crossref')
+		raise
+	METRICS.increment('backend_requests_total', backend='Crossref', status=response.status_code)
+	with CROSSREF_TRANSFER_STATISTICS_LOCK:
+		CROSSREF_TRANSFER_STATISTICS['requests'] += 1
+		CROSSREF_TRANSFER_STATISTICS['bytes'] += len(response.content)
+	if response.status_code == 404:
+		return None
+	response.raise_for_status()
+	return response.json()['message']
+
+
+def crossref_works_request(params: Dict) -> Dict:
+	'''This function takes a dict with query parameters, sends a GET request to the works route
+	of the Crossref API and returns the "message" of the JSON response.
+	If CROSSREF_FIELD_PROJECTION is True, only the fields in CROSSREF_SELECT_FIELDS are requested.'''
+	if CROSSREF_FIELD_PROJECTION:
+		params = dict(params, select=','.join(CROSSREF_SELECT_FIELDS))
+	return crossref_request('/works', params)
+
+
+def crossref_DOI_request(DOI: str) -> Dict:
+	'''This function takes a DOI str and returns the corresponding work record from the Crossref API
+	(None if the DOI is unknown). The single work route does not support the select parameter,
+	so a filtered works query is used if CROSSREF_FIELD_PROJECTION is True.'''
+	if CROSSREF_FIELD_PROJECTION and ',' not in DOI:
+		items = crossref_works_request({'filter': 'doi:' + DOI, 'rows': 1})['items']
+		if items:
+			return items[0]
+		return None
+	return crossref_request('/works/' + urllib.parse.quote(DOI))
+
+
+def get_crossref_transfer_statistics() -> Dict:
+	'''This function returns a dict with the number of Crossref requests, the transferred bytes,
+	the number of references that have been resolved (with retrieve_info_MetaPub_Crossref() or
+	async_resolution.resolution_engine.retrieve()) and the average number of transferred bytes per request
+	and per reference.'''
+	with CROSSREF_TRANSFER_STATISTICS_LOCK:
+		statistics = dict(CROSSREF_TRANSFER_STATISTICS)
+	statistics['bytes_per_request'] = statistics['bytes'] / statistics['requests'] if statistics['requests'] else 0.0
+	statistics['bytes_per_reference'] = statistics['bytes'] / statistics['references'] if statistics['references'] else 0.0
+	return statistics
+
+
+def print_crossref_statistics(file=None) -> None:
+	'''This function prints the Crossref transfer statistics (see get_crossref_transfer_statistics()) and the
+	result page statistics (see get_crossref_page_statistics()) to the given file (default: stdout), eg. at the end of a run.'''
+	print('Crossref transfer statistics: {}'.format(json.dumps(get_crossref_transfer_statistics())), file=file)
+	print('Crossref page statistics: {}'.format(json.dumps(get_crossref_page_statistics())), file=file)
+
+
+def crossref_bulk_DOI_query(DOIs: List[str], chunk_size: int = 50) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+	'''
+	This function takes a list of DOI str and requests the corresponding work records from
+	the Crossref API with one filtered query (filter=doi:...,doi:...) per chunk of chunk_size DOIs.
+	It returns a tuple of two dicts:
+	- DOI -> work dict (same format as the Crossref results of get_info_by_DOI())
+	- DOI -> reason why no information could be retrieved
+	'''
+	results = {}
+	failures = {}
+	DOIs = list(dict.fromkeys([DOI.strip() for DOI in DOIs]))
+	if RESPONSE_CACHE is not None:
+		for DOI in DOIs:
+			cached_response = RESPONSE_CACHE.get('DOI', DOI)
+			if cached_response is not None:
+				results[DOI] = cached_response
+		DOIs = [DOI for DOI in DOIs if DOI not in results]
+	# Commas separate the filters, DOIs that contain one cannot be part of a filtered query
+	for DOI in [DOI for DOI in DOIs if ',' in DOI]:
+		failures[DOI] = 'DOI contains a comma and cannot be used in a filtered query'
+	DOIs = [DOI for DOI in DOIs if ',' not in DOI]
+	for chunk in split_into_chunks(DOIs, chunk_size):
+		params = {'filter': ','.join(['doi:' + DOI for DOI in chunk]),
+				  'rows': len(chunk)}
+		# Temporary errors are retried with backoff (see backend_policy.py)
+		try:
+			message = call_backend('Crossref', crossref_works_request, params)
+		except (requests.exceptions.RequestException, JSONDecodeError, CircuitOpenError) as error:
+			for DOI in chunk:
+				failures[DOI] = 'request failed: {}'.format(error)
+			continue
+		# crossref_request() returns None if the route does not exist (404)
+		items = message.get('items') if message else None
+		if items is None:
+			for DOI in chunk:
+				failures[DOI] = 'request failed: no items in the Crossref response'
+			continue
+		# DOIs are case-insensitive
+		requested_DOIs = {DOI.lower(): DOI for DOI in chunk}
+		for item in items:
+			if 'DOI' in item.keys() and item['DOI'].lower() in requested_DOIs.keys():
+				DOI = requested_DOIs[item['DOI'].lower()]
+				results[DOI] = add_retrieval_information(item, 'Crossref', 'DOI', DOI)
+				if RESPONSE_CACHE is not None:
+					RESPONSE_CACHE.set('DOI', DOI, results[DOI])
+		for DOI in chunk:
+			if DOI not in results:
+				failures[DOI] = 'not found in Crossref'
+	return results, failures
+
+
+class crossref_DOI_collector:
+	'''
+	This class collects DOIs whose resolution is pending and resolves all of them at once
+	via crossref_bulk_DOI_query(). The results are returned in normalised form (see normalize_crossref_dict()).
+	Example:
+	collector = crossref_DOI_collector()
+	collector.add('10.1021/ol502216j')
+	normalized_dicts, failures = collector.resolve()
+	'''
+	def __init__(self, chunk_size: int = 50) -> None:
+		self.chunk_size = chunk_size
+		self.pending_DOIs = []
+
+
+	def __len__(self) -> int:
+		return len(self.pending_DOIs)
+
+
+	def add(self, DOI: str) -> None:
+		'''This function takes a DOI str and adds it to the pending DOIs.'''
+		self.pending_DOIs.append(DOI)
+
+
+	def resolve(self) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+		'''
+		This function resolves all pending DOIs and returns a tuple of two dicts:
+		- DOI -> normalised reference dict
+		- DOI -> reason why no information could be retrieved
+		'''
+		results, failures = crossref_bulk_DOI_query(self.pending_DOIs, self.chunk_size)
+		self.pending_DOIs = []
+		normalized_dicts = {}
+		for DOI, crossref_dict in results.items():
+			normalized_dict = normalize_crossref_dict(crossref_dict)
+			if normalized_dict:
+				normalized_dicts[DOI] = normalized_dict
+			else:
+				failures[DOI] = 'could not be normalised'
+		return normalized_dicts, failures
+
+
 def add_retrieval_information(reference_dict: Dict, retrieved_from: str, query_str_type: str, query_str: str) -> Dict:
 	'''This function takes a reference_dict (Dict) and information about where the reference data was retrieved from,
 	what type of query str and what exact query str have been used to retrieve the information. It adds this data to
@@ -429,13 +926,13 @@ def normalize_title(title: str, only_if_homogeneous: bool = True) -> str:
 
 
 
-def normalize_metapub_dict(metapub_dict: Dict):
+def normalize_metapub_dict(metapub_dict: Dict) -> normalized_reference:
 	'''
 	This function takes a dictionary as it is returned by a MetaPub retrieval
-	and returns a dictionary with the information relevant for a reference notation
-	str in a normalised format.
+	and returns a normalized_reference (compact record with a dict interface) with the
+	information relevant for a reference notation str in a normalised format.
 	'''
-	normalized_dict = {}
+	normalized_dict = normalized_reference()
 	copy_keys = ['title', 'year', 'volume', 'issue', 'first_page', 'pages', 'journal', 'reference_retrieved_from', 'query_str_type', 'query_str']
 	for key in copy_keys:
 		if key in metapub_dict.keys(): 
@@ -452,12 +949,12 @@ def normalize_metapub_dict(metapub_dict: Dict):
 	return normalized_dict
 
 
-def normalize_crossref_dict(crossref_dict: Dict) -> Dict:
+def normalize_crossref_dict(crossref_dict: Dict) -> normalized_reference:
 	'''This function takes a dict with publication metadata as returned by the 
-	Crossref API and returns a dict which contains the essential information in 
-	the same format as returned by Metapub.'''
+	Crossref API and returns a normalized_reference (compact record with a dict interface)
+	which contains the essential information in the same format as returned by Metapub.'''
 	if crossref_dict:
-		normalized_dict = {}
+		normalized_dict = normalized_reference()
 		normkeys = ['title', 'abstract', 'DOI', 'issue', 'volume']
 		for normkey in normkeys:
 			if normkey in crossref_dict.keys():
@@ -502,9 +999,9 @@ def normalize_crossref_dict(crossref_dict: Dict) -> Dict:
 
 
 
-def create_normalized_reference_str(article_dict: Dict) -> str:
-	'''This function takes a dictionary with information about a publication (as returned by
-	get_info_by_DOI() or scholarly_request()) and returns a normalized reference string.'''
+def create_normalized_reference_str(article_dict: normalized_reference) -> str:
+	'''This function takes a normalized_reference or a dictionary with information about a publication
+	(as returned by normalize_metapub_dict() or normalize_crossref_dict()) and returns a normalized reference string.'''
 	reference_str = ''
 	# Add authors
 	if 'authors' in article_dict.keys():
@@ -571,7 +1068,7 @@ def get_structured_reference(unstructured_publication_ID: str, only_DOI_PMID: bo
 	if DOI:
 		try:
 			article_dict = get_info_by_DOI(DOI)
-		except EutilsNCBIError:
+		except BACKEND_ERRORS:
 			article_dict = False
 	# If no DOI is available or the queries have not returned anything reasonable, 
 	#check if the given ID only consists of numbers. If that is the case, interpret 
@@ -581,7 +1078,7 @@ def get_structured_reference(unstructured_publication_ID: str, only_DOI_PMID: bo
 			if unstructured_publication_ID.isdigit():
 				try:
 					article_dict = get_info_by_PMID(unstructured_publication_ID)
-				except EutilsNCBIError:
+				except BACKEND_ERRORS:
 					article_dict = False
 	# If it has not worked until now, use crossref API and take most 'relevant' result
 	# TODO: Some sort of validation that we get the right result here
@@ -604,6 +1101,56 @@ def get_structured_reference(unstructured_publication_ID: str, only_DOI_PMID: bo
 	return article_dict
 
 
+def get_info_from_local_index(unstructured_publication_ID: str, only_DOI_PMID: bool = False) -> Dict:
+	'''
+	This function takes a string that contains a reference to a publication and looks it up in LOCAL_INDEX
+	(by DOI, by PMID or by the parsed first author, year, volume and first page / journal name).
+	Records that have been found via the parsed information are only accepted if they are confirmed
+	by is_same_publication(). It returns a dict in the same format as the network lookups or None.
+	'''
+	DOI = contains_DOI(unstructured_publication_ID)
+	if DOI:
+		result = LOCAL_INDEX.get_by_DOI(DOI)
+		if result:
+			return local_index_result_to_dict(result, 'DOI', DOI)
+	if len(unstructured_publication_ID) > 3 and unstructured_publication_ID.isdigit():
+		result = LOCAL_INDEX.get_by_PMID(unstructured_publication_ID)
+		if result:
+			return local_index_result_to_dict(result, 'PMID', unstructured_publication_ID)
+	if only_DOI_PMID:
+		return None
+	parser = rp.reference_parser()
+	parsed_ref_dict = parser(unstructured_publication_ID)
+	if not parsed_ref_dict:
+		return None
+	if not (parsed_ref_dict.get('year') and parsed_ref_dict.get('volume') and parsed_ref_dict.get('first_page')):
+		return None
+	candidates = []
+	if parsed_ref_dict.get('first_author_surname'):
+		candidates = LOCAL_INDEX.get_by_citation(parsed_ref_dict['first_author_surname'], parsed_ref_dict['year'],
+												 parsed_ref_dict['volume'], parsed_ref_dict['first_page'])
+	if not candidates and parsed_ref_dict.get('journal'):
+		candidates = LOCAL_INDEX.search_journal(parsed_ref_dict['journal'], parsed_ref_dict['year'],
+												parsed_ref_dict['volume'], parsed_ref_dict['first_page'])
+	parsed_ref_dict.setdefault('issue', None)
+	for result in candidates:
+		article_dict = local_index_result_to_dict(result, 'unstructured_ID', unstructured_publication_ID)
+		if article_dict['reference_retrieved_from'] == 'Crossref':
+			normalized_dict = normalize_crossref_dict(article_dict)
+		else:
+			normalized_dict = normalize_metapub_dict(article_dict)
+		if normalized_dict and is_same_publication(parsed_ref_dict, normalized_dict):
+			return article_dict
+
+
+def local_index_result_to_dict(result: Tuple[str, Dict], query_str_type: str, query_str: str) -> Dict:
+	'''This function takes a (source, record) tuple as returned by local_index and returns the record
+	with the same retrieval information as the corresponding network lookup.'''
+	source, record = result
+	retrieved_from = 'Crossref' if source == 'Crossref' else 'MetaPub'
+	return add_retrieval_information(record, retrieved_from, query_str_type, query_str)
+
+
 def retrieve_info_MetaPub_Crossref(unstructured_publication_ID: str, only_DOI_PMID: bool = False) -> Dict:
 	'''This function takes a string that contains a reference to a publication.
 	If only_DOI_PMID = True, it will only return queries based on DOI or Pubmed IDs (relatively secure).
@@ -612,36 +1159,131 @@ def retrieve_info_MetaPub_Crossref(unstructured_publication_ID: str, only_DOI_PM
 	- Metapub (PubMed API)
 	- Crossref API (with the first 200 entries)
 	to request more information and returns a Dict that contains
-	all gathered information about the publication in a structured format.'''
-	
-	# If there is a DOI in the input str, try to use Metapub and 
-	article_dict = False
-	DOI = contains_DOI(unstructured_publication_ID)
-	if DOI:
-		try:
-			article_dict = get_info_by_DOI(DOI)
-		except EutilsNCBIError:
-			article_dict = False
-	# If no DOI is available or the queries have not returned anything reasonable, 
-	#check if the given ID only consists of numbers. If that is the case, interpret 
+	all gathered information about the publication in a structured format.
+	If LOCAL_INDEX is set, the offline index is used first (see get_info_from_local_index()).
+	If NEGATIVE_CACHE is set, references that failed recently are skipped and failures are recorded
+	with their reason (see record_retrieval_outcome()).
+	The stages are shared with async_resolution.resolution_engine.retrieve(), which runs the blocking
+	ones (identifier_lookup() and crossref_lookup()) in its thread pool.'''
+	# Use the offline index first if there is one and skip references that could not be resolved recently
+	finished, article_dict = start_retrieval(unstructured_publication_ID, only_DOI_PMID)
+	if finished:
+		return article_dict
+	# If there is a DOI in the input str, try to use Metapub and Crossref. Otherwise,
+	# check if the given ID only consists of numbers. If that is the case, interpret
 	# it as a PMID for a Metapub query and see if that works.
-	if not article_dict:
-		if len(unstructured_publication_ID) > 3:
-			if unstructured_publication_ID.isdigit():
-				try:
-					article_dict = get_info_by_PMID(unstructured_publication_ID)
-				except EutilsNCBIError:
-					article_dict = False
+	article_dict = False
+	failure_reason = 'no_candidates'
+	backend_error = False
+	DOI, PMID = detect_identifiers(unstructured_publication_ID)
+	if DOI or PMID:
+		article_dict, backend_error = identifier_lookup(DOI, PMID)
 	# If it has not worked until now, use crossref API and take most 'relevant' result
 	if not only_DOI_PMID:
 		if not article_dict:
-			parser = rp.reference_parser()
-			parsed_ref_dict = parser(unstructured_publication_ID)
-			parsed_ref_dict = add_retrieval_information(parsed_ref_dict, 'Crossref', 'unstructured_ID', unstructured_publication_ID)
-			article_dict = crossrefAPI_improved_query(parsed_ref_dict)
+			parsed_ref_dict = parse_reference_str(unstructured_publication_ID)
+			if parsed_ref_dict:
+				article_dict, failure_reason = crossref_lookup(parsed_ref_dict)
+			else:
+				failure_reason = 'no_parse'
+	return finish_retrieval(unstructured_publication_ID, only_DOI_PMID, article_dict, 'backend_error' if backend_error else failure_reason)
+
+
+def start_retrieval(unstructured_publication_ID: str, only_DOI_PMID: bool = False) -> Tuple[bool, Dict]:
+	'''This function takes a reference str and counts it (see get_crossref_transfer_statistics()). It returns
+	(True, result) if the reference does not have to be looked up in the backends: it has been found in LOCAL_INDEX
+	(or LOCAL_INDEX_ONLY is set) or it could not be resolved recently (see negative_cache_lookup()).
+	Otherwise, it returns (False, None).'''
+	with CROSSREF_TRANSFER_STATISTICS_LOCK:
+		CROSSREF_TRANSFER_STATISTICS['references'] += 1
+	if LOCAL_INDEX is not None:
+		with METRICS.timed('stage_seconds', stage='local_index'):
+			article_dict = get_info_from_local_index(unstructured_publication_ID, only_DOI_PMID)
+		if article_dict or LOCAL_INDEX_ONLY:
+			METRICS.increment('retrievals_total', result='local_index' if article_dict else 'not_found')
+			return True, article_dict
+	if negative_cache_lookup(unstructured_publication_ID, only_DOI_PMID):
+		METRICS.increment('retrievals_total', result='negative_cache')
+		return True, False
+	return False, None
+
+
+def detect_identifiers(unstructured_publication_ID: str) -> Tuple[str, str]:
+	'''This function takes a reference str and returns a (DOI, PMID) tuple (None if there is none).
+	The str is only interpreted as a PMID if it has more than 3 characters and only consists of digits.'''
+	with METRICS.timed('stage_seconds', stage='doi_detection'):
+		DOI = contains_DOI(unstructured_publication_ID)
+	PMID = None
+	if not DOI and len(unstructured_publication_ID) > 3 and unstructured_publication_ID.isdigit():
+		PMID = unstructured_publication_ID
+	return DOI, PMID
+
+
+def identifier_lookup(DOI: str, PMID: str) -> Tuple[Dict, bool]:
+	'''This function takes a DOI or a PMID str (see detect_identifiers()) and retrieves the article via
+	get_info_by_DOI() or get_info_by_PMID(). It returns a tuple of the article dict (False if nothing has
+	been found) and a bool that is True if the backends could not be reached (see BACKEND_ERRORS).'''
+	try:
+		if DOI:
+			with METRICS.timed('stage_seconds', stage='doi_lookup'):
+				return get_info_by_DOI(DOI), False
+		with METRICS.timed('stage_seconds', stage='pmid_lookup'):
+			return get_info_by_PMID(PMID), False
+	except BACKEND_ERRORS:
+		METRICS.increment('backend_errors_total', backend='MetaPub')
+		return False, True
+
+
+def parse_reference_str(unstructured_publication_ID: str) -> Dict:
+	'''This function takes a reference str and returns the dict of the first reference_parser pattern that fits
+	(with retrieval information for the Crossref query) or None if no pattern fits.'''
+	with METRICS.timed('stage_seconds', stage='parsing'):
+		parser = rp.reference_parser()
+		parsed_ref_dict = parser(unstructured_publication_ID)
+	return add_retrieval_information(parsed_ref_dict, 'Crossref', 'unstructured_ID', unstructured_publication_ID)
+
+
+def crossref_lookup(parsed_ref_dict: Dict) -> Tuple[Dict, str]:
+	'''This function takes a parsed reference dict (see parse_reference_str()) and returns the confirmed Crossref
+	result and the failure reason (see crossref_candidate_search()).'''
+	with METRICS.timed('stage_seconds', stage='crossref_query'):
+		return crossref_candidate_search(parsed_ref_dict)
+
+
+def finish_retrieval(unstructured_publication_ID: str, only_DOI_PMID: bool, article_dict: Dict, failure_reason: str) -> Dict:
+	'''This function takes a reference str, the retrieved dict and the failure reason. It counts the
+	result, records it (see record_retrieval_outcome()) and returns the retrieved dict.'''
+	if METRICS.enabled:
+		METRICS.increment('retrievals_total', result=article_dict.get('reference_retrieved_from', 'found') if article_dict else 'not_found')
+	record_retrieval_outcome(unstructured_publication_ID, only_DOI_PMID, article_dict, failure_reason)
 	return article_dict
 
 
+def negative_cache_lookup(unstructured_publication_ID: str, only_DOI_PMID: bool = False) -> Dict:
+	'''This function takes a reference str and returns its failure entry if it is in NEGATIVE_CACHE and must
+	not be retried yet (see negative_cache.get()), otherwise None. DOI/PMID-only retrievals do not use the cache.'''
+	cache = NEGATIVE_CACHE
+	if cache is None or only_DOI_PMID:
+		return None
+	failure = cache.get(unstructured_publication_ID)
+	METRICS.increment('negative_cache_lookups_total', result='hit' if failure else 'miss')
+	return failure
+
+
+def record_retrieval_outcome(unstructured_publication_ID: str, only_DOI_PMID: bool, article_dict: Dict, failure_reason: str) -> None:
+	'''This function takes a reference str, the retrieved dict and the failure reason (see negative_cache.FAILURE_REASONS).
+	Failures are counted and saved in NEGATIVE_CACHE (if it is set and the retrieval was not DOI/PMID-only),
+	resolved references are removed from it.'''
+	cache = NEGATIVE_CACHE
+	if article_dict:
+		if cache is not None:
+			cache.discard(unstructured_publication_ID)
+		return
+	METRICS.increment('retrieval_failures_total', reason=failure_reason)
+	if cache is not None and not only_DOI_PMID:
+		cache.record(unstructured_publication_ID, failure_reason)
+
+
 def get_final_dict_from_ref_str(ref_str: str) -> Dict:
 	'''
 	This function takes a ref_str and goes through the whole process of 
@@ -652,12 +1294,23 @@ def get_final_dict_from_ref_str(ref_str: str) -> Dict:
 	contains a normalised reference str, the DOI and the PMID.
 	'''
 
-	ref_dict = retrieve_info_MetaPub_Crossref(ref_str)
+	with METRICS.timed('reference_seconds'):
+		ref_dict = retrieve_info_MetaPub_Crossref(ref_str)
+		with METRICS.timed('stage_seconds', stage='normalisation'):
+			return get_final_dict_from_ref_dict(ref_dict)
+
+
+def get_final_dict_from_ref_dict(ref_dict: Dict) -> Dict:
+	'''
+	This function takes a reference dict as returned by retrieve_info_MetaPub_Crossref()
+	and returns a dictionary that maps the original string to a dictionary that
+	contains a normalised reference str, the DOI and the PMID (see get_final_dict_from_ref_str()).
+	'''
 	if ref_dict:
 		if ref_dict["reference_retrieved_from"] == "Crossref":
 			norm_dict = normalize_crossref_dict(ref_dict)
 			if norm_dict['query_str'][0] == '{':
-				norm_dict['query_str'] = eval(norm_dict['query_str'])['query_str']
+				norm_dict['query_str'] = ast.literal_eval(norm_dict['query_str'])['query_str']
 		elif ref_dict['reference_retrieved_from'] == 'MetaPub':
 			norm_dict = normalize_metapub_dict(ref_dict) 
 		references = {}
@@ -670,8 +1323,83 @@ def get_final_dict_from_ref_str(ref_str: str) -> Dict:
 
 
 
-if __name__ == '__main__':
-	if len(sys.argv) == 2:
-		retrieve_info_MetaPub_Crossref(sys.argv[1])
+def read_reference_lines(input_file, input_format: str = 'auto', field: str = 'reference') -> Iterator[str]:
+	'''
+	This function takes an opened text file and lazily yields the reference str in it. Every line contains
+	either a plain reference str or (input_format 'jsonl') a JSON str or object with the reference in the given field.
+	With input_format 'auto', lines that start with '{' or '"' are read as JSON.
+	'''
+	for line in input_file:
+		line = line.strip()
+		if not line:
+			continue
+		if input_format == 'jsonl' or (input_format == 'auto' and line[0] in '{"'):
+			record = json.loads(line)
+			if isinstance(record, dict):
+				record = record.get(field)
+			if not record:
+				continue
+			line = str(record)
+		yield line
+
+
+async def stream_final_dicts(references: Iterable[str], output_file, ordered: bool = False, max_in_flight: int = 1000) -> int:
+	'''
+	This function takes an iterable of reference str and an opened text file. The references are resolved
+	concurrently (see async_resolution.resolution_engine, at most max_in_flight at once) and for every reference,
+	a JSON line in the format of get_final_dict_from_ref_str() ({reference: {'reference': ..., 'DOI': ..., 'PMID': ...}},
+	the value is null if the reference could not be resolved) is written as soon as it is available (or in the
+	order of the input if ordered). It returns the number of written lines.
+	'''
+	import async_resolution as ar
+	written_lines = 0
+	async with ar.resolution_engine(max_in_flight=max_in_flight) as engine:
+		# References that raise an error are yielded with None (see resolution_engine.map())
+		async for ref_str, final_dict in engine.resolve_many(references, ordered):
+			if not final_dict:
+				final_dict = {ref_str: None}
+			output_file.write(dumps(final_dict) + '\n')
+			output_file.flush()
+			written_lines += 1
+	return written_lines
+
+
+def main(argv: List[str] = None) -> None:
+	'''This function is the command line interface: it reads reference str (plain lines or JSONL) from
+	a file or stdin and writes the normalised references as JSONL to stdout as they are resolved.'''
+	import argparse
+	import asyncio
+	argument_parser = argparse.ArgumentParser(description='Resolve and normalise references. Reads one reference per line '
+																'(plain text or JSONL) and writes one JSON object per reference.')
+	argument_parser.add_argument('input', nargs='?', default='-', help='Input file (default: stdin)')
+	argument_parser.add_argument('-r', '--reference', action='append', help='Resolve this reference (can be given several times)')
+	argument_parser.add_argument('--format', default='auto', choices=['auto', 'plain', 'jsonl'], help='Format of the input lines')
+	argument_parser.add_argument('--field', default='reference', help='Key of the reference in JSONL input objects')
+	argument_parser.add_argument('--ordered', action='store_true', help='Write the results in the order of the input')
+	argument_parser.add_argument('--max-in-flight', type=int, default=1000, help='Maximal number of references resolved at once')
+	args = argument_parser.parse_args(argv)
+	if args.reference:
+		input_file = None
+		references = iter(args.reference)
 	else:
-		print('Usage: ' + sys.argv[0] + 'unstructured_publication_ID')
+		input_file = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+		references = read_reference_lines(input_file, args.format, args.field)
+	try:
+		asyncio.run(stream_final_dicts(references, sys.stdout, args.ordered, args.max_in_flight))
+		# stdout only contains the results
+		print_crossref_statistics(sys.stderr)
+	except BrokenPipeError:
+		# The reading end of the pipe has been closed (eg. | head). stdout is redirected to devnull,
+		# so that flushing it at interpreter exit does not fail again.
+		devnull = os.open(os.devnull, os.O_WRONLY)
+		os.dup2(devnull, sys.stdout.fileno())
+		sys.exit(1)
+	finally:
+		if input_file not in (None, sys.stdin):
+			input_file.close()
+
+
+if __name__ == '__main__':
+	# Run main() of the imported module so that async_resolution and the CLI share the module state
+	import citation_normalisation
+	citation_normalisation.main()
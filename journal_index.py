@@ -0,0 +1,166 @@
+import re
+import json
+import threading
+import functools
+from typing import Iterable
+import reference_parser as rp
+from result_files import iter_jsonl
+
+
+# ISO4-style abbreviations of words that frequently occur in the titles of COCONUT journals
+ISO4_WORD_ABBREVIATIONS = {'academy': 'acad', 'acta': 'acta', 'agricultural': 'agric', 'american': 'am',
+						   'analytical': 'anal', 'annals': 'ann', 'antibiotics': 'antibiot', 'applied': 'appl',
+						   'archives': 'arch', 'biochemical': 'biochem', 'biochemistry': 'biochem', 'biological': 'biol',
+						   'bioorganic': 'bioorg', 'bioscience': 'biosci', 'biotechnology': 'biotechnol', 'botany': 'bot',
+						   'bulletin': 'bull', 'canadian': 'can', 'chemical': 'chem', 'chemistry': 'chem',
+						   'chimica': 'chim', 'chinese': 'chin', 'communications': 'commun', 'ecology': 'ecol',
+						   'environmental': 'environ', 'ethnopharmacology': 'ethnopharmacol', 'european': 'eur',
+						   'helvetica': 'helv', 'industrial': 'ind', 'international': 'int', 'japanese': 'jpn',
+						   'journal': 'j', 'khimiya': 'khim', 'letters': 'lett', 'magnetic': 'magn', 'marine': 'mar',
+						   'medica': 'med', 'medicinal': 'med', 'medicine': 'med', 'microbiology': 'microbiol',
+						   'molecular': 'mol', 'national': 'natl', 'natural': 'nat', 'naturforschung': 'naturforsch',
+						   'organic': 'org', 'pharmaceutical': 'pharm', 'pharmacognosy': 'pharmacogn',
+						   'pharmacology': 'pharmacol', 'pharmacy': 'pharm', 'physiologia': 'physiol',
+						   'physiology': 'physiol', 'phytochemistry': 'phytochem', 'plantarum': 'plant',
+						   'prirodnykh': 'prir', 'proceedings': 'proc', 'products': 'prod', 'research': 'res',
+						   'resonance': 'reson', 'review': 'rev', 'reviews': 'rev', 'science': 'sci', 'sciences': 'sci',
+						   'section': 'sect', 'society': 'soc', 'soedinenii': 'soedin', 'structure': 'struct',
+						   'systematics': 'syst', 'zeitschrift': 'z'}
+# Words that are left out in ISO4 abbreviations
+ISO4_STOP_WORDS = {'of', 'the', 'and', 'for', 'in', 'on', 'de', 'la', 'und', 'fur'}
+
+
+@functools.lru_cache(maxsize=100000)
+def journal_key(journal_name: str) -> str:
+	'''This function takes a journal name and returns its normalised form that only
+	consists of its lowercase alphabetic characters ('J. Nat. Prod.' -> 'jnatprod').'''
+	return ''.join(re.findall('[A-Za-z]+', journal_name)).lower()
+
+
+@functools.lru_cache(maxsize=100000)
+def iso4_key(journal_title: str) -> str:
+	'''This function takes a full journal title and returns the normalised form (see journal_key())
+	of its ISO4-style abbreviation ('Journal of Natural Products' -> 'jnatprod').'''
+	words = re.findall('[A-Za-z]+', journal_title.lower())
+	return ''.join([ISO4_WORD_ABBREVIATIONS.get(word, word) for word in words if word not in ISO4_STOP_WORDS])
+
+
+# Bounded, because every pair of a parsed journal name and a Crossref candidate title is a new entry
+@functools.lru_cache(maxsize=50000)
+def subsequence_match(key_1: str, key_2: str) -> bool:
+	'''
+	This function takes two normalised journal names and determines whether all letters from the
+	shorter string appear in the longer string in the same order. If the condition
+	is fulfilled, it returns True.
+	'''
+	longer_str = max([key_1, key_2], key=len)
+	shorter_str = min([key_1, key_2], key=len)
+	# Check if chars from shorter str can be matched with longer str in right order
+	longer_chars = iter(longer_str)
+	return all(short_char in longer_chars for short_char in shorter_str)
+
+
+class journal_index:
+	'''
+	This class contains an index that maps normalised journal names and abbreviations to the
+	normalised canonical journal titles they stand for. Canonical titles are registered together
+	with their ISO4-style abbreviation, pairs of abbreviations and titles that have been confirmed
+	can be learned and saved. Only confirmed titles are registered, so that the index does not grow
+	with every rejected Crossref candidate. Matches are answered by a dict lookup or the ISO4-style
+	abbreviation of the title, the subsequence check is only used as a fallback.
+	'''
+	def __init__(self) -> None:
+		self.canonical_titles = {}
+		self._lock = threading.Lock()
+
+
+	def __len__(self) -> int:
+		return len(self.canonical_titles)
+
+
+	def add_title(self, journal_title: str) -> None:
+		'''This function takes a canonical journal title and registers it under its own
+		normalised form and its ISO4-style abbreviation.'''
+		title_key = journal_key(journal_title)
+		if not title_key:
+			return
+		with self._lock:
+			for key in [title_key, iso4_key(journal_title)]:
+				self.canonical_titles.setdefault(key, set()).add(title_key)
+
+
+	def add_titles(self, journal_titles: Iterable[str]) -> None:
+		'''This function takes an iterable of canonical journal titles and registers all of them.'''
+		for journal_title in journal_titles:
+			self.add_title(journal_title)
+
+
+	def add_abbreviation(self, abbreviation: str, journal_title: str) -> None:
+		'''This function takes an abbreviated journal name and the canonical title it stands for
+		(eg. from a confirmed retrieval) and registers the pair.'''
+		abbreviation_key = journal_key(abbreviation)
+		self.add_title(journal_title)
+		if abbreviation_key:
+			with self._lock:
+				self.canonical_titles.setdefault(abbreviation_key, set()).add(journal_key(journal_title))
+
+
+	def match(self, journal_name: str, journal_title: str) -> bool:
+		'''
+		This function takes a (possibly abbreviated) journal name and a canonical journal title and
+		returns True if they refer to the same journal. The index is not changed (see add_abbreviation()).
+		If the index does not know the pair and the name is not the ISO4-style abbreviation of the title,
+		the subsequence check (see subsequence_match()) is used.
+		'''
+		name_key = journal_key(journal_name)
+		title_key = journal_key(journal_title)
+		if name_key == title_key:
+			return True
+		if title_key in self.canonical_titles.get(name_key, ()):
+			return True
+		if name_key == iso4_key(journal_title):
+			return True
+		return subsequence_match(name_key, title_key)
+
+
+	def save(self, path: str) -> None:
+		'''This function saves the index as a JSON file at the given path.'''
+		with self._lock:
+			index = {key: sorted(title_keys) for key, title_keys in self.canonical_titles.items()}
+		with open(path, 'w') as output:
+			json.dump(index, output)
+
+
+	def load(self, path: str) -> None:
+		'''This function loads an index that has been saved with save() and merges it into this index.'''
+		with open(path, 'r') as index_file:
+			index = json.load(index_file)
+		with self._lock:
+			for key, title_keys in index.items():
+				self.canonical_titles.setdefault(key, set()).update(title_keys)
+
+
+def build_journal_index(results_path: str, index: journal_index = None) -> journal_index:
+	'''
+	This function takes the path of a JSONL file with the raw results of a previous run ({"reference": ..., "result": ...}
+	per line, see checkpoint_store) and registers the journal names in them in the given index (or a new one), which
+	it returns. The container titles of the Crossref results are registered as canonical titles together with
+	their short titles. For results that have been confirmed via the parsed reference (Crossref_extended_query),
+	the parsed journal name is registered as abbreviation of the title.
+	'''
+	if index is None:
+		index = journal_index()
+	parser = rp.reference_parser()
+	for record in iter_jsonl(results_path):
+		result = record.get('result')
+		if not result or result.get('reference_retrieved_from') != 'Crossref' or not result.get('container-title'):
+			continue
+		journal_title = result['container-title'][0]
+		index.add_title(journal_title)
+		for short_title in result.get('short-container-title') or []:
+			index.add_abbreviation(short_title, journal_title)
+		if result.get('query_str_type') == 'Crossref_extended_query':
+			parsed_ref_dict = parser(record['reference'])
+			if parsed_ref_dict and parsed_ref_dict.get('journal'):
+				index.add_abbreviation(parsed_ref_dict['journal'], journal_title)
+	return index
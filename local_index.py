@@ -0,0 +1,238 @@
+import os
+import re
+import gzip
+import json
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Iterator, Tuple
+
+
+def open_dump(path: str, binary: bool = False):
+	'''This function takes the path of a (optionally gzipped) dump file and returns an opened file object.'''
+	if path.endswith('.gz'):
+		return gzip.open(path, 'rb') if binary else gzip.open(path, 'rt', encoding='utf-8')
+	return open(path, 'rb') if binary else open(path, 'r', encoding='utf-8')
+
+
+def crossref_index_keys(crossref_dict: Dict) -> Dict:
+	'''This function takes a work record as returned by the Crossref API and returns a dict
+	with the keys under which it is indexed (DOI, first author surname, year, volume, first page, journal).'''
+	keys = {'doi': crossref_dict.get('DOI'), 'pmid': None}
+	authors = crossref_dict.get('author') or []
+	keys['first_author_surname'] = authors[0].get('family') if authors else None
+	try:
+		keys['year'] = str(crossref_dict['issued']['date-parts'][0][0])
+	except (KeyError, IndexError, TypeError):
+		keys['year'] = None
+	keys['volume'] = crossref_dict.get('volume')
+	keys['first_page'] = crossref_dict['page'].split('-')[0] if crossref_dict.get('page') else None
+	container_titles = crossref_dict.get('container-title') or []
+	keys['journal'] = container_titles[0] if container_titles else None
+	return keys
+
+
+def parse_pubmed_article(article_element: ET.Element) -> Dict:
+	'''This function takes a PubmedArticle XML element (PubMed baseline/update files) and returns a dict
+	with the keys that metapub provides for the normalisation (see cn.normalize_metapub_dict()).'''
+	citation = article_element.find('MedlineCitation')
+	article = citation.find('Article')
+	journal = article.find('Journal')
+	metapub_dict = {'pmid': citation.findtext('PMID'),
+					'title': article.findtext('ArticleTitle'),
+					'journal': journal.findtext('ISOAbbreviation') or journal.findtext('Title'),
+					'volume': journal.findtext('JournalIssue/Volume'),
+					'issue': journal.findtext('JournalIssue/Issue'),
+					'year': journal.findtext('JournalIssue/PubDate/Year'),
+					'pages': article.findtext('Pagination/MedlinePgn'),
+					'doi': None}
+	metapub_dict['first_page'] = metapub_dict['pages'].split('-')[0] if metapub_dict['pages'] else None
+	# metapub author format: 'Lustig P'
+	metapub_dict['authors'] = []
+	for author in article.findall('AuthorList/Author'):
+		if author.findtext('LastName'):
+			metapub_dict['authors'].append((author.findtext('LastName') + ' ' + (author.findtext('Initials') or '')).strip())
+	for article_id in article_element.findall('PubmedData/ArticleIdList/ArticleId'):
+		if article_id.get('IdType') == 'doi':
+			metapub_dict['doi'] = article_id.text
+	if not metapub_dict['doi']:
+		for elocation_id in article.findall('ELocationID'):
+			if elocation_id.get('EIdType') == 'doi':
+				metapub_dict['doi'] = elocation_id.text
+	return metapub_dict
+
+
+class local_index:
+	'''
+	This class contains an offline bibliographic index (SQLite) that is built from local metadata dumps
+	(Crossref JSONL snapshots or PubMed XML files). Records can be looked up by DOI, PMID,
+	(first author surname, year, volume, first page) and by a free-text search over journal titles.
+	Crossref records are returned in the format of the Crossref API, PubMed records in the format
+	of the metapub dicts, so that they can be normalised like network results.
+	'''
+	def __init__(self, path: str = 'citation_normalisation_index.sqlite') -> None:
+		self.path = os.path.normpath(path)
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(self.path, check_same_thread=False)
+		self._connection.execute('''CREATE TABLE IF NOT EXISTS records (
+										id INTEGER PRIMARY KEY,
+										source TEXT NOT NULL,
+										doi TEXT,
+										pmid TEXT,
+										first_author_surname TEXT,
+										year TEXT,
+										volume TEXT,
+										first_page TEXT,
+										journal TEXT,
+										record TEXT NOT NULL)''')
+		self._connection.execute('CREATE INDEX IF NOT EXISTS records_doi ON records (doi)')
+		self._connection.execute('CREATE INDEX IF NOT EXISTS records_pmid ON records (pmid)')
+		self._connection.execute('''CREATE INDEX IF NOT EXISTS records_citation
+									ON records (first_author_surname, year, volume, first_page)''')
+		self._connection.execute('CREATE INDEX IF NOT EXISTS records_year_volume_page ON records (year, volume, first_page)')
+		# Full text search over the journal titles (if SQLite has been compiled with FTS5)
+		try:
+			self._connection.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS journals
+										USING fts5(journal, content='records', content_rowid='id')''')
+			self.full_text_search = True
+		except sqlite3.OperationalError:
+			self.full_text_search = False
+		self._connection.commit()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def __len__(self) -> int:
+		with self._lock:
+			return self._connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+
+	def close(self) -> None:
+		'''This function closes the underlying database connection.'''
+		with self._lock:
+			self._connection.close()
+
+
+	def add_records(self, source: str, records: Iterator[Tuple[Dict, Dict]], batch_size: int = 10000) -> int:
+		'''
+		This function takes the source ('Crossref' or 'PubMed') and an iterable of (index keys, record) tuples
+		and adds them to the index in batches of batch_size records. It returns the number of added records.
+		'''
+		added_records = 0
+		batch = []
+		for keys, record in records:
+			batch.append((source,
+						  keys['doi'].lower() if keys['doi'] else None,
+						  keys['pmid'],
+						  keys['first_author_surname'].lower() if keys['first_author_surname'] else None,
+						  keys['year'],
+						  keys['volume'],
+						  keys['first_page'],
+						  keys['journal'],
+						  json.dumps(record)))
+			if len(batch) >= batch_size:
+				added_records += self._insert(batch)
+				batch = []
+		if batch:
+			added_records += self._insert(batch)
+		return added_records
+
+
+	def _insert(self, batch: List[Tuple]) -> int:
+		'''This function inserts a batch of rows into the records table (and the journal search table).'''
+		with self._lock:
+			for row in batch:
+				cursor = self._connection.execute('''INSERT INTO records (source, doi, pmid, first_author_surname, year,
+													 volume, first_page, journal, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', row)
+				if self.full_text_search and row[7]:
+					self._connection.execute('INSERT INTO journals (rowid, journal) VALUES (?, ?)', (cursor.lastrowid, row[7]))
+			self._connection.commit()
+		return len(batch)
+
+
+	def ingest_crossref_jsonl(self, path: str) -> int:
+		'''This function takes the path of a Crossref dump in JSONL format (one work record per line,
+		optionally gzipped) and adds all records to the index. It returns the number of added records.'''
+		def records():
+			with open_dump(path) as dump:
+				for line in dump:
+					if line.strip():
+						crossref_dict = json.loads(line)
+						yield crossref_index_keys(crossref_dict), crossref_dict
+		return self.add_records('Crossref', records())
+
+
+	def ingest_pubmed_xml(self, path: str) -> int:
+		'''This function takes the path of a PubMed XML file (PubmedArticleSet, optionally gzipped),
+		parses it element by element and adds all records to the index. It returns the number of added records.'''
+		def records():
+			with open_dump(path, binary=True) as dump:
+				for _, element in ET.iterparse(dump):
+					if element.tag == 'PubmedArticle':
+						metapub_dict = parse_pubmed_article(element)
+						keys = {key: metapub_dict[key] for key in ['doi', 'pmid', 'year', 'volume', 'first_page', 'journal']}
+						keys['first_author_surname'] = metapub_dict['authors'][0].rsplit(' ', 1)[0] if metapub_dict['authors'] else None
+						yield keys, metapub_dict
+						element.clear()
+		return self.add_records('PubMed', records())
+
+
+	def _select(self, where: str, params: Tuple, limit: int = 50) -> List[Tuple[str, Dict]]:
+		'''This function returns a list of (source, record) tuples of the records that fulfil the where clause.'''
+		with self._lock:
+			rows = self._connection.execute('SELECT source, record FROM records WHERE ' + where + ' LIMIT ?',
+											params + (limit,)).fetchall()
+		return [(source, json.loads(record)) for source, record in rows]
+
+
+	def get_by_DOI(self, DOI: str) -> Tuple[str, Dict]:
+		'''This function takes a DOI str and returns a (source, record) tuple or None.'''
+		results = self._select('doi = ?', (DOI.strip().lower(),), 1)
+		if results:
+			return results[0]
+
+
+	def get_by_PMID(self, PMID: str) -> Tuple[str, Dict]:
+		'''This function takes a PMID str and returns a (source, record) tuple or None.'''
+		results = self._select('pmid = ?', (str(PMID).strip(),), 1)
+		if results:
+			return results[0]
+
+
+	def get_by_citation(self, first_author_surname: str, year: str, volume: str, first_page: str) -> List[Tuple[str, Dict]]:
+		'''This function takes the surname of the first author, the year, the volume and the first page
+		and returns a list of (source, record) tuples of the matching records.'''
+		return self._select('first_author_surname = ? AND year = ? AND volume = ? AND first_page = ?',
+							(first_author_surname.strip().lower(), str(year), str(volume), str(first_page)))
+
+
+	def search_journal(self, journal: str, year: str = None, volume: str = None, first_page: str = None,
+					   limit: int = 50) -> List[Tuple[str, Dict]]:
+		'''
+		This function takes a (possibly abbreviated) journal name and optionally year, volume and first page.
+		It returns a list of (source, record) tuples of the records whose journal title contains words
+		that start with the words of the given journal name (eg. 'Phytochem.' -> 'Phytochemistry').
+		'''
+		words = re.findall('[A-Za-z]+', journal)
+		if not words:
+			return []
+		where = []
+		params = ()
+		if self.full_text_search:
+			where.append('id IN (SELECT rowid FROM journals WHERE journals MATCH ?)')
+			params += (' '.join(['"{}"*'.format(word) for word in words]),)
+		else:
+			for word in words:
+				where.append('journal LIKE ?')
+				params += ('%' + word + '%',)
+		for column, value in [('year', year), ('volume', volume), ('first_page', first_page)]:
+			if value:
+				where.append(column + ' = ?')
+				params += (str(value),)
+		return self._select(' AND '.join(where), params, limit)
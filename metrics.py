@@ -0,0 +1,200 @@
+import os
+import time
+import json
+import threading
+import functools
+from typing import Dict, Tuple
+
+
+# Upper bounds (seconds) of the buckets of the latency histograms
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class null_timer:
+	'''This class contains a context manager that does nothing (returned by metrics_registry.timed()
+	if the instrumentation is disabled).'''
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		pass
+
+
+NULL_TIMER = null_timer()
+
+
+class timer:
+	'''This class contains a context manager that measures the time spent in its block and adds it
+	to a histogram of a metrics_registry.'''
+	__slots__ = ('registry', 'name', 'labels', 'start')
+
+	def __init__(self, registry, name: str, labels: Dict[str, str]) -> None:
+		self.registry = registry
+		self.name = name
+		self.labels = labels
+
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class metrics_registry:
+	'''
+	This class contains a registry of counters and latency histograms (both with labels, eg. backend
+	or stage). The metrics can be exported as JSON snapshot or in the Prometheus text format.
+	If the registry is disabled (default), all recording functions return immediately so that the
+	instrumentation of the pipeline does not cost anything noticeable.
+	'''
+	def __init__(self, enabled: bool = False, buckets: Tuple[float] = DEFAULT_BUCKETS,
+				 prefix: str = 'citation_normalisation') -> None:
+		self.enabled = enabled
+		self.buckets = tuple(sorted(buckets))
+		self.prefix = prefix
+		self.counters = {}
+		self.histograms = {}
+		self._lock = threading.Lock()
+
+
+	def enable(self) -> None:
+		'''This function switches the recording of metrics on.'''
+		self.enabled = True
+
+
+	def disable(self) -> None:
+		'''This function switches the recording of metrics off (recorded metrics are kept).'''
+		self.enabled = False
+
+
+	def reset(self) -> None:
+		'''This function deletes all recorded metrics.'''
+		with self._lock:
+			self.counters = {}
+			self.histograms = {}
+
+
+	def increment(self, name: str, amount: float = 1, **labels) -> None:
+		'''This function takes the name of a counter, an amount and labels and adds the amount to the counter.'''
+		if not self.enabled:
+			return
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			self.counters[key] = self.counters.get(key, 0) + amount
+
+
+	def observe(self, name: str, value: float, **labels) -> None:
+		'''This function takes the name of a histogram, a value (seconds) and labels and records the value.'''
+		if not self.enabled:
+			return
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			if key not in self.histograms:
+				# Counts per bucket (+ one for values above the highest bound), sum, count
+				self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+			histogram = self.histograms[key]
+			for index, bound in enumerate(self.buckets):
+				if value <= bound:
+					break
+			else:
+				index = len(self.buckets)
+			histogram[0][index] += 1
+			histogram[1] += value
+			histogram[2] += 1
+
+
+	def timed(self, name: str, **labels):
+		'''This function takes the name of a histogram and labels and returns a context manager that
+		records the time spent in its block.
+		Example:
+		with METRICS.timed('stage_seconds', stage='parsing'):
+			parsed_ref_dict = parser(ref_str)
+		'''
+		if not self.enabled:
+			return NULL_TIMER
+		return timer(self, name, labels)
+
+
+	def timed_function(self, name: str, **labels):
+		'''This decorator takes the name of a histogram and labels and records the duration of
+		every call of the decorated function.'''
+		def decorator(function):
+			@functools.wraps(function)
+			def timed_function_wrapper(*args, **kwargs):
+				if not self.enabled:
+					return function(*args, **kwargs)
+				with timer(self, name, labels):
+					return function(*args, **kwargs)
+			return timed_function_wrapper
+		return decorator
+
+
+	def snapshot(self) -> Dict:
+		'''This function returns a dict with the current values of all counters and histograms.'''
+		with self._lock:
+			counters = [{'name': name, 'labels': dict(labels), 'value': value}
+						for (name, labels), value in sorted(self.counters.items())]
+			histograms = []
+			for (name, labels), (bucket_counts, total, count) in sorted(self.histograms.items()):
+				cumulative_counts = []
+				cumulative_count = 0
+				for bucket_count in bucket_counts:
+					cumulative_count += bucket_count
+					cumulative_counts.append(cumulative_count)
+				buckets = {str(bound): cumulative_count for bound, cumulative_count in zip(self.buckets, cumulative_counts)}
+				buckets['+Inf'] = count
+				histograms.append({'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'buckets': buckets})
+		return {'enabled': self.enabled, 'counters': counters, 'histograms': histograms}
+
+
+	def to_json(self) -> str:
+		'''This function returns a JSON snapshot of all metrics (see snapshot()).'''
+		return json.dumps(self.snapshot(), indent=2)
+
+
+	def save(self, path: str) -> None:
+		'''This function writes a JSON snapshot of all metrics to the given path.'''
+		with open(path, 'w') as output:
+			output.write(self.to_json())
+
+
+	def to_prometheus(self) -> str:
+		'''This function returns all metrics in the Prometheus text exposition format.'''
+		snapshot = self.snapshot()
+		lines = []
+		declared_names = set()
+		for counter in snapshot['counters']:
+			metric_name = '{}_{}'.format(self.prefix, counter['name'])
+			if metric_name not in declared_names:
+				lines.append('# TYPE {} counter'.format(metric_name))
+				declared_names.add(metric_name)
+			lines.append('{}{} {}'.format(metric_name, format_labels(counter['labels']), counter['value']))
+		for histogram in snapshot['histograms']:
+			metric_name = '{}_{}'.format(self.prefix, histogram['name'])
+			if metric_name not in declared_names:
+				lines.append('# TYPE {} histogram'.format(metric_name))
+				declared_names.add(metric_name)
+			for bound, cumulative_count in histogram['buckets'].items():
+				labels = dict(histogram['labels'], le=bound)
+				lines.append('{}_bucket{} {}'.format(metric_name, format_labels(labels), cumulative_count))
+			lines.append('{}_sum{} {}'.format(metric_name, format_labels(histogram['labels']), histogram['sum']))
+			lines.append('{}_count{} {}'.format(metric_name, format_labels(histogram['labels']), histogram['count']))
+		return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+	'''This function takes a dict of labels and returns them in the Prometheus format ('{backend="Crossref"}').'''
+	if not labels:
+		return ''
+	escaped_labels = ['{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+					  for key, value in labels.items()]
+	return '{' + ','.join(escaped_labels) + '}'
+
+
+# Registry that is shared by all modules of the pipeline. It is disabled unless the environment
+# variable CITATION_NORMALISATION_METRICS is set or METRICS.enable() is called.
+METRICS = metrics_registry(enabled=bool(os.environ.get('CITATION_NORMALISATION_METRICS')))
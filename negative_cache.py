@@ -0,0 +1,119 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict
+
+
+# Why a reference could not be resolved:
+# no_parse: reference_parser could not extract enough information for a Crossref query
+# no_candidates: the backends did not return anything for the reference
+# mismatch: Crossref returned candidates, but is_same_publication() rejected all of them
+# backend_error: a backend could not be reached (timeouts, 5xx, open circuit breaker etc.)
+FAILURE_REASONS = ('no_parse', 'no_candidates', 'mismatch', 'backend_error')
+
+# Seconds until a failed reference is retried, per failure reason. Deterministic failures are
+# skipped for a long time, transient backend errors are retried in the next run.
+DEFAULT_RETRY_AFTER = {'no_parse': 180 * 24 * 3600,
+					   'no_candidates': 30 * 24 * 3600,
+					   'mismatch': 30 * 24 * 3600,
+					   'backend_error': 3600}
+
+
+class negative_cache:
+	'''
+	This class contains a persistent cache (SQLite) of the references that could not be resolved,
+	together with the reason of the last failure (see FAILURE_REASONS), the time of the last attempt
+	and the number of failed attempts in a row. A reference is skipped until the retry-after period
+	of its failure reason has passed (see DEFAULT_RETRY_AFTER, configurable per reason).
+	'''
+	def __init__(self, path: str = 'citation_normalisation_negative_cache.sqlite', retry_after: Dict[str, float] = None) -> None:
+		self.path = os.path.normpath(path)
+		self.retry_after = dict(DEFAULT_RETRY_AFTER)
+		if retry_after:
+			for reason, seconds in retry_after.items():
+				self.set_retry_after(reason, seconds)
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(self.path, check_same_thread=False)
+		self._connection.execute('PRAGMA journal_mode=WAL')
+		self._connection.execute('''CREATE TABLE IF NOT EXISTS failures (
+										reference TEXT PRIMARY KEY,
+										reason TEXT NOT NULL,
+										failed_at REAL NOT NULL,
+										failures INTEGER NOT NULL)''')
+		self._connection.commit()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def __len__(self) -> int:
+		with self._lock:
+			return self._connection.execute('SELECT COUNT(*) FROM failures').fetchone()[0]
+
+
+	def close(self) -> None:
+		'''This function closes the underlying database connection.'''
+		with self._lock:
+			self._connection.close()
+
+
+	def set_retry_after(self, reason: str, seconds: float) -> None:
+		'''This function takes a failure reason and the number of seconds after which references that
+		failed for this reason are retried (0: always retry, None: never retry).'''
+		if reason not in FAILURE_REASONS:
+			raise ValueError('Unknown failure reason: {} (expected one of {})'.format(reason, ', '.join(FAILURE_REASONS)))
+		self.retry_after[reason] = seconds
+
+
+	def get(self, reference: str) -> Dict:
+		'''
+		This function takes a reference str and returns its failure entry (reason, failed_at, failures,
+		retry_at) if the reference failed and must not be retried yet. Otherwise, it returns None.
+		'''
+		with self._lock:
+			row = self._connection.execute('SELECT reason, failed_at, failures FROM failures WHERE reference = ?',
+										   (reference,)).fetchone()
+			if row:
+				retry_after = self.retry_after.get(row[0], 0)
+				retry_at = None if retry_after is None else row[1] + retry_after
+				if retry_at is None or time.time() < retry_at:
+					self.hits += 1
+					return {'reason': row[0], 'failed_at': row[1], 'failures': row[2], 'retry_at': retry_at}
+			self.misses += 1
+
+
+	def record(self, reference: str, reason: str) -> None:
+		'''This function takes a reference str and the reason why it could not be resolved and saves the failure.'''
+		if reason not in FAILURE_REASONS:
+			raise ValueError('Unknown failure reason: {} (expected one of {})'.format(reason, ', '.join(FAILURE_REASONS)))
+		with self._lock:
+			self._connection.execute('''INSERT INTO failures (reference, reason, failed_at, failures) VALUES (?, ?, ?, 1)
+										ON CONFLICT (reference) DO UPDATE SET reason = excluded.reason,
+										failed_at = excluded.failed_at, failures = failures.failures + 1''',
+									 (reference, reason, time.time()))
+			self._connection.commit()
+
+
+	def discard(self, reference: str) -> None:
+		'''This function takes a reference str that has been resolved and deletes its failure entry.'''
+		with self._lock:
+			self._connection.execute('DELETE FROM failures WHERE reference = ?', (reference,))
+			self._connection.commit()
+
+
+	def statistics(self) -> Dict:
+		'''This function returns a dict with the number of skipped references (hits), the number of
+		lookups without a valid entry (misses) and the number of saved failures per reason.'''
+		with self._lock:
+			reasons = dict(self._connection.execute('SELECT reason, COUNT(*) FROM failures GROUP BY reason').fetchall())
+		return {'hits': self.hits,
+				'misses': self.misses,
+				'failures': {reason: reasons.get(reason, 0) for reason in FAILURE_REASONS}}
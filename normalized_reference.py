@@ -0,0 +1,81 @@
+from collections.abc import MutableMapping
+from typing import Dict, Iterator
+
+
+# Normalised publication information and provenance (see cn.normalize_metapub_dict() and cn.normalize_crossref_dict())
+NORMALIZED_FIELDS = ('title', 'abstract', 'authors', 'first_author_surname', 'year', 'volume', 'issue', 'pages',
+					 'first_page', 'journal', 'DOI', 'PMID', 'reference_retrieved_from', 'query_str_type', 'query_str')
+
+
+class normalized_reference(MutableMapping):
+	'''
+	This class contains a compact record of a normalised reference. The fields are stored in slots
+	(no dict per record) and are accessible as attributes. For backward compatibility, the record also
+	behaves like the former normalised dicts: normalized['journal'], 'journal' in normalized,
+	normalized.keys(), normalized.get('issue'), dict(normalized) etc. Like in the dicts, a field only
+	exists (is in keys()) once it has been set, even if its value is None.
+	'''
+	__slots__ = NORMALIZED_FIELDS
+
+	def __init__(self, fields: Dict = None, **kwargs) -> None:
+		if fields:
+			for key, value in fields.items():
+				self[key] = value
+		for key, value in kwargs.items():
+			self[key] = value
+
+
+	def __getitem__(self, key: str):
+		# Only fields are items, not methods like keys() or to_dict()
+		if key not in NORMALIZED_FIELDS:
+			raise KeyError(key)
+		try:
+			return getattr(self, key)
+		except AttributeError:
+			raise KeyError(key)
+
+
+	def __setitem__(self, key: str, value) -> None:
+		if key not in NORMALIZED_FIELDS:
+			raise KeyError('{} is not a field of normalized_reference'.format(key))
+		setattr(self, key, value)
+
+
+	def __delitem__(self, key: str) -> None:
+		if key not in NORMALIZED_FIELDS:
+			raise KeyError(key)
+		try:
+			delattr(self, key)
+		except AttributeError:
+			raise KeyError(key)
+
+
+	def __contains__(self, key) -> bool:
+		return key in NORMALIZED_FIELDS and hasattr(self, key)
+
+
+	def __iter__(self) -> Iterator[str]:
+		for key in NORMALIZED_FIELDS:
+			if hasattr(self, key):
+				yield key
+
+
+	def __len__(self) -> int:
+		return sum([1 for key in NORMALIZED_FIELDS if hasattr(self, key)])
+
+
+	def __repr__(self) -> str:
+		return 'normalized_reference({})'.format(self.to_dict())
+
+
+	def __getstate__(self) -> Dict:
+		return self.to_dict()
+
+
+	def __setstate__(self, state: Dict) -> None:
+		self.__init__(state)
+
+
+	def to_dict(self) -> Dict:
+		'''This function returns the set fields as dict (the format of the former normalised dicts).'''
+		return {key: getattr(self, key) for key in NORMALIZED_FIELDS if hasattr(self, key)}
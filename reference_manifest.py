@@ -0,0 +1,126 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict
+
+
+# Failed references are retried once this many seconds have passed since the last attempt
+RETRY_AFTER = 30 * 24 * 3600
+
+
+def reference_hash(reference: str) -> bytes:
+	'''This function takes a reference str and returns its content hash (as used in the manifest).'''
+	return hashlib.blake2b(reference.encode('utf-8'), digest_size=16).digest()
+
+
+class reference_manifest:
+	'''
+	This class contains a manifest (SQLite) of all references that have been resolved: content hash of the
+	reference str, resolution status ('resolved' or 'failed'), backend (reference_retrieved_from),
+	time of the last attempt and number of failed attempts in a row. It is used for incremental runs
+	(see retrieve_COCONUT_references.incremental_retrieval_coordination()): only references that are not
+	in the manifest or that failed more than retry_after seconds ago have to be resolved again.
+	Updates are committed in batches of commit_every rows (and when the manifest is flushed or closed).
+	'''
+	def __init__(self, path: str = 'COCONUT_reference_manifest.sqlite', retry_after: float = RETRY_AFTER, commit_every: int = 1000) -> None:
+		self.path = os.path.normpath(path)
+		self.retry_after = retry_after
+		self.commit_every = commit_every
+		self._pending = {}
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(self.path, check_same_thread=False)
+		self._connection.execute('''CREATE TABLE IF NOT EXISTS manifest (
+										hash BLOB PRIMARY KEY,
+										status TEXT NOT NULL,
+										backend TEXT,
+										attempted_at REAL NOT NULL,
+										failures INTEGER NOT NULL DEFAULT 0)''')
+		self._connection.commit()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def __len__(self) -> int:
+		self.flush()
+		with self._lock:
+			return self._connection.execute('SELECT COUNT(*) FROM manifest').fetchone()[0]
+
+
+	def close(self) -> None:
+		'''This function commits the pending updates and closes the underlying database connection.'''
+		self.flush()
+		with self._lock:
+			self._connection.close()
+
+
+	def get(self, reference: str) -> Dict:
+		'''This function takes a reference str and returns its manifest entry as dict
+		(status, backend, attempted_at, failures) or None if it is not in the manifest.'''
+		key = reference_hash(reference)
+		with self._lock:
+			# Pending (not yet committed) updates are answered without committing them
+			row = self._pending.get(key)
+			if row:
+				row = row[1:]
+			else:
+				row = self._connection.execute('SELECT status, backend, attempted_at, failures FROM manifest WHERE hash = ?',
+											   (key,)).fetchone()
+		if row:
+			return {'status': row[0], 'backend': row[1], 'attempted_at': row[2], 'failures': row[3]}
+
+
+	def is_due(self, entry: Dict, now: float = None) -> bool:
+		'''This function takes a manifest entry (see get()) and returns True if the reference has to be
+		resolved (not in the manifest or failed more than retry_after seconds ago).'''
+		if entry is None:
+			return True
+		if entry['status'] == 'failed':
+			now = time.time() if now is None else now
+			return entry['attempted_at'] + self.retry_after <= now
+		return False
+
+
+	def record(self, reference: str, ref_dict: Dict, attempted_at: float = None) -> Dict:
+		'''This function takes a reference str and the corresponding retrieved dict (None/False if nothing
+		has been found) and records the result of the attempt in the manifest. It returns the new manifest entry
+		(the failures of pending updates are only counted once they are committed).'''
+		status = 'resolved' if ref_dict else 'failed'
+		backend = ref_dict.get('reference_retrieved_from') if ref_dict else None
+		attempted_at = time.time() if attempted_at is None else attempted_at
+		entry = {'status': status, 'backend': backend, 'attempted_at': attempted_at, 'failures': int(status == 'failed')}
+		key = reference_hash(reference)
+		with self._lock:
+			self._pending[key] = (key, status, backend, attempted_at, entry['failures'])
+			if len(self._pending) < self.commit_every:
+				return entry
+		self.flush()
+		return entry
+
+
+	def flush(self) -> None:
+		'''This function commits the pending updates.'''
+		with self._lock:
+			if not self._pending:
+				return
+			self._connection.executemany('''INSERT INTO manifest (hash, status, backend, attempted_at, failures) VALUES (?, ?, ?, ?, ?)
+											ON CONFLICT (hash) DO UPDATE SET status = excluded.status, backend = excluded.backend,
+											attempted_at = excluded.attempted_at,
+											failures = CASE WHEN excluded.status = 'failed' THEN manifest.failures + 1 ELSE 0 END''',
+										 list(self._pending.values()))
+			self._connection.commit()
+			self._pending = {}
+
+
+	def statistics(self) -> Dict[str, int]:
+		'''This function returns the number of references per status.'''
+		self.flush()
+		with self._lock:
+			return dict(self._connection.execute('SELECT status, COUNT(*) FROM manifest GROUP BY status').fetchall())
@@ -0,0 +1,151 @@
+import os
+import sys
+import mmap
+import struct
+import tempfile
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, Tuple
+from result_files import dumps, loads, iter_reference_map, load_reference_map
+
+
+# File format of the compiled reference maps:
+# header (MAGIC, number of entries), offset table (one uint64 per entry, sorted by the UTF-8 bytes of the old reference),
+# records (uint32 length + old reference, uint32 length + JSON of the new reference dict)
+MAGIC = b'CNREFMAP'
+HEADER = struct.Struct('<8sQ')
+OFFSET = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+
+
+def compile_reference_map(items: Iterable[Tuple[str, Dict]], path: str) -> int:
+	'''
+	This function takes an iterable of (old reference str, new reference dict) tuples (eg. iter_reference_map())
+	and writes them into a compiled reference map at path (see reference_map). Only the keys and offsets are kept
+	in memory while compiling; the records are spilled into a temporary file. If an old reference occurs several
+	times, the last entry is used. It returns the number of entries.
+	'''
+	path = os.path.normpath(path)
+	directory = os.path.dirname(path) or '.'
+	keys = []
+	with tempfile.TemporaryFile(dir=directory) as records:
+		for old_ref, new_ref in items:
+			key = old_ref.encode('utf-8')
+			value = dumps(new_ref).encode('utf-8')
+			record = LENGTH.pack(len(key)) + key + LENGTH.pack(len(value)) + value
+			keys.append((key, len(keys), records.tell(), len(record)))
+			records.write(record)
+		# Sort by key; for duplicate keys, keep the last entry
+		keys.sort()
+		keys = [entry for index, entry in enumerate(keys) if index + 1 == len(keys) or keys[index + 1][0] != entry[0]]
+		with open(path + '.tmp', 'wb') as output:
+			output.write(HEADER.pack(MAGIC, len(keys)))
+			offset = HEADER.size + OFFSET.size * len(keys)
+			for _, _, _, record_length in keys:
+				output.write(OFFSET.pack(offset))
+				offset += record_length
+			# The records are written in key order, so that neighbouring keys are on the same pages
+			for _, _, record_offset, record_length in keys:
+				records.seek(record_offset)
+				output.write(records.read(record_length))
+		os.replace(path + '.tmp', path)
+	return len(keys)
+
+
+def is_compiled_reference_map(path: str) -> bool:
+	'''This function returns True if the file at path is a compiled reference map.'''
+	with open(path, 'rb') as input_file:
+		return input_file.read(len(MAGIC)) == MAGIC
+
+
+class reference_map(Mapping):
+	'''
+	This class contains a read-only reference map (old reference str -> {'reference': ..., 'DOI': ..., 'PMID': ...})
+	that is memory-mapped from a file written by compile_reference_map(). Opening it only reads the header,
+	lookups are binary searches over the sorted offset table, and the pages of the file are shared by all
+	processes that open it (via the page cache). It behaves like a dict: references[old_ref], old_ref in references,
+	references.get(old_ref), len(references) etc.
+	'''
+	def __init__(self, path: str) -> None:
+		self.path = os.path.normpath(path)
+		self._file = open(self.path, 'rb')
+		self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, self._length = HEADER.unpack_from(self._mmap, 0)
+		if magic != MAGIC:
+			self.close()
+			raise ValueError('{} is not a compiled reference map'.format(self.path))
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def __len__(self) -> int:
+		return self._length
+
+
+	def _key_at(self, index: int) -> Tuple[bytes, int]:
+		'''This function takes the index of an entry and returns its key and the offset of its value.'''
+		offset = OFFSET.unpack_from(self._mmap, HEADER.size + OFFSET.size * index)[0]
+		key_length = LENGTH.unpack_from(self._mmap, offset)[0]
+		key_start = offset + LENGTH.size
+		return self._mmap[key_start:key_start + key_length], key_start + key_length
+
+
+	def _find(self, key: bytes) -> int:
+		'''This function takes a key and returns the offset of its value (None if the key is not in the map).'''
+		low, high = 0, self._length
+		while low < high:
+			middle = (low + high) // 2
+			middle_key, value_offset = self._key_at(middle)
+			if middle_key < key:
+				low = middle + 1
+			elif middle_key > key:
+				high = middle
+			else:
+				return value_offset
+
+
+	def __getitem__(self, old_ref: str) -> Dict:
+		if not isinstance(old_ref, str):
+			raise KeyError(old_ref)
+		value_offset = self._find(old_ref.encode('utf-8'))
+		if value_offset is None:
+			raise KeyError(old_ref)
+		value_length = LENGTH.unpack_from(self._mmap, value_offset)[0]
+		value_start = value_offset + LENGTH.size
+		return loads(self._mmap[value_start:value_start + value_length])
+
+
+	def __contains__(self, old_ref) -> bool:
+		return isinstance(old_ref, str) and self._find(old_ref.encode('utf-8')) is not None
+
+
+	def __iter__(self) -> Iterator[str]:
+		for index in range(self._length):
+			yield self._key_at(index)[0].decode('utf-8')
+
+
+	def close(self) -> None:
+		'''This function closes the memory map and the file.'''
+		if not self._mmap.closed:
+			self._mmap.close()
+		self._file.close()
+
+
+def open_reference_map(path: str) -> Mapping:
+	'''This function takes the path of a reference map and returns a memory-mapped reference_map if it is
+	compiled, otherwise the map is loaded into a dict (see result_files.load_reference_map()).'''
+	if is_compiled_reference_map(path):
+		return reference_map(path)
+	return load_reference_map(path)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) == 3:
+		print('{} references written.'.format(compile_reference_map(iter_reference_map(sys.argv[1]), sys.argv[2])))
+	else:
+		print('Usage: python {} reference_map_JSONL_or_JSON compiled_reference_map'.format(sys.argv[0]))
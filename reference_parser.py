@@ -1,14 +1,80 @@
 import re
-from typing import Dict
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Iterable, Iterator
 
 
+# The regular expressions of all parsers are compiled once at import time.
+# Building blocks shared by several patterns
+_authors = r'(?P<authors>([A-Z\-]\.\s?)*(?P<first_author_surname>[a-zA-Z\-\s]+),?([A-Z]\.\-?\s?)?\,?\s?([A-Z]\.\s?)?)\.?(\s?\,|et al\.?,?)\s?'
+_year = r'\((?P<year>(20|1[89])\d\d)\),?\s?'
+_pages = r'(?P<pages>(?P<first_page>\d+)(\-\d+)?)'
+
+# General pattern (see reference_parser.parse_general_pattern())
+_general_journal = r"(?P<journal>[a-zA-Z\-'\s\.]+)(\s?\([A-Za-z]+\)\s?)?(,\s?Suppl.)?,?\.?\s?"
+_general_volume_issue = r'((?P<volume>(No\.?\s?)?\d+[A-Ea-e]?)(\s?\((?P<issue>\d+)\))?\.?,?\s?)?' # does not have to appear
+_typo_year = r'(8?(?P<year1>(20|1[789])\d\d)\),?\s?|8(?P<year2>(20|1[89])\d\d)9,?\s?|\((?P<year3>(20|1[89])\d\d)9,?\s?)'
+GENERAL_PATTERN = re.compile(r'^\s?' + _authors + _general_journal + _general_volume_issue + _year + _pages + r'\.?$')
+# Typo that occurs regularily (see ref_str_year_typo_$N)
+GENERAL_PATTERN_WITH_YEAR_TYPO = re.compile('^' + _authors + _general_journal + _general_volume_issue + _typo_year + _pages + r'\.?$')
+
+# Underscore pattern (see reference_parser.parse_underscore_pattern())
+_underscore_journal = r'(?P<journal>[A-Za-z\_]+)'
+_underscore_year = r'(?P<year>(20|1[89])\d\d)'
+_underscore_gap = '[_:;]'
+_underscore_volume_issue = r'(?P<volume>\d+)([_:;]?\((?P<issue>\d+)\))?'
+UNDERSCORE_PATTERN = re.compile(r'^"?\s?"?' + _underscore_journal + _underscore_gap + _underscore_year + _underscore_gap
+								+ _underscore_volume_issue + _underscore_gap + _pages + r'"?\s?"?$')
+
+# J. Chem. Soc. pattern (see reference_parser.parse_jchemsoc_pattern())
+_jchemsoc_journal = r'(?P<journal>J\.\s?Chem\.\s?Soc\.,\s?(C|Perkin\s?1)),'
+JCHEMSOC_PATTERN = re.compile(r'^\s?' + _authors + _jchemsoc_journal + _year + _pages + '$')
+
+# Harborne: The Handbook of Natural Flavonoids (see reference_parser.parse_harborne_flavonoid_pattern())
+_harborne_authors_booktitle_volume = r'^(?P<authors>Harborne),\s?(?P<title>The Handbook of Natural Flavonoids),\s?(?P<volume>[12]),\s?'
+_harborne_year = r'\((?P<year>1999)\),'
+_harborne_chapter = r'\s?(?P<chapter_no>\d+)\s?[,\.](?P<chapter_title>[a-zA-Z\s\,\-]+)'
+_harborne_rest = r'(,\s?John Wiley\s?&\s?Son)?\.?$'
+HARBORNE_FLAVONOID_PATTERN = re.compile(r'^\s?' + _harborne_authors_booktitle_volume + _harborne_year + _harborne_chapter + _harborne_rest + '$')
+
+# Harborne: Phytochemical Dictionary (see reference_parser.parse_harborne_phytochemdict_pattern())
+_phytochemdict_author_title = r'Harborne,\s?Phytochemical Dictionary Second Edition,\s?Taylor and Francis,\s?'
+_phytochemdict_year = r'\((?P<year>1999)\),\s?'
+_phytochemdict_chapter = r'Chapter\s?(?P<chapter_no>\d+)\.?'
+HARBORNE_PHYTOCHEMDICT_PATTERN = re.compile(r'^\s?' + _phytochemdict_author_title + _phytochemdict_year + _phytochemdict_chapter + '$')
+
+def ends_with_page_number(reference: str) -> bool:
+	'''This function takes a reference str and returns True if it ends with a digit (optionally followed
+	by a dot). This is a necessary condition for all patterns that end with the page numbers.'''
+	if reference.endswith('\n'):
+		reference = reference[:-1]
+	if reference.endswith('.'):
+		reference = reference[:-1]
+	return reference[-1:].isdigit()
+
+
+# Cheap prefilters: A parser is only applied if its prefilter returns True for the reference str.
+# Every prefilter is a necessary condition for a match of the corresponding pattern.
+PARSER_PREFILTERS = {'parse_general_pattern': ends_with_page_number,
+					 'parse_underscore_pattern': lambda reference: '_' in reference or ':' in reference or ';' in reference,
+					 'parse_jchemsoc_pattern': lambda reference: 'Soc.,' in reference and ends_with_page_number(reference),
+					 'parse_harborne_flavonoid_pattern': lambda reference: 'Harborne' in reference,
+					 'parse_harborne_phytochemdict_pattern': lambda reference: 'Harborne' in reference}
 
 
 class reference_parser:
 	'''This class contains parsers for reference notations that occur(ed) frequently in COCONUT.'''
 	def __init__(self) -> None:
 		self.parsed_references =  ()
-		pass
+		# Parser functions (in the order in which they are applied) and their prefilters
+		self.parser_functions = [(getattr(self, function_name), PARSER_PREFILTERS[function_name])
+								 for function_name in ['parse_general_pattern',
+													   'parse_underscore_pattern',
+													   'parse_jchemsoc_pattern',
+													   'parse_harborne_flavonoid_pattern',
+													   'parse_harborne_phytochemdict_pattern']]
 		
 
 	def __call__(self, reference_str) -> Dict:
@@ -17,14 +83,10 @@ class reference_parser:
 		it will apply all available parser functions and return a dictionary containing the
 		parsed information if one of the available patterns fits.
 		'''
-		parser_functions = [
-							self.parse_general_pattern,
-							self.parse_underscore_pattern,
-							self.parse_jchemsoc_pattern,
-							self.parse_harborne_flavonoid_pattern,
-							self.parse_harborne_phytochemdict_pattern
-							]
-		for parser_function in parser_functions:
+		for parser_function, prefilter in self.parser_functions:
+			# Skip parsers that cannot match
+			if not prefilter(reference_str):
+				continue
 			parsed_reference_dict = parser_function(reference_str)
 			if parsed_reference_dict:
 				return parsed_reference_dict
@@ -49,29 +111,15 @@ class reference_parser:
 		If the pattern is detected, the reference string is parsed and a dictionary with
 		the parsed information is returned.
 		'''
-		# Define regex pattern
-		authors = '(?P<authors>([A-Z\-]\.\s?)*(?P<first_author_surname>[a-zA-Z\-\s]+),?([A-Z]\.\-?\s?)?\,?\s?([A-Z]\.\s?)?)\.?(\s?\,|et al\.?,?)\s?'
-		#authors = '(?P<authors>([A-Z\-]\.\s?)*(?P<first_author_surname>[a-zA-Z\-]+)\s?,?([A-Z]\.\-?\s?)?\,?\s?([A-Z]\.\s?)?)\.?(\s?\,|et al\.?,?)\s?'
-
-		journal = '(?P<journal>[a-zA-Z\-\'\s\.]+)(\s?\([A-Za-z]+\)\s?)?(,\s?Suppl.)?,?\.?\s?'
-		volume_issue = '((?P<volume>(No\.?\s?)?\d+[A-Ea-e]?)(\s?\((?P<issue>\d+)\))?\.?,?\s?)?' # does not have to appear
-		year = '\((?P<year>(20|1[89])\d\d)\),?\s?'
-		typo_year = '(8?(?P<year1>(20|1[789])\d\d)\),?\s?|8(?P<year2>(20|1[89])\d\d)9,?\s?|\((?P<year3>(20|1[89])\d\d)9,?\s?)'
-		pages = '(?P<pages>(?P<first_page>\d+)(\-\d+)?)'
-		
-		general_pattern = '^\s?' + authors + journal + volume_issue + year + pages + '\.?$'
-		# Typo that occurs regularily (see ref_str_year_typo_$N)
-		general_pattern_with_year_typo = '^' + authors + journal + volume_issue + typo_year + pages + '\.?$'
-		
 		# Match pattern, create group_dict, normalise and return it
-		match = re.search(general_pattern, reference)
+		match = GENERAL_PATTERN.search(reference)
 		if match:
 			group_dict = match.groupdict()
 			# Get rid of " et al" in surname 
 			if group_dict['first_author_surname'][-6:] == ' et al':
 				group_dict['first_author_surname'] = group_dict['first_author_surname'][:-6]
 			return group_dict
-		match = re.search(general_pattern_with_year_typo, reference)
+		match = GENERAL_PATTERN_WITH_YEAR_TYPO.search(reference)
 		if match:
 			group_dict = match.groupdict()
 			# Get rid of " et al" in surname 
@@ -98,17 +146,8 @@ class reference_parser:
 		If the pattern is detected, the reference string is parsed and a dictionary with
 		the parsed information is returned.
 		'''
-		# Define regex pattern
-		journal = '(?P<journal>[A-Za-z\_]+)'
-		year = '(?P<year>(20|1[89])\d\d)'
-		gap = '[_:;]'
-		volume_issue = '(?P<volume>\d+)([_:;]?\((?P<issue>\d+)\))?'
-		pages = '(?P<pages>(?P<first_page>\d+)(\-\d+)?)'
-
-		underscore_pattern = '^\"?\s?\"?' + journal + gap + year + gap + volume_issue + gap + pages + '\"?\s?\"?$'
-		
 		# Match pattern, create group_dict, normalise and return it
-		match = re.search(underscore_pattern, reference)
+		match = UNDERSCORE_PATTERN.search(reference)
 		if match:
 			group_dict = match.groupdict()
 			# Normalise journal spelling (don't include underscore)
@@ -127,14 +166,7 @@ class reference_parser:
 		If the pattern is detected, the reference string is parsed and a dictionary with
 		the parsed information is returned.
 		'''
-		# Define regular expression
-		authors = '(?P<authors>([A-Z\-]\.\s?)*(?P<first_author_surname>[a-zA-Z\-\s]+),?([A-Z]\.\-?\s?)?\,?\s?([A-Z]\.\s?)?)\.?(\s?\,|et al\.?,?)\s?'
-		journal = '(?P<journal>J\.\s?Chem\.\s?Soc\.,\s?(C|Perkin\s?1)),'
-		year = '\((?P<year>(20|1[89])\d\d)\),?\s?'
-		pages = '(?P<pages>(?P<first_page>\d+)(\-\d+)?)'
-
-		jchemsoc_pattern = '^\s?' + authors + journal + year + pages + '$'
-		match = re.search(jchemsoc_pattern, reference)
+		match = JCHEMSOC_PATTERN.search(reference)
 		if match:
 			group_dict = match.groupdict()
 			# Add space after comma in journal specification
@@ -155,14 +187,7 @@ class reference_parser:
 		but the output Dict is also enriched with additional information.
 		the parsed information is returned.
 		'''
-		# Define regular expression
-		authors_booktitle_volume = '^(?P<authors>Harborne),\s?(?P<title>The Handbook of Natural Flavonoids),\s?(?P<volume>[12]),\s?'
-		year = '\((?P<year>1999)\),'
-		chapter = '\s?(?P<chapter_no>\d+)\s?[,\.](?P<chapter_title>[a-zA-Z\s\,\-]+)'
-		rest = '(,\s?John Wiley\s?&\s?Son)?\.?$'
-		harborne_pattern = '^\s?' + authors_booktitle_volume + year + chapter + rest + '$'
-
-		match = re.search(harborne_pattern, reference)
+		match = HARBORNE_FLAVONOID_PATTERN.search(reference)
 		if match:
 			group_dict = match.groupdict()
 			# Add additional information about the book
@@ -184,14 +209,7 @@ class reference_parser:
 		but the output Dict is also enriched with additional information.
 		the parsed information is returned.
 		'''
-		# Define regular expression
-		author_title = 'Harborne,\s?Phytochemical Dictionary Second Edition,\s?Taylor and Francis,\s?'
-		year = '\((?P<year>1999)\),\s?'
-		chapter = 'Chapter\s?(?P<chapter_no>\d+)\.?'
-
-		harborne_phytochemdict_pattern = '^\s?' + author_title + year + chapter + '$'
-
-		match = re.search(harborne_phytochemdict_pattern, reference)
+		match = HARBORNE_PHYTOCHEMDICT_PATTERN.search(reference)
 		if match:
 			group_dict = match.groupdict()
 			# Add additional information about the book
@@ -202,3 +220,51 @@ class reference_parser:
 			group_dict['isbn'] = '9780748406203'
 			group_dict['original_str'] = reference
 			return group_dict
+
+
+def parse_reference_chunk(reference_chunk: List[str]) -> List[Dict]:
+	'''This function takes a list of reference str and returns the list of parsed reference dicts
+	(None for references that do not match any pattern). It is run in the worker processes of parse_many().'''
+	parser = reference_parser()
+	return [parser(reference_str) for reference_str in reference_chunk]
+
+
+def iter_parse_many(references: Iterable[str], workers: int = None, chunksize: int = 1000) -> Iterator[Dict]:
+	'''
+	This function takes an iterable of reference str, parses them with reference_parser in a pool
+	of worker processes (default: one per CPU) and yields the parsed reference dicts (or None) in the
+	order of the input. The input is consumed lazily in chunks of chunksize references and only
+	2 chunks per worker are in flight at once, so the memory usage does not depend on the input size.
+	'''
+	if workers is None:
+		workers = os.cpu_count() or 1
+	references = iter(references)
+	if workers <= 1:
+		parser = reference_parser()
+		for reference_str in references:
+			yield parser(reference_str)
+		return
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		pending_chunks = deque()
+		while True:
+			# Keep max. 2 chunks per worker in flight
+			while len(pending_chunks) < 2 * workers:
+				reference_chunk = list(itertools.islice(references, chunksize))
+				if not reference_chunk:
+					break
+				pending_chunks.append(executor.submit(parse_reference_chunk, reference_chunk))
+			if not pending_chunks:
+				break
+			for parsed_reference_dict in pending_chunks.popleft().result():
+				yield parsed_reference_dict
+
+
+def parse_many(references: Iterable[str], workers: int = None, chunksize: int = 1000) -> List[Dict]:
+	'''
+	This function takes an iterable of reference str, parses them with reference_parser in a pool
+	of worker processes (see iter_parse_many()) and returns the list of parsed reference dicts
+	(or None) in the order of the input.
+	Example:
+	parsed_reference_dicts = parse_many(['Haba,Phytochem.,68,(2007),1255', 'J_Nat_Prod_2015_78_(4):730-735'], workers=4)
+	'''
+	return list(iter_parse_many(references, workers, chunksize))
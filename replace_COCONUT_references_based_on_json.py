@@ -1,22 +1,134 @@
-import sys
-from pymongo import MongoClient
-import pandas as pd
+import os
+import ast
+import time
+import argparse
+from typing import Dict, List, Union, Mapping
+from pymongo import MongoClient, UpdateOne
+from reference_map import open_reference_map
+
+
+# The last coconut_id of every written batch is saved here so that an interrupted replacement can be resumed
+PROGRESS_PATH = 'COCONUT_reference_replacement_progress.txt'
+
+
+def replace_references(old_refs: List[str], references: Mapping[str, Dict]) -> List[str]:
+    '''This function takes a list of old reference str and the reference map (see main()) and returns
+    the list of reference str where every old reference is replaced with the new reference (if it exists).'''
+    new_refs = []
+    # Go through all old references and replace them with the new reference (if it exists)
+    for old_ref in old_refs:
+        # One lookup per reference (a compiled reference map decodes the entry on every lookup)
+        new_data = references.get(old_ref)
+        if new_data:
+            new_ref = new_data['reference']
+            for DOIPMID in ['DOI', 'PMID']:
+                # If they are given: Add DOI and/or PMID
+                if new_data[DOIPMID]:
+                    new_ref += '; {}'.format(new_data[DOIPMID])
+            new_refs.append(new_ref)
+        # If no new data has been retrieved for the old reference:
+        else:
+            new_refs.append(old_ref)
+    return new_refs
+
+
+def read_citations(citations: Union[str, List[str]]) -> List[str]:
+    '''This function takes the citationDOI value of a document (list of reference str or its str representation)
+    and returns it as list of reference str.'''
+    if isinstance(citations, str):
+        try:
+            citations = ast.literal_eval(citations)
+        except (ValueError, SyntaxError):
+            return [citations]
+    return list(citations) if citations else []
+
+
+def read_progress(progress_path: str) -> str:
+    '''This function takes the path of a progress file and returns the last processed coconut_id (None if there is none).'''
+    if progress_path and os.path.exists(progress_path):
+        with open(progress_path, 'r') as progress_file:
+            last_coconut_id = progress_file.read().strip()
+            if last_coconut_id:
+                return last_coconut_id
+
+
+def write_progress(progress_path: str, last_coconut_id: str) -> None:
+    '''This function takes the path of a progress file and the last processed coconut_id and saves it (atomically).'''
+    if progress_path:
+        with open(progress_path + '.tmp', 'w') as progress_file:
+            progress_file.write(str(last_coconut_id))
+        os.replace(progress_path + '.tmp', progress_path)
+
+
+def replace_collection_references(collection, references: Mapping[str, Dict], batch_size: int = 1000, resume_after: str = None,
+                                  progress_path: str = None, report_every: int = 100000) -> Dict:
+    '''
+    This function takes a MongoDB collection (eg. db.uniqueNaturalProduct or a mongomock collection) and the reference map
+    (see main()). It streams the documents sorted by coconut_id (only the ones after resume_after if it is given) and replaces
+    the references in citationDOI. Documents whose references do not change are skipped, the others are updated via
+    unordered bulk writes of batch_size operations. After every written batch, the last processed coconut_id is saved
+    at progress_path (if given). The throughput is printed every report_every documents.
+    It returns a dict with the number of processed, updated and skipped documents, the last coconut_id and the documents per second.
+    '''
+    query = {'coconut_id': {'$gt': resume_after}} if resume_after else {}
+    cursor = collection.find(query, {'_id': 0, 'coconut_id': 1, 'citationDOI': 1}).sort('coconut_id', 1).batch_size(batch_size)
+    statistics = {'processed': 0, 'updated': 0, 'skipped': 0, 'last_coconut_id': resume_after}
+    operations = []
+    start = time.monotonic()
+
+    def write_batch(last_coconut_id: str) -> None:
+        if operations:
+            result = collection.bulk_write(operations, ordered=False)
+            statistics['updated'] += result.modified_count
+            operations.clear()
+        statistics['last_coconut_id'] = last_coconut_id
+        write_progress(progress_path, last_coconut_id)
+
+    for document in cursor:
+        coconut_id = document['coconut_id']
+        old_refs = read_citations(document.get('citationDOI'))
+        new_refs = replace_references(old_refs, references)
+        statistics['processed'] += 1
+        if new_refs == old_refs:
+            statistics['skipped'] += 1
+        else:
+            operations.append(UpdateOne({'coconut_id': coconut_id}, {'$set': {'citationDOI': new_refs}}))
+        if len(operations) >= batch_size:
+            write_batch(coconut_id)
+        if statistics['processed'] % report_every == 0:
+            print('{} documents processed ({} skipped, {:.0f} documents/s)'.format(
+                statistics['processed'], statistics['skipped'], statistics['processed'] / (time.monotonic() - start)))
+        last_coconut_id = coconut_id
+    if statistics['processed']:
+        write_batch(last_coconut_id)
+    statistics['documents_per_second'] = round(statistics['processed'] / max(time.monotonic() - start, 1e-9), 1)
+    return statistics
+
 
 def main():
+    argument_parser = argparse.ArgumentParser(description='Replace the references in COCONUT with the normalised references.')
+    argument_parser.add_argument('mongoPort')
+    argument_parser.add_argument('mongoDatabase')
+    argument_parser.add_argument('reference_map', help='Compiled reference map, JSONL, JSON or str(dict) file that maps the old to the new references')
+    argument_parser.add_argument('--batch-size', type=int, default=1000, help='Number of updates per bulk write')
+    argument_parser.add_argument('--resume-after', help='Only process documents with a greater coconut_id')
+    argument_parser.add_argument('--resume', action='store_true', help='Resume after the last coconut_id in the progress file')
+    argument_parser.add_argument('--progress-file', default=PROGRESS_PATH)
+    args = argument_parser.parse_args()
+
     # Set paths and load DB client
-    mongoPort = sys.argv[1]
-    mongoDatabase = sys.argv[2]
-    client = MongoClient("localhost:{}".format(mongoPort))
-    db = client[mongoDatabase]
+    client = MongoClient("localhost:{}".format(args.mongoPort))
+    db = client[args.mongoDatabase]
 
     # Load dict that maps every old reference string to dict containing a normalised reference string,
     # a DOI and a PMID (if they are not given, these keys refer to None)
     # Example of entry in references:
-    #'Ito,Chem. Pharm. Bull.,37,(1989),819': {'reference': 'Ito, Chemical and Pharmaceutical Bulletin, 1989, 37 (3), 819', 
-    #                                         'DOI': '10.1248/cpb.37.819', 
+    #'Ito,Chem. Pharm. Bull.,37,(1989),819': {'reference': 'Ito, Chemical and Pharmaceutical Bulletin, 1989, 37 (3), 819',
+    #                                         'DOI': '10.1248/cpb.37.819',
     #                                         'PMID': None}
-    with open('COCONUT_reference_dict.json', 'r') as references:
-        references = eval(references.read())
+    # The map can be given as compiled reference map (memory-mapped, see reference_map.py), JSONL, JSON
+    # or in the former str(dict) format (see result_files.load_reference_map())
+    references = open_reference_map(args.reference_map)
 
     # MARIA - I don't know how exactly it works in COCONUT
     # We need to retrieve the original reference str in COCONUT (does not matter if it is a DOI, a PMID or something else)
@@ -25,38 +137,15 @@ def main():
     # The question now is what to do when we have a reference str AND a DOI or a PMID
     # In the csv file you have sent me, the reference is saved under the keyword "citationDOI".
     # Hence, I assume that this is where you save the normal reference str
-    # I have now solved this by merging them in one str (see below)
-
-    collection = db.uniqueNaturalProduct.aggregate([{'$project': {'_id': 0, 'coconut_id': 1, 'citationDOI': 1}}])
-    allnp = pd.DataFrame(list(collection))
-
-    for index, row in allnp.iterrows():
-        coconut_id = row['coconut_id'] # str
-        old_refs = eval(row["citationDOI"]) # List[str]
-        new_refs = []
-        # Go through all old references and replace them with the new reference (if it exists)
-        for old_ref in old_refs:
-            if old_ref in references.keys():
-                new_ref = references[old_ref]['reference']
-                for DOIPMID in ['DOI', 'PMID']:
-                    # If they are given: Add DOI and/or PMID
-                    if references[old_ref][DOIPMID]:
-                        new_ref += '; {}'.format(DOIPMID, references[old_ref][DOIPMID])
-                new_refs.append(new_ref)
-            # If no new data has been retrieved for the old reference:    
-            else:
-                new_refs.append(old_ref)
-
-        # Replace old reference list with modified reference list 
-        db.uniqueNaturalProduct.update_one({'coconut_id': coconut_id}, {"$set": {"citationDOI": new_refs}})
+    # I have now solved this by merging them in one str (see replace_references())
 
+    resume_after = args.resume_after
+    if args.resume and not resume_after:
+        resume_after = read_progress(args.progress_file)
+    statistics = replace_collection_references(db.uniqueNaturalProduct, references, batch_size=args.batch_size,
+                                               resume_after=resume_after, progress_path=args.progress_file)
+    print(statistics)
     print("The old references have been replaced.")
 
 if __name__ == '__main__':
-    if len(sys.argv) == 4:
-        main()
-    else:
-        print('Usage: python {} mongoPort_PATH mongoDatabase_PATH reference_map_JSON'.format(sys.argv[0]))
-
-
-
+    main()
@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict
+
+
+class response_cache:
+	'''
+	This class contains a persistent on-disk cache (SQLite) for the responses of the
+	DOI, PMID and Crossref keyword lookups in citation_normalisation.
+	Entries are keyed by the backend and the normalised query, they expire after
+	ttl seconds (None: never) and if more than max_entries are stored, the least
+	recently used entries are evicted.
+	'''
+	def __init__(self, path: str = 'citation_normalisation_cache.sqlite', ttl: float = 30 * 24 * 3600, max_entries: int = 500000) -> None:
+		self.path = os.path.normpath(path)
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		# Eviction is only checked every eviction_interval insertions to keep writes cheap
+		self.eviction_interval = 1000
+		self._insertions = 0
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(self.path, check_same_thread=False)
+		self._connection.execute('PRAGMA journal_mode=WAL')
+		self._connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+										backend TEXT NOT NULL,
+										query TEXT NOT NULL,
+										response TEXT NOT NULL,
+										created REAL NOT NULL,
+										last_access REAL NOT NULL,
+										PRIMARY KEY (backend, query))''')
+		self._connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+		self._connection.commit()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, tb) -> None:
+		self.close()
+
+
+	def __len__(self) -> int:
+		with self._lock:
+			return self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+	def close(self) -> None:
+		'''This function closes the underlying database connection.'''
+		with self._lock:
+			self._connection.close()
+
+
+	@staticmethod
+	def normalize_query(backend: str, query) -> str:
+		'''
+		This function takes a backend name and a query (str or parsed reference dict)
+		and returns the normalised str that is used as a cache key.
+		DOIs are case-insensitive, keyword queries are compared without case and
+		redundant whitespace, parsed reference dicts are serialised with sorted keys.
+		'''
+		if isinstance(query, dict):
+			return json.dumps(query, sort_keys=True, default=str)
+		query = re.sub(r'\s+', ' ', str(query)).strip()
+		if backend in ['DOI', 'Crossref_keyword']:
+			query = query.lower()
+		return query
+
+
+	def get(self, backend: str, query) -> Dict:
+		'''
+		This function takes a backend name and a query and returns the cached response
+		or None if there is no (valid) entry. Expired entries are deleted.
+		'''
+		key = self.normalize_query(backend, query)
+		now = time.time()
+		with self._lock:
+			row = self._connection.execute('SELECT response, created FROM responses WHERE backend = ? AND query = ?',
+										   (backend, key)).fetchone()
+			if row and (self.ttl is None or now - row[1] <= self.ttl):
+				self._connection.execute('UPDATE responses SET last_access = ? WHERE backend = ? AND query = ?',
+										 (now, backend, key))
+				self._connection.commit()
+				self.hits += 1
+				return json.loads(row[0])
+			if row:
+				self._connection.execute('DELETE FROM responses WHERE backend = ? AND query = ?', (backend, key))
+				self._connection.commit()
+			self.misses += 1
+
+
+	def set(self, backend: str, query, response: Dict) -> None:
+		'''
+		This function takes a backend name, a query and the corresponding response and
+		saves it in the cache. Values that cannot be serialised as JSON (eg. lazy XML objects
+		of MetaPub articles) are saved as their str representation.
+		If the cache holds more than max_entries, the least recently used entries are evicted
+		(checked every eviction_interval insertions).
+		'''
+		key = self.normalize_query(backend, query)
+		now = time.time()
+		serialised_response = json.dumps(response, default=str)
+		with self._lock:
+			self._connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+									 (backend, key, serialised_response, now, now))
+			self._insertions += 1
+			if self.max_entries and self._insertions % self.eviction_interval == 0:
+				self._evict()
+			self._connection.commit()
+
+
+	def _evict(self) -> None:
+		'''This function deletes the least recently used entries that exceed max_entries (lock must be held).'''
+		cursor = self._connection.execute('''DELETE FROM responses WHERE rowid IN (
+												SELECT rowid FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)''',
+										  (self.max_entries,))
+		self.evictions += cursor.rowcount
+
+
+	def statistics(self) -> Dict:
+		'''This function returns a dict with the number of cache hits, misses and the hit rate.'''
+		lookups = self.hits + self.misses
+		return {'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,173 @@
+import sys
+import ast
+import gzip
+import json
+from collections.abc import Mapping
+from typing import Dict, Iterator, Iterable, Tuple, Callable
+try:
+	import orjson
+except ImportError:
+	orjson = None
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+
+def _default(value):
+	'''This function converts values that are not JSON serialisable (eg. normalized_reference records, sets or
+	metapub objects) to dicts, lists or str.'''
+	if isinstance(value, Mapping):
+		return dict(value)
+	if isinstance(value, (set, frozenset, tuple)):
+		return list(value)
+	return str(value)
+
+
+def dumps(record) -> str:
+	'''This function takes an object and returns it as JSON str (via orjson if it is installed).
+	Values that are not JSON serialisable are converted (see _default()).'''
+	if orjson is not None:
+		return orjson.dumps(record, default=_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+	return json.dumps(record, ensure_ascii=False, default=_default)
+
+
+def loads(line: str):
+	'''This function takes a JSON str and returns the corresponding object (via orjson if it is installed).'''
+	if orjson is not None:
+		return orjson.loads(line)
+	return json.loads(line)
+
+
+def open_text(path: str, mode: str = 'r'):
+	'''This function takes the path of a (optionally gzipped) text file and returns the opened file.'''
+	if path.endswith('.gz'):
+		return gzip.open(path, mode + 't', encoding='utf-8')
+	return open(path, mode, encoding='utf-8')
+
+
+def is_jsonl(path: str) -> bool:
+	'''This function returns True if the file at path is a JSONL file (judged by its extension).'''
+	return path.endswith('.jsonl') or path.endswith('.jsonl.gz')
+
+
+def write_jsonl(records: Iterable, path: str) -> int:
+	'''This function takes an iterable of JSON serialisable records and writes them into a JSONL file
+	(gzipped if the path ends with .gz). It returns the number of written records.'''
+	written_records = 0
+	with open_text(path, 'w') as output:
+		for record in records:
+			output.write(dumps(record) + '\n')
+			written_records += 1
+	return written_records
+
+
+def iter_jsonl(path: str, predicate: Callable[[Dict], bool] = None) -> Iterator:
+	'''This function takes the path of a JSONL file (optionally gzipped) and lazily yields its records
+	(only the ones for which predicate returns True if a predicate is given). An incomplete last line
+	(eg. after a crash during writing) is skipped.'''
+	with open_text(path) as input_file:
+		for line in input_file:
+			if not line.strip():
+				continue
+			try:
+				record = loads(line)
+			except ValueError:
+				if not line.endswith('\n'):
+					break
+				raise
+			if predicate is None or predicate(record):
+				yield record
+
+
+def iter_raw_results(path: str, predicate: Callable[[str, Dict], bool] = None) -> Iterator[Tuple[str, Dict]]:
+	'''
+	This function takes the path of a raw retrieval output file and lazily yields (reference, retrieved dict) tuples
+	(only the ones for which predicate(reference, retrieved dict) returns True if a predicate is given).
+	JSONL files ({"reference": ..., "result": ...} per line, see checkpoint_store) and the former tsv files
+	(reference + tab + str(dict)) are supported. The dicts in tsv files are read with ast.literal_eval();
+	lines that cannot be read that way are skipped and counted, the count is printed to stderr at the end.
+	This concerns all MetaPub results of the former retrieval, whose dicts contain reprs of objects.
+	'''
+	if is_jsonl(path):
+		for record in iter_jsonl(path):
+			if predicate is None or predicate(record['reference'], record['result']):
+				yield record['reference'], record['result']
+		return
+	skipped_lines = 0
+	with open_text(path) as input_file:
+		for line in input_file:
+			if '\t' not in line:
+				continue
+			reference, retrieved_dict = line.rstrip('\n').split('\t', 1)
+			try:
+				retrieved_dict = ast.literal_eval(retrieved_dict)
+			except (ValueError, SyntaxError):
+				skipped_lines += 1
+				continue
+			if predicate is None or predicate(reference, retrieved_dict):
+				yield reference, retrieved_dict
+	if skipped_lines:
+		print('Skipped {} lines of {} that could not be read (eg. MetaPub results with object reprs).'.format(skipped_lines, path),
+			  file=sys.stderr)
+
+
+def iter_reference_map(path: str) -> Iterator[Tuple[str, Dict]]:
+	'''
+	This function takes the path of a reference map (old reference str -> {'reference': ..., 'DOI': ..., 'PMID': ...})
+	and yields its (old reference, new reference dict) items. Supported formats: JSONL (one {old reference: {...}} object
+	per line, as written by the command line interface of citation_normalisation.py; read lazily), JSON and the former
+	str(dict) files. Lines of the JSONL files that map a reference to null (not resolved) are skipped.
+	'''
+	if is_jsonl(path):
+		for record in iter_jsonl(path):
+			for old_ref, new_ref in record.items():
+				if new_ref:
+					yield old_ref, new_ref
+		return
+	with open_text(path) as input_file:
+		content = input_file.read()
+	try:
+		references = loads(content)
+	except ValueError:
+		# Former format: str() of the dict (Python literal)
+		references = ast.literal_eval(content)
+	yield from references.items()
+
+
+def load_reference_map(path: str) -> Dict[str, Dict]:
+	'''This function takes the path of a reference map (see iter_reference_map()) and returns it as dict.'''
+	return dict(iter_reference_map(path))
+
+
+def raw_results_to_parquet(path: str, parquet_path: str, batch_size: int = 100000) -> int:
+	'''
+	This function takes the path of a raw retrieval output file (see iter_raw_results()) and writes its content
+	into a Parquet file with the columns reference, retrieved_from, query_str_type, DOI, PMID and result (JSON str)
+	in batches of batch_size rows. It returns the number of written rows. pyarrow has to be installed.
+	'''
+	if pyarrow is None:
+		raise ImportError('pyarrow is needed to write Parquet files (pip install pyarrow).')
+	columns = ['reference', 'retrieved_from', 'query_str_type', 'DOI', 'PMID', 'result']
+	schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+	written_rows = 0
+	with pyarrow.parquet.ParquetWriter(parquet_path, schema) as writer:
+		batch = {column: [] for column in columns}
+		for reference, retrieved_dict in iter_raw_results(path):
+			retrieved_dict = retrieved_dict if retrieved_dict else {}
+			batch['reference'].append(reference)
+			batch['retrieved_from'].append(retrieved_dict.get('reference_retrieved_from'))
+			batch['query_str_type'].append(retrieved_dict.get('query_str_type'))
+			batch['DOI'].append(retrieved_dict.get('DOI') or retrieved_dict.get('doi'))
+			PMID = retrieved_dict.get('pmid')
+			batch['PMID'].append(str(PMID) if PMID else None)
+			batch['result'].append(dumps(retrieved_dict) if retrieved_dict else None)
+			if len(batch['reference']) >= batch_size:
+				writer.write_table(pyarrow.table(batch, schema=schema))
+				written_rows += len(batch['reference'])
+				batch = {column: [] for column in columns}
+		if batch['reference']:
+			writer.write_table(pyarrow.table(batch, schema=schema))
+			written_rows += len(batch['reference'])
+	return written_rows
@@ -1,78 +1,307 @@
 import sys
 import os
-from typing import Tuple, List, Dict
+import ast
+import dbm
+import hashlib
+import asyncio
+import time
+import atexit
+import threading
+from typing import List, Dict, Iterable, Iterator
 import pandas as pd
-from multiprocessing.dummy import Pool as ThreadPool
 import citation_normalisation as cn
 import reference_parser as rp
+import async_resolution as ar
+from checkpoint_store import checkpoint_store
+from journal_index import build_journal_index
+from result_files import is_jsonl, iter_jsonl, iter_raw_results
+from reference_manifest import reference_manifest, reference_hash, RETRY_AFTER
+from metrics import METRICS
+
+
+# Raw retrieval output (JSONL, see checkpoint_store.py and result_files.iter_raw_results())
+RAW_OUTPUT_PATH = 'COCONUT_reference_retrieval_raw_output.jsonl'
+SECOND_RAW_OUTPUT_PATH = 'COCONUT_reference_second_retrieval_raw_output.jsonl'
+# Raw retrieval output of former runs (reference + tab + str(dict) per line). Their results are migrated into the
+# JSONL output when it is opened, so that an interrupted former run can be resumed (see open_checkpoint_store())
+LEGACY_RAW_OUTPUT_PATHS = {RAW_OUTPUT_PATH: 'COCONUT_reference_retrieval_raw_output.tsv',
+                           SECOND_RAW_OUTPUT_PATH: 'COCONUT_reference_second_retrieval_raw_output.tsv'}
+# Retrieved dicts after the confirmation procedure ("QUERY_STR_TYPE, {retrieved dict}" per line or
+# JSONL with one retrieved dict per line)
+FILTERED_DICTS_PATH = './retrieved_dicts_filtered.csv'
+# query_str_type of the dicts that have been retrieved with a Crossref keyword query (all but the DOI and PMID
+# lookups, see cn.add_retrieval_information()); the former csv files label these dicts with KEYWORD
+KEYWORD_QUERY_STR_TYPES = ('unstructured_ID', 'Crossref_extended_query')
+# Manifest of the resolved references for incremental runs (see incremental_retrieval_coordination())
+MANIFEST_PATH = 'COCONUT_reference_manifest.sqlite'
+# JSON snapshot of the metrics of a retrieval run (only written if metrics are enabled, see metrics.py)
+METRICS_OUTPUT_PATH = 'COCONUT_reference_retrieval_metrics.json'
+SECOND_METRICS_OUTPUT_PATH = 'COCONUT_reference_second_retrieval_metrics.json'
+
+# Checkpoint stores that are shared by all threads calling retrieve_reference_data()
+# or detailed_retrieve_reference_data() without an explicit checkpoint store
+checkpoint_stores = {}
+checkpoint_stores_lock = threading.Lock()
+
+
+def get_checkpoint_store(output_path: str) -> checkpoint_store:
+    '''This function takes the path of a raw output file and returns the shared
+    checkpoint store for it (it is opened when it is requested for the first time, see open_checkpoint_store()).'''
+    with checkpoint_stores_lock:
+        if output_path not in checkpoint_stores.keys():
+            checkpoint_stores[output_path] = open_checkpoint_store(output_path)
+        return checkpoint_stores[output_path]
+
+
+def open_checkpoint_store(output_path: str, flush_every: int = 100, fsync: bool = False) -> checkpoint_store:
+    '''This function takes the path of a raw output file and returns a checkpoint store for it. If there is a
+    raw output file of a former run for this path (see LEGACY_RAW_OUTPUT_PATHS), its results are added first
+    (see migrate_legacy_output()).'''
+    checkpoint = checkpoint_store(output_path, flush_every=flush_every, fsync=fsync)
+    legacy_output_path = LEGACY_RAW_OUTPUT_PATHS.get(output_path)
+    if legacy_output_path:
+        migrated = migrate_legacy_output(legacy_output_path, checkpoint)
+        if migrated:
+            print('Migrated {} results from {}.'.format(migrated, legacy_output_path))
+    return checkpoint
+
+
+def migrate_legacy_output(legacy_output_path: str, checkpoint: checkpoint_store) -> int:
+    '''This function takes the path of a raw output tsv file of a former run and a checkpoint store. The results
+    that are not in the store yet are added to it. Lines that cannot be read (see result_files.iter_raw_results())
+    are not added, so their references are retrieved again. It returns the number of added results.'''
+    if not os.path.exists(legacy_output_path):
+        return 0
+    migrated = 0
+    for reference, ref_dict in iter_raw_results(legacy_output_path):
+        if checkpoint.add(reference, ref_dict):
+            migrated += 1
+    return migrated
+
+
+@atexit.register
+def close_checkpoint_stores() -> None:
+    '''This function writes the queued lines of all shared checkpoint stores and closes them.'''
+    with checkpoint_stores_lock:
+        for checkpoint in checkpoint_stores.values():
+            checkpoint.close()
+        checkpoint_stores.clear()
+
+
+def iter_COCONUT_references(coconut_references_csv_path: str, chunk_size: int = 10000, spill_path: str = None) -> Iterator[str]:
+    '''
+    This function reads a csv file with 2 columns ('coconut_id', 'citationDOI') at coconut_references_csv_path
+    in chunks of chunk_size rows and lazily yields every unique reference str (without "NA").
+    Duplicates are detected via a set of hashes of the references. If a spill_path is given,
+    the hashes are kept in a dbm file at that path instead of memory (for huge inputs).
+    '''
+    if spill_path:
+        seen_hashes = dbm.open(spill_path, 'n')
+    else:
+        seen_hashes = set()
+    try:
+        chunks = pd.read_csv(os.path.normpath(coconut_references_csv_path), usecols=['citationDOI'], chunksize=chunk_size)
+        for chunk in chunks:
+            for ref_list in chunk['citationDOI']:
+                # The reference lists are saved as str, empty cells are read as NaN
+                if not isinstance(ref_list, str):
+                    continue
+                try:
+                    ref_list = ast.literal_eval(ref_list)
+                except (ValueError, SyntaxError):
+                    continue
+                for ref in ref_list:
+                    if ref == 'NA':
+                        continue
+                    ref_hash = hashlib.blake2b(ref.encode('utf-8'), digest_size=16).digest()
+                    if ref_hash in seen_hashes:
+                        continue
+                    if spill_path:
+                        seen_hashes[ref_hash] = b''
+                    else:
+                        seen_hashes.add(ref_hash)
+                    yield ref
+    finally:
+        if spill_path:
+            seen_hashes.close()
 
 
 def read_COCONUT_references(coconut_references_csv_path: str) -> List[str]:
     '''This function reads a csv file with 2 columns ('coconut_id', 'citationDOI') at coconut_references_csv_path.
     It returns a list unique reference str.'''
+    return list(iter_COCONUT_references(coconut_references_csv_path))
 
-    # Read data from file
-    coconut_references = pd.read_csv(os.path.normpath(coconut_references_csv_path))
-    unstructured_references = coconut_references['citationDOI']
-    
-    # Filter non-unique references and "NA"
-    unique_references = []
-    for ref_list in unstructured_references:
-        for ref in eval(ref_list):
-            if ref not in unique_references:
-                if ref != 'NA':
-                    unique_references.append(ref)
-    return unique_references
-
-def retrieve_reference_data(reference: str) -> None:
+
+def retrieve_reference_data(reference: str, checkpoint: checkpoint_store = None) -> None:
     '''This function takes a reference str, retrieves information about it from MetaPub or Crossref
-    and writes the retrieved information into a file. It returns None.'''
+    and writes the retrieved information into a file (via the given checkpoint store or the shared
+    one for RAW_OUTPUT_PATH). It returns None.'''
     
     # In case this script needs to be restarted due to timeout or whatever reason:
     # Do not retrieve data that already has been retrieved.
-    
-    if os.path.exists('COCONUT_reference_retrieval_raw_output.tsv'):
-        with open('COCONUT_reference_retrieval_raw_output.tsv', 'r') as output:
-            lines = output.readlines()
-            already_retrieved_refs = [line.split('\t')[0] for line in lines]
-    else:
-        already_retrieved_refs = []
+    if checkpoint is None:
+        checkpoint = get_checkpoint_store(RAW_OUTPUT_PATH)
 
     # Retrieve information from MetaPub or Crossref       
-    if reference not in already_retrieved_refs:
-        print('Retrieving ref N° {}: {}'.format(len(already_retrieved_refs), reference))
-        ref_dict = cn.retrieve_info_MetaPub_Crossref(reference, only_DOI_PMID=False)
-        with open('COCONUT_reference_retrieval_raw_output.tsv', 'a') as output:
-            output.write(reference + "\t" + str(ref_dict) + "\n")
+    if reference not in checkpoint:
+        print('Retrieving ref N° {}: {}'.format(len(checkpoint), reference))
+        with METRICS.timed('stage_seconds', stage='retrieval'):
+            ref_dict = cn.retrieve_info_MetaPub_Crossref(reference, only_DOI_PMID=False)
+        checkpoint.add(reference, ref_dict)
+        METRICS.increment('references_processed_total', stage='retrieval')
         return None
 
-def retrieval_coordination(coconut_references_csv_path: str) -> None:
+
+async def async_retrieval(references: Iterable[str], checkpoint: checkpoint_store, manifest: reference_manifest = None) -> int:
+    '''
+    This function takes an iterable of reference str, retrieves information about them from MetaPub
+    or Crossref (see async_resolution.resolution_engine) and hands the retrieved information to the
+    checkpoint store (and the manifest, if given) as the results come in. References that already
+    are in the store are skipped. It returns the number of references that have been retrieved.
+    '''
+    references = (reference for reference in references if reference not in checkpoint)
+    retrieved = 0
+    async with ar.resolution_engine() as engine:
+        async for reference, ref_dict in engine.retrieve_many(references):
+            print('Retrieved ref N° {}: {}'.format(len(checkpoint), reference))
+            if checkpoint.add(reference, ref_dict):
+                retrieved += 1
+            if manifest is not None:
+                manifest.record(reference, ref_dict)
+            METRICS.increment('references_processed_total', stage='retrieval')
+    return retrieved
+
+
+def load_journal_index(results_path: str) -> None:
+    '''This function takes the path of the raw output of a previous run and registers the journal names in it
+    in cn.JOURNAL_INDEX (see journal_index.build_journal_index()). Former tsv files are not read.'''
+    if not os.path.exists(results_path) or not is_jsonl(results_path):
+        return
+    with METRICS.timed('stage_seconds', stage='journal_index'):
+        build_journal_index(results_path, cn.JOURNAL_INDEX)
+    print('Journal index: {} names.'.format(len(cn.JOURNAL_INDEX)))
+
+
+def retrieval_coordination(coconut_references_csv_path: str, flush_every: int = 100, fsync: bool = False) -> None:
     '''
     This function is responsible for the coordination of
-    - Reading the original COCONUT references
-    - Retrieving information about the publications (parallelised)
-    - Saving the retrieved information in a csv file
+    - Reading the original COCONUT references (streamed, see iter_COCONUT_references())
+    - Loading the journal names of the results that are already there into cn.JOURNAL_INDEX (see load_journal_index())
+    - Retrieving information about the publications (asynchronous, rate limited per backend)
+    - Saving the retrieved information in a csv file (batches of flush_every lines, optionally fsynced)
     '''
     # Read data from file
-    references = read_COCONUT_references(coconut_references_csv_path)
+    references = iter_COCONUT_references(coconut_references_csv_path)
+    # Journal names that have been confirmed before the restart
+    load_journal_index(RAW_OUTPUT_PATH)
     # Run information retrieval
-    with ThreadPool(35) as pool:
-        _ = pool.map(retrieve_reference_data, references)
+    with open_checkpoint_store(RAW_OUTPUT_PATH, flush_every=flush_every, fsync=fsync) as checkpoint:
+        with METRICS.timed('coordination_seconds', stage='retrieval'):
+            asyncio.run(async_retrieval(references, checkpoint))
+    if METRICS.enabled:
+        METRICS.save(METRICS_OUTPUT_PATH)
+    cn.print_crossref_statistics()
     print('Finished information retrieval.')
 
 
+def carry_forward_results(coconut_references_csv_path: str, previous_output_path: str, checkpoint: checkpoint_store,
+                          manifest: reference_manifest) -> int:
+    '''
+    This function takes the path of the COCONUT references csv file, the path of the raw output of the previous run,
+    a checkpoint store for the new output and the manifest. The results of the previous run are copied into the new
+    output if their reference still is in the csv file and does not have to be resolved again (see reference_manifest.is_due()).
+    References that are not in the manifest yet (eg. output of a full run) are added to it with the time of the previous
+    output file. It returns the number of results that have been carried forward.
+    '''
+    if not os.path.exists(previous_output_path):
+        return 0
+    current_hashes = {reference_hash(reference) for reference in iter_COCONUT_references(coconut_references_csv_path)}
+    previous_run_time = os.path.getmtime(previous_output_path)
+    now = time.time()
+    carried_forward = 0
+    for reference, ref_dict in iter_raw_results(previous_output_path):
+        if reference_hash(reference) not in current_hashes or reference in checkpoint:
+            continue
+        entry = manifest.get(reference)
+        if entry is None:
+            entry = manifest.record(reference, ref_dict, attempted_at=previous_run_time)
+        if not manifest.is_due(entry, now):
+            checkpoint.add(reference, ref_dict)
+            carried_forward += 1
+    return carried_forward
+
+
+def jsonl_output_path(output_path: str) -> str:
+    '''This function takes the path of a raw output file and returns the path of the corresponding
+    uncompressed JSONL file ('raw_output.tsv' -> 'raw_output.jsonl', JSONL paths are returned unchanged).'''
+    if output_path.endswith('.gz'):
+        output_path = output_path[:-len('.gz')]
+    if output_path.endswith('.jsonl'):
+        return output_path
+    return os.path.splitext(output_path)[0] + '.jsonl'
+
+
+def incremental_retrieval_coordination(coconut_references_csv_path: str, previous_output_path: str = RAW_OUTPUT_PATH,
+                                       manifest_path: str = MANIFEST_PATH, retry_after: float = RETRY_AFTER,
+                                       flush_every: int = 100, fsync: bool = False) -> None:
+    '''
+    This function is responsible for the coordination of an incremental run on a new COCONUT export:
+    - Carrying forward the results of the previous run for the references that are still in the export
+      (see carry_forward_results())
+    - Retrieving information only about new references and references that failed more than retry_after
+      seconds ago (the resolution status of every reference is kept in the manifest at manifest_path)
+    - Replacing the previous output with the new output (the new output is written next to it first,
+      so that an interrupted run can simply be restarted). The new output is always JSONL: if the previous
+      results are a former tsv file, they are kept and the new output is written to the corresponding
+      JSONL path (see jsonl_output_path()).
+    If there is no previous output at previous_output_path, the output of a former run is used
+    (see LEGACY_RAW_OUTPUT_PATHS).
+    '''
+    if not os.path.exists(previous_output_path) and previous_output_path in LEGACY_RAW_OUTPUT_PATHS:
+        previous_output_path = LEGACY_RAW_OUTPUT_PATHS[previous_output_path]
+    target_path = jsonl_output_path(previous_output_path)
+    load_journal_index(previous_output_path)
+    output_path = target_path[:-len('.jsonl')] + '.incremental.jsonl'
+    with reference_manifest(manifest_path, retry_after=retry_after) as manifest:
+        with checkpoint_store(output_path, flush_every=flush_every, fsync=fsync) as checkpoint:
+            with METRICS.timed('stage_seconds', stage='carry_forward'):
+                carried_forward = carry_forward_results(coconut_references_csv_path, previous_output_path, checkpoint, manifest)
+            print('Carried forward {} results.'.format(carried_forward))
+            # Everything that is not in the new output yet: new references and due retries
+            references = iter_COCONUT_references(coconut_references_csv_path)
+            with METRICS.timed('coordination_seconds', stage='incremental_retrieval'):
+                retrieved = asyncio.run(async_retrieval(references, checkpoint, manifest))
+            # Counted for this run only: after a restart, the store already contains earlier results
+            print('Resolved {} references.'.format(retrieved))
+        print('Manifest: {}'.format(manifest.statistics()))
+    os.replace(output_path, target_path)
+    if METRICS.enabled:
+        METRICS.save(METRICS_OUTPUT_PATH)
+    cn.print_crossref_statistics()
+    print('Finished incremental information retrieval.')
+
+
+def iter_keyword_based_dicts(filtered_dicts_path: str) -> Iterator[Dict]:
+    '''This function takes the path of the filtered retrieved dicts (see FILTERED_DICTS_PATH) and lazily
+    yields the dicts that have been retrieved with a keyword query (see KEYWORD_QUERY_STR_TYPES). The dicts are read
+    with json or ast.literal_eval() (no eval()).'''
+    if is_jsonl(filtered_dicts_path):
+        yield from iter_jsonl(filtered_dicts_path, lambda retrieved_dict: retrieved_dict.get('query_str_type') in KEYWORD_QUERY_STR_TYPES)
+        return
+    with open(filtered_dicts_path) as filtered_retrieved_dicts:
+        for entry in filtered_retrieved_dicts:
+            query_type, retrieved_dict = entry.split(', ', 1)
+            if query_type == 'KEYWORD' or query_type in KEYWORD_QUERY_STR_TYPES:
+                yield ast.literal_eval(retrieved_dict)
+
+
 def read_false_retrieved_references(coconut_references_csv_path: str) -> List[Dict]:
     '''
     This function reads the retrieved dicts which have been falsified in the reference
     confirmation procedure. It returns a list of parsed reference Dicts.
     '''
     # Load all retrieved keyword-query-based reference dicts
-    keyword_based_dicts = []
-    with open('./retrieved_dicts_filtered.csv') as filtered_retrieved_dicts:
-        for entry in filtered_retrieved_dicts.readlines():
-            query_type, retrieved_dict = entry.split(', ', 1)
-            if query_type == 'KEYWORD':
-                keyword_based_dicts.append(eval(retrieved_dict))
+    keyword_based_dicts = iter_keyword_based_dicts(FILTERED_DICTS_PATH)
     # Check which reference dicts do not contain valid information
     parser = rp.reference_parser()
     falsified_reference_dicts = []
@@ -94,9 +323,10 @@ def read_false_retrieved_references(coconut_references_csv_path: str) -> List[Di
     return falsified_reference_dicts
 
 
-def detailed_retrieve_reference_data(reference: str) -> None:
-    '''This function takes a reference str, retrieves information about it from Crossref
-    and writes the retrieved information into a file. It returns None.
+def detailed_retrieve_reference_data(reference: Dict, checkpoint: checkpoint_store = None) -> None:
+    '''This function takes a parsed reference dict, retrieves information about it from Crossref
+    and writes the retrieved information into a file (via the given checkpoint store or the shared
+    one for SECOND_RAW_OUTPUT_PATH). It returns None.
     _____________________________________
     Difference between this function and retrieve_reference_data():
     Only Crossref, confirmation of retrieved information is done during retrieval,
@@ -105,41 +335,62 @@ def detailed_retrieve_reference_data(reference: str) -> None:
     
     # In case this script needs to be restarted due to timeout or whatever reason:
     # Do not retrieve data that already has been retrieved.
-    
-    if os.path.exists('COCONUT_reference_second_retrieval_raw_output.tsv'):
-        with open('COCONUT_reference_second_retrieval_raw_output.tsv', 'r') as output:
-            lines = output.readlines()
-            already_retrieved_refs = [line.split('\t')[0] for line in lines]
-    else:
-        already_retrieved_refs = []
+    if checkpoint is None:
+        checkpoint = get_checkpoint_store(SECOND_RAW_OUTPUT_PATH)
 
     # Retrieve information from MetaPub or Crossref       
-    if reference['query_str'] not in already_retrieved_refs:
-        print('Retrieving ref N° {}: {}'.format(len(already_retrieved_refs), reference))
-        ref_dict = cn.crossrefAPI_improved_query(reference)
-        with open('COCONUT_reference_second_retrieval_raw_output.tsv', 'a') as output:
-            output.write(reference['query_str'] + "\t" + str(ref_dict) + "\n")
+    if reference['query_str'] not in checkpoint:
+        print('Retrieving ref N° {}: {}'.format(len(checkpoint), reference))
+        with METRICS.timed('stage_seconds', stage='second_retrieval'):
+            ref_dict = cn.crossrefAPI_improved_query(reference)
+        checkpoint.add(reference['query_str'], ref_dict)
+        METRICS.increment('references_processed_total', stage='second_retrieval')
         return None
 
 
-def second_retrieval_coordination(coconut_references_csv_path: str) -> None:
+async def async_detailed_retrieval(references: Iterable[Dict], checkpoint: checkpoint_store) -> None:
+    '''
+    This function takes an iterable of parsed reference dicts, retrieves information about them
+    from Crossref (see detailed_retrieve_reference_data()) and hands the retrieved information to the
+    checkpoint store as the results come in. References that already are in the store are skipped.
+    '''
+    references = (reference for reference in references if reference['query_str'] not in checkpoint)
+    async with ar.resolution_engine() as engine:
+        async def detailed_retrieval(reference: Dict) -> Dict:
+            return await engine.call('Crossref', cn.crossrefAPI_improved_query, reference)
+        async for reference, ref_dict in engine.map(detailed_retrieval, references):
+            print('Retrieved ref N° {}: {}'.format(len(checkpoint), reference['query_str']))
+            checkpoint.add(reference['query_str'], ref_dict)
+            METRICS.increment('references_processed_total', stage='second_retrieval')
+
+
+def second_retrieval_coordination(coconut_references_csv_path: str, flush_every: int = 100, fsync: bool = False) -> None:
     '''
     This function is responsible for the coordination of
     - Reading the filtered retrieved references after the first retrieval
-    - Retrieving information about the publications (parallelised)
-    - Saving the retrieved information in a csv file
+    - Retrieving information about the publications (asynchronous, rate limited per backend)
+    - Saving the retrieved information in a csv file (batches of flush_every lines, optionally fsynced)
     '''
     # Read data from file
-    references = read_false_retrieved_references(coconut_references_csv_path)
+    with METRICS.timed('stage_seconds', stage='read_references'):
+        references = read_false_retrieved_references(coconut_references_csv_path)
+    # Journal names confirmed by the first retrieval
+    load_journal_index(RAW_OUTPUT_PATH)
     # Run information retrieval
-    with ThreadPool(35) as pool:
-        _ = pool.map(detailed_retrieve_reference_data, references)
+    with open_checkpoint_store(SECOND_RAW_OUTPUT_PATH, flush_every=flush_every, fsync=fsync) as checkpoint:
+        with METRICS.timed('coordination_seconds', stage='second_retrieval'):
+            asyncio.run(async_detailed_retrieval(references, checkpoint))
+    if METRICS.enabled:
+        METRICS.save(SECOND_METRICS_OUTPUT_PATH)
+    cn.print_crossref_statistics()
     print('Finished information retrieval.')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
+    if len(sys.argv) == 3 and sys.argv[1] == '--incremental':
+        incremental_retrieval_coordination(sys.argv[2])
+    elif len(sys.argv) == 2:
         second_retrieval_coordination(sys.argv[1])
     else:
-        print('Usage: ' + sys.argv[0] + 'coconut_reference_file')
+        print('Usage: ' + sys.argv[0] + ' [--incremental] coconut_reference_file')
 
@@ -0,0 +1,123 @@
+import copy
+import asyncio
+import threading
+from typing import Dict, Callable, Hashable
+from metrics import METRICS
+
+
+class flight_call:
+	'''This class contains the state of one in-flight call of a single_flight group (result or error and waiters).'''
+	__slots__ = ('done', 'result', 'error', 'waiters')
+
+	def __init__(self) -> None:
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.waiters = 0
+
+
+class single_flight:
+	'''
+	This class contains a single-flight layer for duplicate lookups: while a call for a key is in flight,
+	concurrent calls for the same key (in the same group, eg. a backend) do not start their own call but
+	wait for it and share its result (or its exception). Threads use do(), asyncio coroutines use do_async().
+	The waiters get a deep copy of the result, so that they can modify it independently.
+	The number of calls, executed calls and coalesced calls is counted per group (see statistics()).
+	'''
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._calls = {}
+		self._async_calls = {}
+		self._statistics = {}
+
+
+	def _count(self, group: str, coalesced: bool) -> None:
+		'''This function counts a call of the group (lock must be held).'''
+		statistics = self._statistics.setdefault(group, {'calls': 0, 'executions': 0, 'coalesced': 0})
+		statistics['calls'] += 1
+		statistics['coalesced' if coalesced else 'executions'] += 1
+		METRICS.increment('single_flight_calls_total', group=group, result='coalesced' if coalesced else 'executed')
+
+
+	def do(self, group: str, key: Hashable, function: Callable, *args, **kwargs):
+		'''
+		This function takes a group name, a key, a blocking function and its arguments. If there is no call for
+		the key in flight, it calls the function and returns its result. Otherwise, it waits for the call in flight
+		and returns a copy of its result (or raises its exception).
+		'''
+		with self._lock:
+			call = self._calls.get((group, key))
+			coalesced = call is not None
+			if coalesced:
+				call.waiters += 1
+			else:
+				call = self._calls[(group, key)] = flight_call()
+			self._count(group, coalesced)
+		if coalesced:
+			call.done.wait()
+			if call.error is not None:
+				raise call.error
+			return copy.deepcopy(call.result)
+		try:
+			result = function(*args, **kwargs)
+		except BaseException as error:
+			call.error = error
+			raise
+		else:
+			# The waiters copy a snapshot, because the caller may modify the result right away
+			with self._lock:
+				del self._calls[(group, key)]
+				if call.waiters:
+					call.result = copy.deepcopy(result)
+			return result
+		finally:
+			if call.error is not None:
+				with self._lock:
+					del self._calls[(group, key)]
+			call.done.set()
+
+
+	async def do_async(self, group: str, key: Hashable, coroutine_function: Callable, *args, **kwargs):
+		'''
+		This function is the asynchronous version of do(). It takes a group name, a key, a coroutine function and
+		its arguments. Calls are coalesced per event loop.
+		'''
+		loop = asyncio.get_running_loop()
+		flight_key = (id(loop), group, key)
+		with self._lock:
+			call = self._async_calls.get(flight_key)
+			coalesced = call is not None
+			if coalesced:
+				call[1] += 1
+			else:
+				call = self._async_calls[flight_key] = [loop.create_future(), 0]
+			self._count(group, coalesced)
+		future = call[0]
+		if coalesced:
+			return copy.deepcopy(await asyncio.shield(future))
+		try:
+			result = await coroutine_function(*args, **kwargs)
+		except BaseException as error:
+			with self._lock:
+				del self._async_calls[flight_key]
+			if call[1]:
+				future.set_exception(error)
+			else:
+				future.cancel()
+			raise
+		with self._lock:
+			del self._async_calls[flight_key]
+		future.set_result(copy.deepcopy(result) if call[1] else None)
+		return result
+
+
+	def statistics(self) -> Dict[str, Dict[str, int]]:
+		'''This function returns the number of calls, executed calls and coalesced calls per group.'''
+		with self._lock:
+			return {group: dict(statistics) for group, statistics in self._statistics.items()}
+
+
+	def reset_statistics(self) -> None:
+		'''This function sets all counts to 0.'''
+		with self._lock:
+			self._statistics = {}
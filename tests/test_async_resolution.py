@@ -0,0 +1,86 @@
+import asyncio
+import requests
+import async_resolution as ar
+import backend_policy
+import retrieve_COCONUT_references as rcr
+from backend_policy import call_backend, configure_backend, set_rate_limiter, rate_limiter, retry_policy, circuit_breaker
+from checkpoint_store import checkpoint_store
+from result_files import iter_raw_results
+
+
+class counting_rate_limiter(rate_limiter):
+	'''rate_limiter that counts the taken tokens.'''
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+		self.acquired = 0
+
+	def acquire(self) -> float:
+		self.acquired += 1
+		return super().acquire()
+
+
+def test_every_attempt_takes_a_token():
+	configure_backend('Test', retry_policy(max_attempts=3, base_delay=0, jitter=False), circuit_breaker(failure_threshold=100))
+	limiter = counting_rate_limiter(1000.0, concurrency=1)
+	set_rate_limiter('Test', limiter)
+	attempts = []
+
+	def flaky_request():
+		attempts.append(None)
+		if len(attempts) < 3:
+			raise requests.exceptions.ConnectionError('Connection reset')
+		return 'response'
+	try:
+		assert call_backend('Test', flaky_request) == 'response'
+	finally:
+		set_rate_limiter('Test', None)
+	assert limiter.acquired == 3
+
+
+def test_engine_installs_and_restores_rate_limiters():
+	async def open_engine():
+		async with ar.resolution_engine() as engine:
+			return dict(backend_policy.BACKEND_RATE_LIMITERS)
+	limiters = asyncio.run(open_engine())
+	assert set(limiters) == {'MetaPub', 'Crossref'}
+	assert not backend_policy.BACKEND_RATE_LIMITERS
+
+
+def test_failing_reference_does_not_abort_the_others():
+	async def resolve(ref_str):
+		if ref_str == 'broken':
+			raise ValueError('Unexpected record')
+		return ref_str.upper()
+
+	async def resolve_all():
+		async with ar.resolution_engine() as engine:
+			return [result async for result in engine.map(resolve, ['a', 'broken', 'b'], ordered=True)]
+	assert asyncio.run(resolve_all()) == [('a', 'A'), ('broken', None), ('b', 'B')]
+
+
+def test_async_retrieval_records_failing_references(tmp_path, monkeypatch):
+	async def retrieve(self, ref_str, only_DOI_PMID=False):
+		if ref_str == 'broken':
+			raise KeyError('issued')
+		return {'reference_retrieved_from': 'Crossref', 'query_str': ref_str}
+	monkeypatch.setattr(ar.resolution_engine, 'retrieve', retrieve)
+	output_path = str(tmp_path / 'raw_output.jsonl')
+	with checkpoint_store(output_path) as checkpoint:
+		asyncio.run(rcr.async_retrieval(['a', 'broken', 'b'], checkpoint))
+	results = dict(iter_raw_results(output_path))
+	assert set(results) == {'a', 'broken', 'b'}
+	assert results['broken'] is None
+
+
+def test_engine_counts_references_for_the_transfer_statistics(monkeypatch):
+	import citation_normalisation as cn
+	monkeypatch.setattr(cn, 'CROSSREF_TRANSFER_STATISTICS', {'requests': 0, 'bytes': 0, 'references': 0})
+	monkeypatch.setattr(cn, 'LOCAL_INDEX', None)
+	monkeypatch.setattr(cn, 'NEGATIVE_CACHE', None)
+
+	async def retrieve_all():
+		async with ar.resolution_engine() as engine:
+			# Neither identifiers nor parsable, so no request is sent
+			return [result async for result in engine.retrieve_many(['unparsable reference', 'another one'])]
+	asyncio.run(retrieve_all())
+	assert cn.get_crossref_transfer_statistics()['references'] == 2
@@ -0,0 +1,16 @@
+import requests
+from backend_policy import call_backend, configure_backend, retry_policy, circuit_breaker
+
+
+def test_circuit_breaker_counts_calls_not_attempts():
+	breaker = circuit_breaker(failure_threshold=2)
+	configure_backend('Test', retry_policy(max_attempts=5, base_delay=0, jitter=False), breaker)
+
+	def unreachable_request():
+		raise requests.exceptions.ConnectionError('Connection refused')
+	try:
+		call_backend('Test', unreachable_request)
+	except requests.exceptions.ConnectionError:
+		pass
+	assert breaker.consecutive_failures == 1
+	assert not breaker.is_open()
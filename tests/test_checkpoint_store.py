@@ -0,0 +1,31 @@
+import pytest
+from checkpoint_store import checkpoint_store
+
+
+class unprintable:
+	'''Value whose line cannot be formatted.'''
+	def __repr__(self):
+		raise ValueError('Cannot be formatted')
+
+
+def test_writer_error_is_raised_and_does_not_stop_the_writer(tmp_path):
+	path = str(tmp_path / 'raw_output.tsv')
+	checkpoint = checkpoint_store(path, flush_every=1)
+	checkpoint.add('broken', {'value': unprintable()})
+	with pytest.raises(ValueError):
+		checkpoint.flush()
+	assert 'broken' not in checkpoint
+	checkpoint.add('working', {'value': 1})
+	checkpoint.close()
+	assert checkpoint._output.closed
+	with open(path) as output:
+		assert output.read() == "working\t{'value': 1}\n"
+
+
+def test_lines_are_written_on_close(tmp_path):
+	path = str(tmp_path / 'raw_output.jsonl')
+	with checkpoint_store(path) as checkpoint:
+		checkpoint.add('reference', {'DOI': '10.1000/1'})
+		assert not checkpoint.add('reference', {'DOI': '10.1000/1'})
+	with checkpoint_store(path) as reopened_checkpoint:
+		assert 'reference' in reopened_checkpoint
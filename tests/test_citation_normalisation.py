@@ -0,0 +1,126 @@
+import sys
+import json
+import asyncio
+import pytest
+from eutils._internal.exceptions import EutilsNCBIError
+import citation_normalisation as cn
+
+
+class offline_query_service:
+	'''eutils QueryService stand-in, its requests are answered by the fake call_backend().'''
+	def esearch(self, params):
+		raise AssertionError('Requests are sent via call_backend()')
+
+
+class offline_fetcher:
+	'''PubMedFetcher stand-in.'''
+	qs = offline_query_service()
+
+
+def pubmed_down_crossref_404(backend, function, *args, **kwargs):
+	if backend == 'MetaPub':
+		raise EutilsNCBIError('PubMed is down')
+	# crossref_request() returns None for 404 responses
+	return None
+
+
+def test_missing_crossref_message_is_a_failure_of_the_chunk(monkeypatch):
+	monkeypatch.setattr(cn, 'RESPONSE_CACHE', None)
+	monkeypatch.setattr(cn, 'call_backend', pubmed_down_crossref_404)
+	results, failures = cn.crossref_bulk_DOI_query(['10.1000/a', '10.1000/b'])
+	assert not results
+	assert set(failures) == {'10.1000/a', '10.1000/b'}
+
+
+def test_bulk_DOI_failures_contain_the_pubmed_and_the_crossref_reason(monkeypatch):
+	monkeypatch.setattr(cn, 'RESPONSE_CACHE', None)
+	monkeypatch.setattr(cn, 'call_backend', pubmed_down_crossref_404)
+	monkeypatch.setattr(cn.CLIENTS, 'pubmed_fetcher', lambda: offline_fetcher())
+	results, failures = cn.get_info_by_DOIs(['10.1000/a'])
+	assert not results
+	assert failures['10.1000/a'].startswith('PubMed: request failed: PubMed is down; Crossref: request failed')
+
+
+def test_broken_pipe_redirects_stdout_and_exits(tmp_path, monkeypatch):
+	async def broken_pipe(*args):
+		raise BrokenPipeError()
+	monkeypatch.setattr(cn, 'stream_final_dicts', broken_pipe)
+	stdout_path = tmp_path / 'stdout'
+	with open(str(stdout_path), 'w') as stdout:
+		monkeypatch.setattr(sys, 'stdout', stdout)
+		with pytest.raises(SystemExit) as exit_info:
+			cn.main(['-r', 'unparsable reference'])
+		# Later output (eg. the flush at interpreter exit) goes to devnull
+		stdout.write('discarded')
+		stdout.flush()
+	assert exit_info.value.code == 1
+	assert stdout_path.read_text() == ''
+
+
+def resolved_DOI(DOI):
+	'''get_info_by_DOI() stand-in that returns a Crossref record.'''
+	crossref_dict = {'DOI': DOI, 'type': 'journal-article', 'container-title': ['Organic Letters'],
+					 'issued': {'date-parts': [[2014, 8, 29]]}, 'volume': '16', 'issue': '18', 'page': '4695-4697',
+					 'author': [{'family': 'Grudniewska', 'given': 'Aleksandra'}]}
+	return cn.add_retrieval_information(crossref_dict, 'Crossref', 'DOI', DOI)
+
+
+@pytest.fixture
+def offline(monkeypatch):
+	def no_network(backend, function, *args, **kwargs):
+		raise AssertionError('No request must be sent')
+	monkeypatch.setattr(cn, 'call_backend', no_network)
+	monkeypatch.setattr(cn, 'get_info_by_DOI', resolved_DOI)
+	monkeypatch.setattr(cn, 'RESPONSE_CACHE', None)
+	monkeypatch.setattr(cn, 'NEGATIVE_CACHE', None)
+	monkeypatch.setattr(cn, 'LOCAL_INDEX', None)
+
+
+def output_lines(capsys):
+	return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_cli_writes_one_line_per_reference_in_input_order(offline, capsys):
+	cn.main(['-r', '10.1021/ol502216j', '-r', 'unparsable reference', '--ordered'])
+	assert output_lines(capsys) == [{'10.1021/ol502216j': {'reference': 'Grudniewska, Organic Letters, 2014, 16 (18), 4695',
+														   'DOI': '10.1021/ol502216j', 'PMID': None}},
+									{'unparsable reference': None}]
+
+
+def test_cli_reads_references_from_jsonl_field(offline, tmp_path, capsys):
+	input_path = tmp_path / 'references.jsonl'
+	input_path.write_text('{"citation": "10.1021/ol502216j", "id": 1}\n\n{"citation": null, "id": 2}\n')
+	cn.main([str(input_path), '--format', 'jsonl', '--field', 'citation'])
+	assert list(output_lines(capsys)[0].keys()) == ['10.1021/ol502216j']
+
+
+def test_cli_prints_statistics_to_stderr(offline, capsys):
+	cn.main(['-r', 'unparsable reference'])
+	stderr = capsys.readouterr().err
+	assert 'Crossref transfer statistics' in stderr and 'Crossref page statistics' in stderr
+
+
+class recording_output:
+	'''Output file that records how many references had been read when each line was written.'''
+	def __init__(self, read_references):
+		self.read_references = read_references
+		self.read_at_write = []
+
+	def write(self, line):
+		self.read_at_write.append(len(self.read_references))
+
+	def flush(self):
+		pass
+
+
+def test_stream_reads_the_input_lazily(offline):
+	read_references = []
+
+	def references():
+		for index in range(10):
+			read_references.append(index)
+			yield 'unparsable reference {}'.format(index)
+	output = recording_output(read_references)
+	assert asyncio.run(cn.stream_final_dicts(references(), output, max_in_flight=2)) == 10
+	# Only max_in_flight references are read before the first result is written
+	assert output.read_at_write[0] <= 2
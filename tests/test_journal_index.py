@@ -0,0 +1,30 @@
+import json
+from journal_index import journal_index, build_journal_index
+
+
+def test_match_does_not_register_candidates():
+	index = journal_index()
+	assert index.match('J. Nat. Prod.', 'Journal of Natural Products')
+	assert not index.match('Phytochemistry', 'Tetrahedron Letters')
+	assert len(index) == 0
+
+
+def test_confirmed_abbreviation_is_learned():
+	index = journal_index()
+	assert not index.match('Khim. Prir. Soedin.', 'Chemistry of Natural Compounds')
+	index.add_abbreviation('Khim. Prir. Soedin.', 'Chemistry of Natural Compounds')
+	assert index.match('Khim. Prir. Soedin.', 'Chemistry of Natural Compounds')
+	assert index.match('Chem Nat Compd', 'Chemistry of Natural Compounds')
+
+
+def test_index_is_built_from_previous_results(tmp_path):
+	results_path = str(tmp_path / 'raw_output.jsonl')
+	result = {'container-title': ['Chemistry of Natural Compounds'], 'short-container-title': ['Chem Nat Compd'],
+			  'reference_retrieved_from': 'Crossref', 'query_str_type': 'Crossref_extended_query'}
+	with open(results_path, 'w') as results:
+		results.write(json.dumps({'reference': 'Ivanov,Khim. Prir. Soedin.,26,(1990),400', 'result': result}) + '\n')
+		results.write(json.dumps({'reference': 'not resolved', 'result': None}) + '\n')
+	assert not journal_index().match('Khim. Prir. Soedin.', 'Chemistry of Natural Compounds')
+	index = build_journal_index(results_path)
+	assert index.match('Khim. Prir. Soedin.', 'Chemistry of Natural Compounds')
+	assert 'chemnatcompd' in index.canonical_titles
@@ -0,0 +1,48 @@
+import os
+import pytest
+import citation_normalisation as cn
+from local_index import local_index
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def no_network(backend, function, *args, **kwargs):
+	raise AssertionError('Request to {} although the local index is exclusive'.format(backend))
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+	index = local_index(str(tmp_path / 'index.sqlite'))
+	assert index.ingest_crossref_jsonl(os.path.join(FIXTURES, 'crossref_works.jsonl')) == 4
+	assert index.ingest_pubmed_xml(os.path.join(FIXTURES, 'pubmed_articles.xml')) == 2
+	monkeypatch.setattr(cn, 'call_backend', no_network)
+	monkeypatch.setattr(cn, 'RESPONSE_CACHE', None)
+	monkeypatch.setattr(cn, 'NEGATIVE_CACHE', None)
+	cn.set_local_index(index, exclusive=True)
+	yield index
+	cn.set_local_index(None)
+	index.close()
+
+
+def resolve(ref_str):
+	return cn.get_final_dict_from_ref_str(ref_str)[ref_str]
+
+
+@pytest.mark.parametrize('ref_str, DOI, PMID', [
+	('10.1021/ol502216j', '10.1021/ol502216j', None),
+	('20512739', '10.1080/03601231003800347', '20512739'),
+	('Haba,Phytochem.,68,(2007),1255', '10.1016/j.phytochem.2007.02.021', None),
+	('Mathews.,J. Biol. Chem.,241(21),(1966),5008', None, '5923450')])
+def test_references_are_resolved_offline(index, ref_str, DOI, PMID):
+	final_dict = resolve(ref_str)
+	assert final_dict['DOI'] == DOI
+	assert final_dict['PMID'] == PMID
+
+
+@pytest.mark.parametrize('ref_str', [
+	# Not in the index
+	'Peng J.-P.,Phytochem.,41,(1996),283-285',
+	# In the index, but without a first author it cannot be confirmed
+	'Phytochemistry_2003;64:285-291'])
+def test_unconfirmed_references_are_not_resolved(index, ref_str):
+	assert not cn.retrieve_info_MetaPub_Crossref(ref_str)
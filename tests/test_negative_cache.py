@@ -0,0 +1,77 @@
+import asyncio
+import requests
+import pytest
+from metapub.exceptions import MetaPubError
+import citation_normalisation as cn
+from backend_policy import CircuitOpenError
+from negative_cache import negative_cache
+
+
+class unreachable_fetcher:
+	'''PubMedFetcher stand-in whose requests never reach PubMed.'''
+	def article_by_doi(self, DOI):
+		raise requests.exceptions.ConnectionError('PubMed is down')
+
+	def article_by_pmid(self, PMID):
+		raise requests.exceptions.ConnectionError('PubMed is down')
+
+
+@pytest.fixture
+def failures(tmp_path, monkeypatch):
+	cache = negative_cache(str(tmp_path / 'negative_cache.sqlite'))
+	monkeypatch.setattr(cn, 'NEGATIVE_CACHE', cache)
+	monkeypatch.setattr(cn, 'RESPONSE_CACHE', None)
+	monkeypatch.setattr(cn, 'LOCAL_INDEX', None)
+	monkeypatch.setattr(cn.CLIENTS, 'pubmed_fetcher', lambda: unreachable_fetcher())
+	yield cache
+	cache.close()
+
+
+def open_circuit(backend, function, *args, **kwargs):
+	raise CircuitOpenError('The circuit breaker of {} is open'.format(backend))
+
+
+def unreachable_backend(backend, function, *args, **kwargs):
+	return function(*args, **kwargs)
+
+
+def unknown_DOI(backend, function, *args, **kwargs):
+	if backend == 'MetaPub':
+		raise MetaPubError('No PubMed article for this DOI')
+	# Crossref answers 404 (see crossref_request())
+	return None
+
+
+def test_outage_during_DOI_lookup_is_recorded_as_backend_error(failures, monkeypatch):
+	monkeypatch.setattr(cn, 'call_backend', open_circuit)
+	reference = 'doi: 10.1000/unreachable.1'
+	assert not cn.retrieve_info_MetaPub_Crossref(reference)
+	assert failures.get(reference)['reason'] == 'backend_error'
+
+
+def test_outage_during_PMID_lookup_is_recorded_as_backend_error(failures, monkeypatch):
+	monkeypatch.setattr(cn, 'call_backend', unreachable_backend)
+	monkeypatch.setattr(cn, 'crossref_candidate_search', lambda parsed_ref_dict: (None, 'no_candidates'))
+	reference = '12345678'
+	assert not cn.retrieve_info_MetaPub_Crossref(reference)
+	assert failures.get(reference)['reason'] == 'backend_error'
+
+
+def test_unknown_DOI_is_not_recorded_as_backend_error(failures, monkeypatch):
+	monkeypatch.setattr(cn, 'call_backend', unknown_DOI)
+	monkeypatch.setattr(cn, 'crossref_candidate_search', lambda parsed_ref_dict: (None, 'no_candidates'))
+	reference = 'doi: 10.1000/unknown.1'
+	assert not cn.retrieve_info_MetaPub_Crossref(reference)
+	assert failures.get(reference)['reason'] != 'backend_error'
+
+
+def test_outage_during_asynchronous_DOI_lookup_is_recorded_as_backend_error(failures, monkeypatch):
+	from async_resolution import resolution_engine
+	monkeypatch.setattr(cn, 'call_backend', open_circuit)
+	reference = 'doi: 10.1000/unreachable.2'
+
+	async def retrieve():
+		async with resolution_engine() as engine:
+			return await engine.retrieve(reference)
+	assert not asyncio.run(retrieve())
+	assert failures.get(reference)['reason'] == 'backend_error'
@@ -0,0 +1,20 @@
+import pytest
+from normalized_reference import normalized_reference
+
+
+@pytest.mark.parametrize('key', ['keys', 'get', 'to_dict', '__class__', 'unknown', 1])
+def test_only_fields_are_items(key):
+	ref = normalized_reference(journal='Phytochemistry')
+	with pytest.raises(KeyError):
+		ref[key]
+	assert ref.get(key) is None
+	assert key not in ref
+
+
+def test_unset_field_is_missing():
+	ref = normalized_reference(journal='Phytochemistry', issue=None)
+	assert ref['issue'] is None
+	with pytest.raises(KeyError):
+		ref['volume']
+	del ref['issue']
+	assert dict(ref) == {'journal': 'Phytochemistry'}
@@ -0,0 +1,53 @@
+import json
+import pytest
+from reference_map import compile_reference_map, reference_map, open_reference_map
+
+
+NEW_REFERENCES = {'Morvan-Bertrand,Physiol Plant,111,(2001),225': {'reference': 'Morvan-Bertrand et al., Physiologia Plantarum, 2001, 111 (2), 225',
+																   'DOI': '10.1034/j.1399-3054.2001.1110214.x', 'PMID': None},
+				  '20512739': {'reference': 'Sheu et al., J Environ Sci Health B, 2010, 45 (5), 478',
+							   'DOI': '10.1080/03601231003800347', 'PMID': '20512739'},
+				  'Żółć,Phytochem.,1,(2000),1': {'reference': 'Żółć, Phytochemistry, 2000, 1, 1', 'DOI': None, 'PMID': None}}
+
+
+@pytest.fixture
+def compiled_map_path(tmp_path):
+	path = str(tmp_path / 'reference_map.bin')
+	items = list(NEW_REFERENCES.items())
+	# The last entry of a duplicate key is used
+	items.insert(0, ('20512739', {'reference': 'outdated', 'DOI': None, 'PMID': None}))
+	assert compile_reference_map(items, path) == 3
+	return path
+
+
+def test_lookups_of_existing_references(compiled_map_path):
+	with reference_map(compiled_map_path) as references:
+		assert len(references) == 3
+		for old_ref, new_ref in NEW_REFERENCES.items():
+			assert old_ref in references
+			assert references[old_ref] == new_ref
+		assert sorted(references) == sorted(NEW_REFERENCES)
+
+
+@pytest.mark.parametrize('old_ref', ['', '1', '99999999', 'Morvan-Bertrand', 'Zzz', 20512739])
+def test_lookups_of_missing_references(compiled_map_path, old_ref):
+	with reference_map(compiled_map_path) as references:
+		assert old_ref not in references
+		assert references.get(old_ref) is None
+		with pytest.raises(KeyError):
+			references[old_ref]
+
+
+def test_uncompiled_maps_are_loaded_into_a_dict(tmp_path, compiled_map_path):
+	jsonl_path = tmp_path / 'reference_map.jsonl'
+	jsonl_path.write_text(''.join([json.dumps({old_ref: new_ref}) + '\n' for old_ref, new_ref in NEW_REFERENCES.items()]))
+	assert open_reference_map(str(jsonl_path)) == NEW_REFERENCES
+	with open_reference_map(compiled_map_path) as references:
+		assert isinstance(references, reference_map)
+
+
+def test_other_files_are_rejected(tmp_path):
+	path = tmp_path / 'not_a_map.bin'
+	path.write_bytes(b'0' * 32)
+	with pytest.raises(ValueError):
+		reference_map(str(path))
@@ -0,0 +1,34 @@
+import reference_parser as rp
+
+
+REFERENCES = ['El-Sayed,Phytochem.,30,(1991),2442',
+			  'Peng J.-P.,Phytochem.,41,(1996),283-285',
+			  'Ingham,Phytochem.,15,819769,1489',
+			  'Mathews.,J. Biol. Chem.,241(21),(1966),5008',
+			  'Phytochemistry_2003;64:285-291',
+			  'J_Nat_Prod_2015_78_(4):730-735',
+			  'not a reference',
+			  '20512739']
+
+
+def test_parse_many_keeps_the_input_order():
+	references = REFERENCES * 5
+	parser = rp.reference_parser()
+	expected = [parser(reference) for reference in references]
+	assert any(expected) and not all(expected)
+	assert rp.parse_many(references, workers=2, chunksize=3) == expected
+	assert rp.parse_many(references, workers=1) == expected
+
+
+def test_iter_parse_many_bounds_the_chunks_in_flight():
+	read_references = []
+
+	def references():
+		for index in range(200):
+			read_references.append(index)
+			yield REFERENCES[index % len(REFERENCES)]
+	parsed_reference_dicts = rp.iter_parse_many(references(), workers=2, chunksize=5)
+	next(parsed_reference_dicts)
+	# 2 chunks per worker
+	assert len(read_references) <= 2 * 2 * 5
+	assert len(list(parsed_reference_dicts)) == 199
@@ -0,0 +1,51 @@
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+from replace_COCONUT_references_based_on_json import replace_collection_references, read_progress
+
+
+REFERENCES = {'Ito,Chem. Pharm. Bull.,37,(1989),819': {'reference': 'Ito, Chemical and Pharmaceutical Bulletin, 1989, 37 (3), 819',
+													   'DOI': '10.1248/cpb.37.819',
+													   'PMID': None},
+			  '20512739': {'reference': 'Sheu, Journal of environmental science and health, 2010, 45 (5), 478-85',
+						   'DOI': '10.1080/03601231003800347',
+						   'PMID': '20512739'}}
+
+
+@pytest.fixture
+def collection():
+	collection = mongomock.MongoClient().COCONUT.uniqueNaturalProduct
+	collection.insert_many([
+		{'coconut_id': 'CNP0000001', 'citationDOI': "['Ito,Chem. Pharm. Bull.,37,(1989),819', 'unknown reference']"},
+		{'coconut_id': 'CNP0000002', 'citationDOI': ['unknown reference']},
+		{'coconut_id': 'CNP0000003', 'citationDOI': ['20512739']},
+		{'coconut_id': 'CNP0000004', 'citationDOI': None},
+		{'coconut_id': 'CNP0000005', 'citationDOI': ['Ito,Chem. Pharm. Bull.,37,(1989),819']}])
+	return collection
+
+
+def citations(collection, coconut_id):
+	return collection.find_one({'coconut_id': coconut_id})['citationDOI']
+
+
+def test_references_are_replaced_with_bulk_writes(collection, tmp_path):
+	progress_path = str(tmp_path / 'progress.txt')
+	statistics = replace_collection_references(collection, REFERENCES, batch_size=2, progress_path=progress_path)
+	assert statistics['processed'] == 5
+	assert statistics['updated'] == 3
+	assert statistics['skipped'] == 2
+	assert statistics['last_coconut_id'] == 'CNP0000005'
+	assert read_progress(progress_path) == 'CNP0000005'
+	assert citations(collection, 'CNP0000001') == ['Ito, Chemical and Pharmaceutical Bulletin, 1989, 37 (3), 819; 10.1248/cpb.37.819',
+												   'unknown reference']
+	assert citations(collection, 'CNP0000002') == ['unknown reference']
+	assert citations(collection, 'CNP0000003') == ['Sheu, Journal of environmental science and health, 2010, 45 (5), 478-85; '
+												   '10.1080/03601231003800347; 20512739']
+
+
+def test_replacement_resumes_after_the_last_coconut_id(collection, tmp_path):
+	statistics = replace_collection_references(collection, REFERENCES, batch_size=2, resume_after='CNP0000003')
+	assert statistics['processed'] == 2
+	assert statistics['updated'] == 1
+	assert citations(collection, 'CNP0000001') == "['Ito,Chem. Pharm. Bull.,37,(1989),819', 'unknown reference']"
+	assert citations(collection, 'CNP0000005') == ['Ito, Chemical and Pharmaceutical Bulletin, 1989, 37 (3), 819; 10.1248/cpb.37.819']
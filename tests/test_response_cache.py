@@ -0,0 +1,63 @@
+import time
+import pytest
+import citation_normalisation as cn
+from response_cache import response_cache
+
+
+class fake_clock:
+	'''time.time() stand-in that only moves when it is told to.'''
+	def __init__(self) -> None:
+		self.now = time.time()
+
+	def __call__(self) -> float:
+		return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = fake_clock()
+	monkeypatch.setattr(time, 'time', clock)
+	return clock
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+	with response_cache(str(tmp_path / 'cache.sqlite'), ttl=60) as cache:
+		cache.set('DOI', '10.1021/OL502216J', {'DOI': '10.1021/ol502216j'})
+		clock.now += 60
+		# DOIs are case-insensitive
+		assert cache.get('DOI', '10.1021/ol502216j') == {'DOI': '10.1021/ol502216j'}
+		clock.now += 1
+		assert cache.get('DOI', '10.1021/ol502216j') is None
+		assert len(cache) == 0
+		assert cache.statistics()['hits'] == 1 and cache.statistics()['misses'] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+	with response_cache(str(tmp_path / 'cache.sqlite'), max_entries=2) as cache:
+		cache.eviction_interval = 1
+		for PMID in ['1', '2']:
+			cache.set('PMID', PMID, {'pmid': PMID})
+			clock.now += 1
+		assert cache.get('PMID', '1')
+		clock.now += 1
+		cache.set('PMID', '3', {'pmid': '3'})
+		assert cache.get('PMID', '2') is None
+		assert cache.get('PMID', '1') and cache.get('PMID', '3')
+		assert cache.statistics()['evictions'] == 1
+
+
+def test_non_default_options_are_part_of_the_key(tmp_path, monkeypatch):
+	calls = []
+
+	@cn.cached_lookup('Test')
+	def lookup(query, rows=20, max_candidates=200):
+		calls.append((query, rows, max_candidates))
+		return {'query': query, 'max_candidates': max_candidates}
+	with response_cache(str(tmp_path / 'cache.sqlite')) as cache:
+		monkeypatch.setattr(cn, 'RESPONSE_CACHE', cache)
+		assert lookup('query')['max_candidates'] == 200
+		assert lookup('query', max_candidates=5)['max_candidates'] == 5
+		# Cached: explicit default values and repeated options do not send the lookup again
+		assert lookup('query', 20, 200)['max_candidates'] == 200
+		assert lookup('query', max_candidates=5)['max_candidates'] == 5
+	assert calls == [('query', 20, 200), ('query', 20, 5)]
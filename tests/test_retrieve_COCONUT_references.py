@@ -0,0 +1,75 @@
+import json
+import retrieve_COCONUT_references as rcr
+
+
+def test_keyword_based_dicts_are_selected_by_query_str_type(tmp_path):
+	filtered_dicts_path = str(tmp_path / 'retrieved_dicts_filtered.jsonl')
+	with open(filtered_dicts_path, 'w') as filtered_dicts:
+		for query_str_type in ['DOI', 'PMID', 'unstructured_ID', 'Crossref_extended_query']:
+			filtered_dicts.write(json.dumps({'query_str_type': query_str_type, 'query_str': query_str_type}) + '\n')
+	keyword_based_dicts = list(rcr.iter_keyword_based_dicts(filtered_dicts_path))
+	assert [retrieved_dict['query_str_type'] for retrieved_dict in keyword_based_dicts] == ['unstructured_ID', 'Crossref_extended_query']
+
+
+class fake_engine:
+	'''Resolves every reference without network access.'''
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, type, value, tb):
+		return None
+
+	async def retrieve_many(self, references):
+		for reference in references:
+			yield reference, {'reference': reference, 'reference_retrieved_from': 'Crossref'}
+
+
+def test_incremental_run_counts_only_this_runs_results_after_restart(tmp_path, monkeypatch, capsys):
+	references_csv_path = str(tmp_path / 'COCONUT_references.csv')
+	with open(references_csv_path, 'w') as references_csv:
+		references_csv.write('coconut_id,citationDOI\n')
+		references_csv.write('CNP0000001,"[\'ref 1\', \'ref 2\']"\n')
+		references_csv.write('CNP0000002,"[\'ref 3\']"\n')
+	output_path = str(tmp_path / 'raw_output.jsonl')
+	# An interrupted incremental run has already written two results
+	with open(str(tmp_path / 'raw_output.incremental.jsonl'), 'w') as incremental_output:
+		for reference in ['ref 1', 'ref 2']:
+			incremental_output.write(json.dumps({'reference': reference, 'result': {'reference': reference}}) + '\n')
+	monkeypatch.setattr(rcr.ar, 'resolution_engine', fake_engine)
+	rcr.incremental_retrieval_coordination(references_csv_path, output_path, str(tmp_path / 'manifest.sqlite'))
+	assert 'Resolved 1 references.' in capsys.readouterr().out
+	with open(output_path) as output:
+		assert len(output.readlines()) == 3
+
+
+def test_interrupted_former_run_is_resumed(tmp_path, monkeypatch, capsys):
+	legacy_output_path = str(tmp_path / 'raw_output.tsv')
+	with open(legacy_output_path, 'w') as legacy_output:
+		legacy_output.write("Haba,Phytochemistry,68,(2007),1255\t{'DOI': '10.1016/j.phytochem.2007.02.021', 'reference_retrieved_from': 'Crossref'}\n")
+		# MetaPub results of the former retrieval contain object reprs
+		legacy_output.write("20512739\t{'pmid': '20512739', 'xml': <Element PubmedArticle at 0x7f>, 'reference_retrieved_from': 'MetaPub'}\n")
+	output_path = str(tmp_path / 'raw_output.jsonl')
+	monkeypatch.setitem(rcr.LEGACY_RAW_OUTPUT_PATHS, output_path, legacy_output_path)
+	with rcr.open_checkpoint_store(output_path) as checkpoint:
+		assert 'Haba,Phytochemistry,68,(2007),1255' in checkpoint
+		assert '20512739' not in checkpoint
+	assert 'Skipped 1 lines' in capsys.readouterr().err
+	# The migration is only done once per result
+	with rcr.open_checkpoint_store(output_path) as checkpoint:
+		assert len(checkpoint) == 1
+
+
+def test_incremental_run_on_former_tsv_results_writes_jsonl(tmp_path, monkeypatch):
+	references_csv_path = str(tmp_path / 'COCONUT_references.csv')
+	with open(references_csv_path, 'w') as references_csv:
+		references_csv.write('coconut_id,citationDOI\n')
+		references_csv.write('CNP0000001,"[\'ref 1\', \'ref 2\']"\n')
+	previous_output_path = str(tmp_path / 'raw_output.tsv')
+	with open(previous_output_path, 'w') as previous_output:
+		previous_output.write("ref 1\t{'reference': 'ref 1', 'reference_retrieved_from': 'Crossref'}\n")
+	monkeypatch.setattr(rcr.ar, 'resolution_engine', fake_engine)
+	rcr.incremental_retrieval_coordination(references_csv_path, previous_output_path, str(tmp_path / 'manifest.sqlite'))
+	# The former results are left as they are
+	with open(previous_output_path) as previous_output:
+		assert len(previous_output.readlines()) == 1
+	assert dict(rcr.iter_raw_results(str(tmp_path / 'raw_output.jsonl'))).keys() == {'ref 1', 'ref 2'}
@@ -0,0 +1,98 @@
+import time
+import asyncio
+import threading
+from single_flight import single_flight
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+	deadline = time.monotonic() + timeout
+	while not condition():
+		assert time.monotonic() < deadline, 'Timed out'
+		time.sleep(0.001)
+
+
+def test_concurrent_duplicate_calls_run_once():
+	flight = single_flight()
+	release = threading.Event()
+	calls = []
+
+	def lookup(DOI):
+		calls.append(DOI)
+		release.wait()
+		return {'DOI': DOI, 'authors': ['Haba, H.']}
+	results = []
+
+	def caller():
+		results.append(flight.do('DOI', '10.1016/j.phytochem.2007.02.021', lookup, '10.1016/j.phytochem.2007.02.021'))
+	threads = [threading.Thread(target=caller) for _ in range(5)]
+	threads[0].start()
+	wait_for(lambda: calls)
+	for thread in threads[1:]:
+		thread.start()
+	wait_for(lambda: flight.statistics()['DOI']['coalesced'] == 4)
+	release.set()
+	for thread in threads:
+		thread.join()
+	assert len(calls) == 1
+	assert flight.statistics() == {'DOI': {'calls': 5, 'executions': 1, 'coalesced': 4}}
+	# Every caller gets its own copy
+	assert len(set([id(result) for result in results])) == 5
+	results[0]['authors'].append('Doe, J.')
+	assert all([result['authors'] == ['Haba, H.'] for result in results[1:]])
+	# The key is free again once the call has finished
+	flight.do('DOI', '10.1016/j.phytochem.2007.02.021', lookup, '10.1016/j.phytochem.2007.02.021')
+	assert len(calls) == 2
+
+
+def test_waiters_get_the_error_of_the_call():
+	flight = single_flight()
+	release = threading.Event()
+	started = threading.Event()
+
+	def lookup():
+		started.set()
+		release.wait()
+		raise ValueError('Unexpected record')
+	errors = []
+
+	def caller():
+		try:
+			flight.do('PMID', '20512739', lookup)
+		except ValueError as error:
+			errors.append(error)
+	threads = [threading.Thread(target=caller) for _ in range(3)]
+	threads[0].start()
+	started.wait()
+	for thread in threads[1:]:
+		thread.start()
+	wait_for(lambda: flight.statistics()['PMID']['coalesced'] == 2)
+	release.set()
+	for thread in threads:
+		thread.join()
+	assert len(errors) == 3
+
+
+def test_concurrent_duplicate_coroutines_run_once():
+	flight = single_flight()
+	calls = []
+
+	async def lookup(query):
+		calls.append(query)
+		await asyncio.sleep(0.01)
+		return {'query': query, 'items': []}
+
+	async def lookup_all():
+		return await asyncio.gather(*[flight.do_async('Crossref', 'query', lookup, 'query') for _ in range(4)])
+	results = asyncio.run(lookup_all())
+	assert calls == ['query']
+	assert flight.statistics()['Crossref'] == {'calls': 4, 'executions': 1, 'coalesced': 3}
+	results[1]['items'].append('entry')
+	assert [result['items'] for result in results] == [[], ['entry'], [], []]
+
+
+def test_different_keys_are_not_coalesced():
+	flight = single_flight()
+	assert [flight.do('DOI', DOI, str.upper, DOI) for DOI in ['a', 'b']] == ['A', 'B']
+	assert flight.statistics()['DOI']['executions'] == 2
+	flight.reset_statistics()
+	assert flight.statistics() == {}